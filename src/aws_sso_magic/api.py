@@ -0,0 +1,307 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""In-process API of aws-sso-magic.
+
+The commands print their errors and exit, the methods of SsoMagic return data and
+raise AwsSsoMagicError (or one of its subclasses) instead, so a long running service
+can call them directly. An SsoMagic object keeps the botocore session, the clients
+and the token and credentials caches between calls, and it is safe to share it
+between threads: every thread writes the config files through its own transaction
+and the methods that write them take turns. The logging isn't configured, the
+records of the aws_sso_magic loggers go to the handlers of the program.
+
+Example:
+
+    from aws_sso_magic.api import SsoMagic, LoginRequired
+
+    magic = SsoMagic()
+    profiles = list(magic.discover("my-sso", regions=["us-east-1"]))
+    magic.write_profiles(profiles)
+    credentials = magic.get_credentials(profiles[0].profile_name)
+"""
+
+import configparser
+import os
+import threading
+
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from .concurrency import client_limiter, concurrency_stats
+from .transaction import config_transaction
+from .utils import get_sso_session_names, _read_section_configuration, _get_indexed_section, _get_endpoint_url, _add_prefix
+from .utils import _get_role_name, _replace_config_file
+from .utils import (
+    AWS_CONFIG_PATH,
+    AWS_CREDENTIAL_PATH,
+    AWS_DEFAULT_REGION,
+    AWS_SSO_CONFIG_PATH,
+    AWS_SSO_DEFAULT_PROXY_ROLE_KEY,
+    AWS_SSO_DEFAULT_PROXY_ROLE_SECTION
+)
+
+# Same fields as the profiles generated by the login command
+Profile = namedtuple("Profile", ["profile_name", "account_name", "account_id", "role_name", "region", "sso_start_url", "sso_region"])
+Credentials = namedtuple("Credentials", ["access_key_id", "secret_access_key", "session_token", "expiration"])
+
+CREDENTIALS_MIN_VALID = timedelta(minutes=15)
+TOKEN_MIN_VALID = timedelta(minutes=15)
+
+# Held by the methods that write the aws config, credentials and kubeconfig files
+_WRITE_LOCK = threading.Lock()
+
+class AwsSsoMagicError(Exception):
+    pass
+
+class SsoSessionNotFound(AwsSsoMagicError):
+    pass
+
+class ProfileNotFound(AwsSsoMagicError):
+    pass
+
+class LoginRequired(AwsSsoMagicError):
+    """There is no valid cached AWS SSO login for the start URL, log in with
+    SsoMagic.get_token(..., login=True) or the aws-sso-magic login command."""
+    pass
+
+def _api_errors():
+    import botocore.exceptions
+    return (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError)
+
+def _config_errors():
+    return (configparser.Error, OSError, KeyError, ValueError)
+
+def _proxy_role_name(profile_name):
+    role_name = _get_role_name(profile_name)
+    if not role_name:
+        raise AwsSsoMagicError(f"No proxy role for {profile_name}, add the [{AWS_SSO_DEFAULT_PROXY_ROLE_SECTION}] section with the {AWS_SSO_DEFAULT_PROXY_ROLE_KEY} key to {AWS_SSO_CONFIG_PATH}")
+    return role_name
+
+def _to_credentials(role_credentials):
+    return Credentials(
+        role_credentials["accessKeyId"],
+        role_credentials["secretAccessKey"],
+        role_credentials["sessionToken"],
+        datetime.fromtimestamp(role_credentials["expiration"] / 1000.0, timezone.utc))
+
+class SsoMagic:
+    def __init__(self, botocore_session=None):
+        from botocore.session import Session
+        self._session = botocore_session or Session()
+        self._clients = {}
+        self._boto3_sessions = {}
+        self._lock = threading.Lock()
+
+    def _sso_client(self, instance):
+        from .login import _get_sso_client
+        with self._lock:
+            if instance.region not in self._clients:
+                self._clients[instance.region] = _get_sso_client(instance, self._session)
+            return self._clients[instance.region]
+
+    def _boto3_session(self, profile_name):
+        import boto3
+        from .materialize import materialize_profile
+        # The proxy role of a profile left out by the materialize policy
+        _proxy_role_name(profile_name)
+        with _WRITE_LOCK:
+            try:
+                with config_transaction(write_file=_replace_config_file):
+                    materialize_profile(profile_name)
+            except _config_errors() as e:
+                raise AwsSsoMagicError(f"Unable to write the profile {profile_name} to {AWS_CREDENTIAL_PATH}: {e}") from e
+        # A new session once the credentials file changes, the old one would keep the old source credentials
+        try:
+            key = (profile_name, os.stat(AWS_CREDENTIAL_PATH).st_mtime_ns)
+        except FileNotFoundError:
+            key = (profile_name, None)
+        with self._lock:
+            if key not in self._boto3_sessions:
+                self._boto3_sessions = {k: v for k, v in self._boto3_sessions.items() if k[0] != profile_name}
+                self._boto3_sessions[key] = boto3.session.Session(profile_name=profile_name)
+            return self._boto3_sessions[key]
+
+    def sso_sessions(self):
+        """The names of the sso-sessions of the aws config file."""
+        return get_sso_session_names()
+
+    def get_sso_instance(self, sso_session):
+        from aws_sso_lib.config import SSOInstance
+        values = _read_section_configuration(AWS_CONFIG_PATH, f"sso-session {sso_session}")
+        if not values.get("sso_start_url") or not values.get("sso_region"):
+            raise SsoSessionNotFound(f"The sso-session {sso_session} was not found on {AWS_CONFIG_PATH}")
+        return SSOInstance(values["sso_start_url"], values["sso_region"], "api", "api")
+
+    def get_token(self, sso_session, login=False):
+        """Return the cached AWS SSO token of an sso-session.
+
+        Without a valid token it raises LoginRequired, with login=True it runs the
+        device authorization instead, which waits for the user to approve it."""
+        from .token_cache import get_token_cache
+        instance = self.get_sso_instance(sso_session)
+        token_cache = get_token_cache()
+        lookup = dict(start_url=instance.start_url, session_name=sso_session, region=instance.region, min_valid=TOKEN_MIN_VALID)
+        cached_token = token_cache.lookup(**lookup)
+        if cached_token is None:
+            # Another process may have logged in since the cache was scanned
+            token_cache.scan()
+            cached_token = token_cache.lookup(**lookup)
+        if cached_token is not None:
+            return cached_token.data
+        if not login:
+            raise LoginRequired(f"No valid AWS SSO login for {instance.start_url}")
+        from .locks import LockTimeout
+        from .login import _get_token
+        try:
+            return _get_token(self._session, instance, sso_session, False)
+        except _api_errors() as e:
+            raise AwsSsoMagicError(f"Unable to log in to {instance.start_url}: {e}") from e
+        except LockTimeout as e:
+            raise AwsSsoMagicError(f"Unable to log in to {instance.start_url}, another process is still logging in: {e}") from e
+
+    def discover(self, sso_session, regions=None, account_filter=(), role_filter=(), safe_account_names=True):
+        """Yield a Profile for every account, role and region of an sso-session.
+
+        The profiles are named like the login command does by default, with the
+        aliases of the aws-sso-magic config file applied."""
+        from .filters import get_discovery_filter
+        from .login import _iter_accounts, _iter_account_configs, _get_default_profile_name_formatter
+        instance = self.get_sso_instance(sso_session)
+        token = self.get_token(sso_session)
+        try:
+            discovery_filter = get_discovery_filter(sso_session, account_filter, role_filter)
+        except ValueError as e:
+            raise AwsSsoMagicError(str(e)) from e
+        client = self._sso_client(instance)
+        account_configs = _iter_account_configs(
+            client,
+            token,
+            _iter_accounts(client, token),
+            instance,
+            list(regions or [AWS_DEFAULT_REGION]),
+            _get_default_profile_name_formatter(),
+            safe_account_names,
+            discovery_filter=discovery_filter)
+        try:
+            for account, configs in account_configs:
+                for config in configs:
+                    yield Profile(*config.to_tuple()[:len(Profile._fields)])
+        except _api_errors() as e:
+            raise AwsSsoMagicError(f"Unable to list the accounts and roles of {sso_session}: {e}") from e
+
+    def write_profiles(self, profiles, config_default=None, existing_config_action="keep"):
+        """Write the profiles to the aws config and credentials files like the login
+        command, each file is written once. Returns the number of profiles written."""
+        from .login import ConfigParams, _sorted_configs, _write_configs
+        from .utils import _create_credentials_profile, _record_generated_sections
+        from aws_sso_lib.config_file_writer import get_config_filename
+        sections = []
+        # The proxy role is checked before anything is written
+        configs = [ConfigParams(*profile[:len(Profile._fields)], proxy_role_name=_proxy_role_name(profile[0])) for profile in profiles]
+        with _WRITE_LOCK:
+            try:
+                # The files are written by the API itself, their errors are raised instead of exiting
+                with config_transaction(write_file=_replace_config_file):
+                    configs = _write_configs(self._session, _sorted_configs(configs), dict(config_default or {}), existing_config_action, sections)
+                    _create_credentials_profile(configs)
+                    _record_generated_sections(get_config_filename(self._session), sections)
+            except _config_errors() as e:
+                raise AwsSsoMagicError(f"Unable to write the profiles: {e}") from e
+        return len(sections)
+
+    def get_credentials(self, profile_name, use_cache=True):
+        """Return the role Credentials of a generated profile, the aws config and
+        credentials files are not written.
+
+        Cached credentials valid for more than 15 minutes are reused unless use_cache is
+        False, the credentials fetched are put on the credentials cache of aws-sso-magic
+        ($HOME/.aws-sso-magic/cache/credentials) shared with the commands."""
+        from .credentials_cache import get_credentials_cache
+        from .token_cache import get_token_cache
+        profile = _get_indexed_section(AWS_CONFIG_PATH, _add_prefix(profile_name))
+        if profile is None or not profile.get("sso_account_id") or not profile.get("sso_role_name"):
+            raise ProfileNotFound(f"The profile {profile_name} was not found on {AWS_CONFIG_PATH}")
+        account_id = profile["sso_account_id"]
+        role_name = profile["sso_role_name"]
+        start_url = profile.get("sso_start_url")
+        cache = get_credentials_cache()
+        if use_cache:
+            cached = cache.get(account_id, role_name, start_url, min_valid=CREDENTIALS_MIN_VALID)
+            if cached:
+                return _to_credentials(cached)
+
+        token_cache = get_token_cache()
+        lookup = dict(start_url=start_url, session_name=profile.get("sso_session"), region=profile.get("sso_region"), min_valid=timedelta(0))
+        token = token_cache.lookup(**lookup)
+        if token is None:
+            token_cache.scan()
+            token = token_cache.lookup(**lookup)
+        if token is None:
+            raise LoginRequired(f"No valid AWS SSO login for {start_url}")
+
+        from aws_sso_lib.config import SSOInstance
+        client = self._sso_client(SSOInstance(start_url, profile["sso_region"], "api", "api"))
+        try:
+            with client_limiter(client).slot():
+                response = client.get_role_credentials(roleName=role_name, accountId=account_id, accessToken=token.data["accessToken"])
+        except _api_errors() as e:
+            raise AwsSsoMagicError(f"Unable to get the credentials of {profile_name}: {e}") from e
+        try:
+            cache.put(account_id, role_name, start_url, response["roleCredentials"])
+        except OSError as e:
+            raise AwsSsoMagicError(f"Unable to write the credentials of {profile_name} to the credentials cache: {e}") from e
+        return _to_credentials(response["roleCredentials"])
+
+    def concurrency_stats(self):
+        """The stats of the adaptive concurrency limit of every service and region called."""
+        return concurrency_stats()
+
+    def list_clusters(self, profile_name, region=None):
+        """The EKS clusters visible with a profile (through its proxy role)."""
+        session = self._boto3_session(profile_name)
+        client = session.client("eks", region_name=region or session.region_name or AWS_DEFAULT_REGION, endpoint_url=_get_endpoint_url("eks"))
+        clusters = []
+        list_clusters_args = {}
+        limiter = client_limiter(client)
+        try:
+            while True:
+                with limiter.slot():
+                    response = client.list_clusters(**list_clusters_args)
+                clusters.extend(response["clusters"])
+                if not response.get("nextToken"):
+                    return clusters
+                list_clusters_args["nextToken"] = response["nextToken"]
+        except _api_errors() as e:
+            raise AwsSsoMagicError(f"Unable to list the EKS clusters with {profile_name}: {e}") from e
+
+    def update_kubeconfig(self, profile_name, cluster_name, region=None):
+        """Add or update the kubeconfig context of a cluster, its token is got with the profile.
+
+        Returns the context name (the cluster arn)."""
+        import yaml
+        from .eks import _eks_write_kubeconfig
+        session = self._boto3_session(profile_name)
+        region = region or session.region_name or AWS_DEFAULT_REGION
+        client = session.client("eks", region_name=region, endpoint_url=_get_endpoint_url("eks"))
+        try:
+            with client_limiter(client).slot():
+                cluster = client.describe_cluster(name=cluster_name)["cluster"]
+        except _api_errors() as e:
+            raise AwsSsoMagicError(f"Unable to describe the EKS cluster {cluster_name} with {profile_name}: {e}") from e
+        with _WRITE_LOCK:
+            try:
+                _eks_write_kubeconfig(cluster, region, profile_name)
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                raise AwsSsoMagicError(f"Unable to write the kubeconfig context of {cluster_name}: {e}") from e
+        return cluster["arn"]
@@ -0,0 +1,128 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from pathlib import Path
+
+from .utils import AWS_SSO_DIR
+
+LOGGER = logging.getLogger(__name__)
+
+AWS_SSO_CHECKPOINTS_PATH = f'{Path.home()}/{AWS_SSO_DIR}/checkpoints'
+CHECKPOINT_VERSION = 1
+
+class DiscoveryJournal:
+    """Append-only journal of the accounts and roles discovered on an SSO instance.
+
+    Every ListAccounts page is recorded with its next token and every account with
+    its roles once they are all listed, so an interrupted discovery can be resumed
+    without repeating those calls. The raw accounts and roles are recorded, not the
+    profiles, so the profile name options may change between runs.
+    """
+    def __init__(self, start_url, region, checkpoints_dir=AWS_SSO_CHECKPOINTS_PATH):
+        self.start_url = start_url
+        self.region = region
+        key = "|".join([start_url, region])
+        self.path = os.path.join(checkpoints_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".jsonl")
+        self.accounts = []
+        self.next_token = None
+        self.accounts_complete = False
+        self.roles = {}
+        self._file = None
+        # The roles of several accounts are listed at the same time
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_instance(cls, instance):
+        return cls(instance.start_url, instance.region)
+
+    def load(self):
+        """Read the journal left by a previous run, a truncated last record is dropped."""
+        self.accounts = []
+        self.next_token = None
+        self.accounts_complete = False
+        self.roles = {}
+        valid_size = 0
+        try:
+            with open(self.path, "rb") as context:
+                lines = context.readlines()
+        except FileNotFoundError:
+            return self.reset()
+        for i, line in enumerate(lines):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("missing end of line")
+                record = json.loads(line)
+            except ValueError:
+                LOGGER.debug(f"Truncated record on {self.path}, ignoring the rest of the journal")
+                break
+            if i == 0 and (record.get("type") != "start" or record.get("version") != CHECKPOINT_VERSION or record.get("start_url") != self.start_url):
+                LOGGER.debug(f"Ignoring the journal {self.path}, it belongs to another version or instance")
+                return self.reset()
+            if record.get("type") == "accounts":
+                self.accounts.extend(record["accounts"])
+                self.next_token = record.get("next_token")
+                self.accounts_complete = not self.next_token
+            elif record.get("type") == "roles":
+                self.roles[record["account_id"]] = record["roles"]
+            valid_size += len(line)
+        if valid_size == 0:
+            return self.reset()
+        # New records are appended after the last valid one
+        self._file = open(self.path, "a")
+        self._file.truncate(valid_size)
+        return self
+
+    def reset(self):
+        self.close()
+        self.accounts = []
+        self.next_token = None
+        self.accounts_complete = False
+        self.roles = {}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "w")
+        self._append({"type": "start", "version": CHECKPOINT_VERSION, "start_url": self.start_url, "region": self.region})
+        return self
+
+    def _append(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "a")
+            self._file.write(line)
+            # Flushed on every record, so a Ctrl-C or a crash loses at most the record being written
+            self._file.flush()
+
+    def record_accounts(self, accounts, next_token):
+        self._append({"type": "accounts", "accounts": accounts, "next_token": next_token})
+
+    def record_roles(self, account_id, roles):
+        self._append({"type": "roles", "account_id": account_id, "roles": roles})
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -12,32 +12,63 @@
 # language governing permissions and limitations under the License.
 
 import click
+import importlib
 
 from . import __version__
+from .concurrency import log_concurrency_stats
+from .locks import LockTimeout
+from .transaction import config_transaction
+from .utils import set_log_format, _print_error, LOG_FORMATS, LOG_FORMAT_ENV_VAR
 
-from .configure import configure
-from .login import login
-from .logout import logout
+# The commands are imported when they are invoked, so the quick ones (e.g. use)
+# don't pay for the imports of boto3 and the interactive prompts
+COMMANDS = {
+    "configure": "configure:configure",
+    "doctor": "doctor:doctor",
+    "eks-login": "eks_login:eks_login",
+    "exec": "exec_profiles:exec_profiles",
+    "gc": "garbage_collect:gc",
+    "list": "list_profiles:list_profiles",
+    "login": "login:login",
+    "logout": "logout:logout",
+    "use": "use:use",
+}
 
-@click.group(name="aws-sso-magic")
+class LazyGroup(click.Group):
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(COMMANDS))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in COMMANDS and cmd_name not in self.commands:
+            module_name, attribute = COMMANDS[cmd_name].split(":")
+            module = importlib.import_module(f".{module_name}", __package__)
+            self.add_command(getattr(module, attribute), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def invoke(self, ctx):
+        # The config files are written once, when the command finishes
+        with config_transaction():
+            try:
+                return super().invoke(ctx)
+            except LockTimeout as e:
+                _print_error(f"\nERROR: {e}, another aws-sso-magic process is still logging in. Try again once it finishes")
+            finally:
+                log_concurrency_stats()
+
+@click.group(name="aws-sso-magic", cls=LazyGroup)
 @click.version_option(version=__version__, message='%(version)s')
+@click.option("--log-format", type=click.Choice(LOG_FORMATS), default="text", envvar=LOG_FORMAT_ENV_VAR, help="Print the logs as text or as one JSON object per line, with per-phase timings")
 
-def cli():
-    pass
+def cli(log_format):
+    set_log_format(log_format)
 
 # @cli.group()
 # def login():
 #     """Commands to log-in on aws sso."""
 #     pass
 
-# menu options
-cli.add_command(configure)
-cli.add_command(login)
-cli.add_command(logout)
-
 _list_commands = cli.list_commands
 def list_commands(ctx):
     return [c for c in _list_commands(ctx) if c != "credential-process"]
 
 cli.list_commands = list_commands
-
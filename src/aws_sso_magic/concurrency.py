@@ -0,0 +1,199 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from collections import deque
+
+from .utils import configure_logging, _get_log_format
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MAX_LIMIT = 16
+MAX_CONCURRENCY_ENV_VAR = "AWS_SSO_MAGIC_MAX_CONCURRENCY"
+# The limit stops growing while the latency is above this many times the lowest one seen
+LATENCY_FACTOR = 3.0
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "SlowDown",
+}
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+_CURRENT_CALL = threading.local()
+
+class AdaptiveLimiter:
+    """AIMD limit of the calls in flight to a service in a region, shared by every thread.
+
+    A call that isn't throttled raises the limit by 1/limit, so it grows by one per round
+    of calls, and a throttled one halves it. The calls in flight when the limit was halved
+    were sent with the old limit, their throttles don't halve it again. The limit doesn't
+    grow while the latency is above LATENCY_FACTOR times the lowest one seen.
+    """
+    def __init__(self, service, region, initial=DEFAULT_INITIAL_LIMIT, minimum=1, maximum=DEFAULT_MAX_LIMIT):
+        self.service = service
+        self.region = region
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        self._epoch = 0
+        self._stats = {
+            "calls": 0,
+            "throttled": 0,
+            "decreases": 0,
+            "max_in_flight": 0,
+            "lowest_limit": self.limit,
+            "highest_limit": self.limit,
+            "wait_ms": 0.0,
+            "min_latency_ms": None,
+            "total_latency_ms": 0.0,
+        }
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Wait until the call fits within the limit, the block is timed as the call latency."""
+        waiting = time.monotonic()
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self.in_flight)
+            self._stats["wait_ms"] += (time.monotonic() - waiting) * 1000
+            call = {"limiter": self, "epoch": self._epoch, "throttled": False}
+        previous = getattr(_CURRENT_CALL, "call", None)
+        _CURRENT_CALL.call = call
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            _CURRENT_CALL.call = previous
+            self._release(call, (time.monotonic() - started) * 1000)
+
+    def _release(self, call, latency_ms):
+        with self._condition:
+            self.in_flight -= 1
+            stats = self._stats
+            stats["calls"] += 1
+            stats["total_latency_ms"] += latency_ms
+            if not call["throttled"]:
+                if stats["min_latency_ms"] is None or latency_ms < stats["min_latency_ms"]:
+                    stats["min_latency_ms"] = latency_ms
+                if latency_ms <= LATENCY_FACTOR * max(stats["min_latency_ms"], 1.0):
+                    self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                    stats["highest_limit"] = max(stats["highest_limit"], self.limit)
+            self._condition.notify_all()
+
+    def on_throttle(self):
+        """A throttled response of the call running on this thread (every retry counts)."""
+        call = getattr(_CURRENT_CALL, "call", None)
+        with self._condition:
+            self._stats["throttled"] += 1
+            if call is not None and call["limiter"] is self:
+                call["throttled"] = True
+                if call["epoch"] != self._epoch:
+                    return
+            self.limit = max(float(self.minimum), self.limit / 2)
+            self._epoch += 1
+            self._stats["decreases"] += 1
+            self._stats["lowest_limit"] = min(self._stats["lowest_limit"], self.limit)
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            calls = stats.pop("calls")
+            total_latency_ms = stats.pop("total_latency_ms")
+            stats.update({
+                "service": self.service,
+                "region": self.region,
+                "calls": calls,
+                "limit": round(self.limit, 2),
+                "lowest_limit": round(stats["lowest_limit"], 2),
+                "highest_limit": round(stats["highest_limit"], 2),
+                "wait_ms": round(stats["wait_ms"], 1),
+                "min_latency_ms": round(stats["min_latency_ms"], 1) if stats["min_latency_ms"] is not None else None,
+                "avg_latency_ms": round(total_latency_ms / calls, 1) if calls else None,
+            })
+            return stats
+
+def _max_limit():
+    try:
+        return int(os.environ.get(MAX_CONCURRENCY_ENV_VAR) or DEFAULT_MAX_LIMIT)
+    except ValueError:
+        LOGGER.warning(f"Ignoring the invalid {MAX_CONCURRENCY_ENV_VAR} {os.environ[MAX_CONCURRENCY_ENV_VAR]}")
+        return DEFAULT_MAX_LIMIT
+
+def get_limiter(service, region):
+    with _LIMITERS_LOCK:
+        key = (service, region)
+        if key not in _LIMITERS:
+            maximum = _max_limit()
+            _LIMITERS[key] = AdaptiveLimiter(service, region, initial=min(DEFAULT_INITIAL_LIMIT, maximum), maximum=maximum)
+        return _LIMITERS[key]
+
+def _on_needs_retry(limiter, response=None, **kwargs):
+    # Called after every attempt, the retries of botocore stay as they are
+    if response is None or response[1] is None:
+        return None
+    if response[1].get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+        limiter.on_throttle()
+    return None
+
+def client_limiter(client):
+    """The limiter of the service and region of a botocore client, the client reports
+    its throttled responses to it."""
+    limiter = get_limiter(client.meta.service_model.service_name, client.meta.region_name)
+    client.meta.events.register(
+        "needs-retry",
+        lambda **kwargs: _on_needs_retry(limiter, **kwargs),
+        unique_id=f"aws-sso-magic-limiter-{id(client)}")
+    return limiter
+
+def limited_map(function, items, workers):
+    """Like map, running function on up to workers threads while keeping the order of the
+    results. The items are read as the results are consumed, at most 2 * workers ahead, so
+    a long generator is streamed. The calls to AWS inside function are meant to be limited
+    with a limiter slot, workers is only the upper bound."""
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def concurrency_stats():
+    with _LIMITERS_LOCK:
+        limiters = list(_LIMITERS.values())
+    return [stats for stats in (limiter.stats() for limiter in limiters) if stats["calls"]]
+
+def log_concurrency_stats():
+    """Log the stats of every limiter used, on the json log format they are records of the concurrency phase."""
+    configure_logging(LOGGER, False)
+    level = logging.INFO if _get_log_format() == "json" else logging.DEBUG
+    for stats in concurrency_stats():
+        LOGGER.log(level, "Concurrency of {service} in {region}: {calls} calls, {throttled} throttled, limit {limit} (lowest {lowest_limit}, highest {highest_limit})".format(**stats),
+                   extra=dict(stats, phase="concurrency"))
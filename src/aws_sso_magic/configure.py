@@ -18,32 +18,137 @@ import sys
 
 from pathlib import Path
 from .utils import _check_aws_v2, configure_logging, _create_tool_directory, _create_aws_sso_conf_file
+from .utils import _read_config, _write_config
 from .utils import (
+    AWS_CONFIG_PATH,
     AWS_SSO_CONFIG_PATH,
-    AWS_SSO_DIR
+    AWS_SSO_DIR,
+    AWS_SSO_DEFAULT_PROXY_ROLE_SECTION,
+    AWS_SSO_DEFAULT_PROXY_ROLE_KEY,
+    AWS_SSO_EKS_ROLE_NAME_DEFAULT,
+    AWS_DEFAULT_PROFILE,
+    AWS_DEFAULT_REGION
 )
 
 LOGGER = logging.getLogger(__name__)
 
+DEFAULT_REGISTRATION_SCOPES = "sso:account:access"
+DEFAULT_OUTPUT = "json"
+CONFIGURE_FILE_KEYS = [
+    "sso_session",
+    "sso_start_url",
+    "sso_region",
+    "sso_registration_scopes",
+    "account_id",
+    "role_name",
+    "region",
+    "output",
+    "profile",
+    "proxy_role_name",
+]
+
+def _load_configure_file(path):
+    import yaml
+    try:
+        with open(path) as context:
+            values = yaml.safe_load(context) or {}
+    except (OSError, yaml.YAMLError) as e:
+        raise click.UsageError(f"Unable to read the configure file {path}: {e}")
+    if not isinstance(values, dict):
+        raise click.UsageError(f"The configure file {path} must contain a mapping")
+    unknown = [k for k in values if k not in CONFIGURE_FILE_KEYS]
+    if unknown:
+        raise click.UsageError("Unknown keys on the configure file {}: {}".format(path, ", ".join(unknown)))
+    return {k: str(v) for k, v in values.items() if v is not None}
+
+def _configure_non_interactive(values):
+    missing = [k for k in ["sso_session", "sso_start_url", "sso_region"] if not values.get(k)]
+    if missing:
+        raise click.UsageError("Missing arguments: {}".format(", ".join("--" + k.replace("_", "-") for k in missing)))
+
+    sso_session = values["sso_session"]
+    profile_name = values.get("profile") or sso_session
+    profile_section = profile_name if profile_name == AWS_DEFAULT_PROFILE else f"profile {profile_name}"
+    session_section = f"sso-session {sso_session}"
+
+    _create_tool_directory(Path.home(), ".aws")
+    config = _read_config(AWS_CONFIG_PATH)
+
+    if config.has_section(session_section):
+        config.remove_section(session_section)
+    config.add_section(session_section)
+    config.set(session_section, "sso_start_url", values["sso_start_url"])
+    config.set(session_section, "sso_region", values["sso_region"])
+    config.set(session_section, "sso_registration_scopes", values.get("sso_registration_scopes") or DEFAULT_REGISTRATION_SCOPES)
+
+    if config.has_section(profile_section):
+        config.remove_section(profile_section)
+    config.add_section(profile_section)
+    config.set(profile_section, "sso_session", sso_session)
+    if values.get("account_id"):
+        config.set(profile_section, "sso_account_id", values["account_id"])
+    if values.get("role_name"):
+        config.set(profile_section, "sso_role_name", values["role_name"])
+    config.set(profile_section, "region", values.get("region") or AWS_DEFAULT_REGION)
+    config.set(profile_section, "output", values.get("output") or DEFAULT_OUTPUT)
+    # login reads the start url and region from the profile named like the sso-session
+    config.set(profile_section, "sso_start_url", values["sso_start_url"])
+    config.set(profile_section, "sso_region", values["sso_region"])
+
+    _write_config(AWS_CONFIG_PATH, config)
+    LOGGER.info(f"[{session_section}] and [{profile_section}] written to {AWS_CONFIG_PATH}")
+
+    _create_tool_directory(Path.home(), AWS_SSO_DIR)
+    aws_sso_config = _read_config(AWS_SSO_CONFIG_PATH)
+    proxy_role_name = values.get("proxy_role_name")
+    if not aws_sso_config.has_section(AWS_SSO_DEFAULT_PROXY_ROLE_SECTION):
+        aws_sso_config.add_section(AWS_SSO_DEFAULT_PROXY_ROLE_SECTION)
+        proxy_role_name = proxy_role_name or AWS_SSO_EKS_ROLE_NAME_DEFAULT
+    if proxy_role_name:
+        aws_sso_config.set(AWS_SSO_DEFAULT_PROXY_ROLE_SECTION, AWS_SSO_DEFAULT_PROXY_ROLE_KEY, proxy_role_name)
+        _write_config(AWS_SSO_CONFIG_PATH, aws_sso_config)
+        LOGGER.info(f"{AWS_SSO_CONFIG_PATH} file updated")
+
 @click.command()
+@click.option("--sso-session", "sso_session", help="The sso-session name to create, enables the non-interactive mode")
+@click.option("--sso-start-url", "sso_start_url", metavar="URL", help="Your AWS SSO start URL")
+@click.option("--sso-region", "sso_region", help="The AWS region your AWS SSO instance is deployed in")
+@click.option("--sso-registration-scopes", "sso_registration_scopes", help=f"The sso-session registration scopes, default is '{DEFAULT_REGISTRATION_SCOPES}'")
+@click.option("--account-id", "account_id", help="The account id of the default profile")
+@click.option("--role-name", "role_name", help="The role name of the default profile")
+@click.option("--region", "region", help=f"CLI default client region, default is '{AWS_DEFAULT_REGION}'")
+@click.option("--output", "output", help=f"CLI default output format, default is '{DEFAULT_OUTPUT}'")
+@click.option("--profile", "profile", help="CLI profile name, default is the sso-session name")
+@click.option("--proxy-role-name", "proxy_role_name", help="The name of the proxy role to use by default")
+@click.option("--from-file", "from_file", type=click.Path(exists=True, dir_okay=False), help="YAML or JSON file with the same values as the flags (snake_case keys), enables the non-interactive mode")
 
-def configure():
+def configure(**kwargs):
     """Configure the AWS SSO instance.
 
     Note this only needs to be done once for a given SSO instance (i.e., start URL),
     as all profiles sharing the same start URL will share the same login.
+
+    Without flags, it runs the interactive aws configure sso command.
     """
-    configure_logging(LOGGER, False)
+    configure_logging(LOGGER, 0)
+
+    from_file = kwargs.pop("from_file")
+    values = _load_configure_file(from_file) if from_file else {}
+    values.update({k: v for k, v in kwargs.items() if v is not None})
+    if values:
+        _configure_non_interactive(values)
+        return
+
     _check_aws_v2()
-    
+
     try:
         subprocess.run(['aws'] + [ 'configure', 'sso'], stderr=sys.stderr, stdout=sys.stdout, check=True)
     except subprocess.CalledProcessError as e:
         LOGGER.error("Unexpected error on the configure command")
         exit(1)
-    
+
     _create_tool_directory(Path.home(), AWS_SSO_DIR)
     _create_aws_sso_conf_file(AWS_SSO_CONFIG_PATH)
 
 if __name__ == "__main__":
-    configure(prog_name="python -m aws_sso_magic.configure") 
\ No newline at end of file
+    configure(prog_name="python -m aws_sso_magic.configure")
@@ -0,0 +1,87 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from datetime import timedelta
+from pathlib import Path
+
+from .utils import AWS_SSO_DIR
+
+LOGGER = logging.getLogger(__name__)
+
+AWS_SSO_CREDENTIALS_CACHE_PATH = f'{Path.home()}/{AWS_SSO_DIR}/cache/credentials'
+
+class RoleCredentialsCache:
+    """Cache of the role credentials returned by sso:GetRoleCredentials.
+
+    Every account, role and start URL gets its own file, readable only by the user,
+    holding the roleCredentials response with its expiration (epoch milliseconds).
+    """
+    def __init__(self, cache_dir=AWS_SSO_CREDENTIALS_CACHE_PATH):
+        self.cache_dir = cache_dir
+
+    def _path(self, account_id, role_name, start_url):
+        key = "|".join([account_id, role_name, start_url or ""])
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, account_id, role_name, start_url, min_valid=timedelta(0)):
+        """Return the cached role credentials, None if they are missing or expire within min_valid."""
+        path = self._path(account_id, role_name, start_url)
+        try:
+            with open(path) as context:
+                credentials = json.load(context)
+            expiration = credentials["expiration"] / 1000.0
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if expiration <= time.time() + min_valid.total_seconds():
+            LOGGER.debug(f"Cached credentials of {role_name} on {account_id} expire too soon")
+            return None
+        return credentials
+
+    def put(self, account_id, role_name, start_url, credentials):
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        # mkstemp creates the file with 0600 permissions
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as destination:
+                json.dump(credentials, destination)
+            os.replace(temp_path, self._path(account_id, role_name, start_url))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        removed = 0
+        for file_name in os.listdir(self.cache_dir):
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+                removed += 1
+            except OSError as e:
+                LOGGER.debug(f"Unable to delete {file_name}: {e}")
+        return removed
+
+_CREDENTIALS_CACHE = None
+
+def get_credentials_cache():
+    global _CREDENTIALS_CACHE
+    if _CREDENTIALS_CACHE is None:
+        _CREDENTIALS_CACHE = RoleCredentialsCache()
+    return _CREDENTIALS_CACHE
@@ -0,0 +1,173 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import click
+
+from configparser import ConfigParser, Error as ConfigParserError
+from . import __version__
+from .utils import configure_logging, Printer, get_sso_session_names, _read_section_configuration, _get_endpoint_url
+from .utils import (
+    AWS_CONFIG_PATH,
+    AWS_CREDENTIAL_PATH,
+    AWS_SSO_CONFIG_PATH,
+    AWS_SSO_CACHE_PATH
+)
+
+LOGGER = logging.getLogger(__name__)
+
+HEADER_FIELDS = ["Check", "Target", "Status", "Time (ms)", "Detail"]
+HEAVY_MODULES = ["boto3", "botocore.session", "aws_sso_lib", "PyInquirer", "yaml", "dateutil.parser"]
+PROBE_TIMEOUT = 30
+ENDPOINT_TIMEOUT = 10
+ENDPOINT_SAMPLES = 3
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+def _result(check, target, status, elapsed=None, detail=""):
+    return {"check": check, "target": target, "status": status, "elapsed_ms": _ms(elapsed) if elapsed is not None else None, "detail": detail}
+
+def _probe_command(name, args, expected):
+    """Run the same command as _check_aws_v2 and _check_kubectl and time it."""
+    started = time.monotonic()
+    try:
+        output = subprocess.run(args, capture_output=True, timeout=PROBE_TIMEOUT).stdout.decode("utf-8")
+    except FileNotFoundError:
+        return _result("probe", name, "missing", time.monotonic() - started, f"{args[0]} not found on the PATH")
+    except subprocess.TimeoutExpired:
+        return _result("probe", name, "slow", time.monotonic() - started, f"no answer after {PROBE_TIMEOUT}s")
+    elapsed = time.monotonic() - started
+    first_line = output.strip().splitlines()[0] if output.strip() else ""
+    return _result("probe", name, "ok" if expected in output else "unexpected", elapsed, first_line)
+
+def _import_time(module):
+    # A fresh interpreter for every module, the modules already imported by this process would be free
+    code = "import time; started = time.perf_counter(); import {}; print(time.perf_counter() - started)".format(module)
+    try:
+        process = subprocess.run([sys.executable, "-c", code], capture_output=True, timeout=PROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return _result("import", module, "slow", None, f"no answer after {PROBE_TIMEOUT}s")
+    if process.returncode != 0:
+        error = process.stderr.decode("utf-8").strip().splitlines()
+        return _result("import", module, "error", None, error[-1] if error else "")
+    return _result("import", module, "ok", float(process.stdout.decode("utf-8").strip()))
+
+def _config_file(path):
+    if not os.path.isfile(path):
+        return _result("file", path, "missing")
+    size = os.path.getsize(path)
+    started = time.monotonic()
+    config = ConfigParser()
+    try:
+        config.read(path)
+    except ConfigParserError as e:
+        return _result("file", path, "error", time.monotonic() - started, str(e).splitlines()[0])
+    elapsed = time.monotonic() - started
+    return _result("file", path, "ok", elapsed, f"{size} bytes, {len(config.sections())} sections")
+
+def _cache_directory(path):
+    if not os.path.isdir(path):
+        return _result("cache", path, "missing")
+    started = time.monotonic()
+    num_files = 0
+    size = 0
+    for entry in os.scandir(path):
+        if entry.is_file():
+            num_files += 1
+            size += entry.stat().st_size
+    return _result("cache", path, "ok", time.monotonic() - started, f"{num_files} files, {size} bytes")
+
+def _sso_regions(sso_session):
+    regions = {}
+    sessions = [sso_session] if sso_session else get_sso_session_names()
+    for name in sessions:
+        region = _read_section_configuration(AWS_CONFIG_PATH, f"sso-session {name}").get("sso_region")
+        if region:
+            regions.setdefault(region, name)
+    return regions
+
+def _endpoint_latency(region):
+    url = _get_endpoint_url("sso") or f"https://portal.sso.{region}.amazonaws.com"
+    samples = []
+    for _ in range(ENDPOINT_SAMPLES):
+        started = time.monotonic()
+        try:
+            urllib.request.urlopen(urllib.request.Request(url, method="HEAD"), timeout=ENDPOINT_TIMEOUT).close()
+        except urllib.error.HTTPError as e:
+            # Any HTTP answer is a full round trip
+            e.close()
+        except (urllib.error.URLError, OSError) as e:
+            return _result("endpoint", url, "unreachable", time.monotonic() - started, str(getattr(e, "reason", e)))
+        samples.append(time.monotonic() - started)
+    detail = "min {} ms, max {} ms over {} requests (the first includes DNS and TLS)".format(_ms(min(samples)), _ms(max(samples)), len(samples))
+    return _result("endpoint", url, "ok", statistics.median(samples), detail)
+
+def _run_checks(timings, sso_session):
+    yield _probe_command("aws", ["aws", "--version"], "aws-cli/2")
+    yield _probe_command("kubectl", ["kubectl", "version"], "GitVersion:")
+    for path in [AWS_CONFIG_PATH, AWS_CREDENTIAL_PATH, AWS_SSO_CONFIG_PATH]:
+        yield _config_file(path)
+    yield _cache_directory(AWS_SSO_CACHE_PATH)
+    if not timings:
+        return
+    for module in HEAVY_MODULES:
+        yield _import_time(module)
+    for region in _sso_regions(sso_session):
+        yield _endpoint_latency(region)
+
+@click.command()
+@click.option("--timings", is_flag=True, help="Also measure the import time of the heavy modules and the round trip to the SSO endpoints")
+@click.option("--sso-session", "sso_session", help="Only measure the SSO endpoint of this sso-session")
+@click.option("--json", "as_json", is_flag=True, help="Print a JSON document to attach to a ticket")
+@click.option("--verbose", "-v", count=True)
+
+def doctor(timings, sso_session, as_json, verbose):
+    """Diagnose the environment and find where the time goes.
+
+    It checks the aws and kubectl commands, the config files and the SSO cache,
+    with --timings it also measures the imports and the SSO endpoints latency.
+    """
+    configure_logging(LOGGER, verbose)
+
+    if as_json:
+        results = list(_run_checks(timings, sso_session))
+        print(json.dumps({
+            "version": __version__,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "checks": results,
+        }, indent=2))
+        return
+
+    printer = Printer(
+        separator=None,
+        default_separator="  ",
+        header_fields=HEADER_FIELDS,
+    )
+    for result in _run_checks(timings, sso_session):
+        elapsed = "" if result["elapsed_ms"] is None else str(result["elapsed_ms"])
+        printer.add_row([result["check"], result["target"], result["status"], elapsed, result["detail"]])
+    printer.print_after()
+
+if __name__ == "__main__":
+    doctor(prog_name="python -m aws_sso_magic.doctor")  #pylint: disable=unexpected-keyword-arg,no-value-for-parameter
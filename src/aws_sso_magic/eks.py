@@ -6,18 +6,28 @@ import subprocess
 import logging
 import logging.handlers
 import os
+import tempfile
+
+from pathlib import Path
 
 from PyInquirer import prompt, Separator
 from .utils import _check_kubectl, _print_warn
-from .utils import _get_role_name, _print_error, _get_profile_in_use
+from .concurrency import client_limiter
+from .materialize import materialize_profile
+from .utils import _get_role_name, _print_error, _get_profile_in_use, _get_endpoint_url
+from .transaction import flush_config_transaction
 
 LOGGER = logging.getLogger(__name__)
 
+KUBECONFIG_PATH = f'{Path.home()}/.kube/config'
+KUBECONFIG_AUTH_API_VERSION = "client.authentication.k8s.io/v1beta1"
+
 def list_clusters(profile_in_use, max_clusters=10, iter_marker=''):
     os.environ["AWS_PROFILE"] = profile_in_use
-    eks = boto3.client('eks')
+    eks = boto3.client('eks', endpoint_url=_get_endpoint_url("eks"))
     try:
-        clusters = eks.list_clusters(maxResults=max_clusters, nextToken=iter_marker)
+        with client_limiter(eks).slot():
+            clusters = eks.list_clusters(maxResults=max_clusters, nextToken=iter_marker)
         marker = clusters.get('nextToken')       # None if no more clusters to retrieve
         return clusters['clusters'], marker
     except botocore.exceptions.ClientError as e:
@@ -72,6 +82,9 @@ def _eks_cluster_configuration(cluster_arg, eks_profile_arg):
     cluster_name = cluster_arg
     if eks_profile_arg == None:
         profile_in_use = _get_profile_in_use()
+    materialize_profile(profile_in_use)
+    # The SDK and the aws cli read the profiles from the files
+    flush_config_transaction()
     _get_role_name(profile_in_use, "eks")
     if cluster_arg == None:
         cluster_name = _eks_list_clusters(profile_in_use)
@@ -79,3 +92,83 @@ def _eks_cluster_configuration(cluster_arg, eks_profile_arg):
     _eks_print_instructions(profile_in_use)    
 
 
+
+# In-process kubeconfig update, the same entries as aws eks update-kubeconfig
+
+def _get_kubeconfig_path():
+    kubeconfig = os.environ.get("KUBECONFIG")
+    if kubeconfig:
+        return kubeconfig.split(os.pathsep)[0]
+    return KUBECONFIG_PATH
+
+def _eks_select_cluster(eks_client):
+    clusters = []
+    list_clusters_args = {}
+    limiter = client_limiter(eks_client)
+    while True:
+        with limiter.slot():
+            response = eks_client.list_clusters(**list_clusters_args)
+        clusters.extend(response["clusters"])
+        if not response.get("nextToken"):
+            break
+        list_clusters_args["nextToken"] = response["nextToken"]
+    if not clusters:
+        _print_error(f"\nNo clusters exist. Run the aws-sso-magic login and select a valid profile")
+    if len(clusters) == 1:
+        return clusters[0]
+    questions = [{
+        'type': 'list',
+        'name': 'name',
+        'message': 'Please select the EKS cluster',
+        'choices': clusters
+    }]
+    answer = prompt(questions)
+    return answer['name'] if answer else sys.exit(1)
+
+def _upsert_named(entries, name, key, value):
+    entries = [e for e in (entries or []) if e.get("name") != name]
+    entries.append({"name": name, key: value})
+    return entries
+
+def _eks_write_kubeconfig(cluster, region, profile_name):
+    import yaml
+    path = _get_kubeconfig_path()
+    try:
+        with open(path) as context:
+            kubeconfig = yaml.safe_load(context) or {}
+    except FileNotFoundError:
+        kubeconfig = {}
+    kubeconfig.setdefault("apiVersion", "v1")
+    kubeconfig.setdefault("kind", "Config")
+    kubeconfig.setdefault("preferences", {})
+
+    arn = cluster["arn"]
+    kubeconfig["clusters"] = _upsert_named(kubeconfig.get("clusters"), arn, "cluster", {
+        "certificate-authority-data": cluster["certificateAuthority"]["data"],
+        "server": cluster["endpoint"],
+    })
+    kubeconfig["users"] = _upsert_named(kubeconfig.get("users"), arn, "user", {
+        "exec": {
+            "apiVersion": KUBECONFIG_AUTH_API_VERSION,
+            "command": "aws",
+            "args": ["--region", region, "eks", "get-token", "--cluster-name", cluster["name"], "--output", "json"],
+            "env": [{"name": "AWS_PROFILE", "value": profile_name}],
+        },
+    })
+    kubeconfig["contexts"] = _upsert_named(kubeconfig.get("contexts"), arn, "context", {
+        "cluster": arn,
+        "user": arn,
+    })
+    kubeconfig["current-context"] = arn
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "w") as destination:
+            yaml.safe_dump(kubeconfig, destination, default_flow_style=False)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    LOGGER.info(f"Updated context {arn} in {path}")
@@ -0,0 +1,92 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import logging
+import click
+
+from .concurrency import client_limiter
+from .eks import LOGGER as EKS_LOGGER
+from .eks import _eks_select_cluster, _eks_write_kubeconfig, _eks_print_instructions
+from .transaction import flush_config_transaction
+from .utils import configure_logging, log_phase, _print_error, _print_warn, _get_endpoint_url
+from .utils import _set_profile_credentials, _set_profile_in_use, _add_prefix, _get_role_name, _get_indexed_section
+from .utils import (
+    AWS_CONFIG_PATH,
+    AWS_DEFAULT_REGION
+)
+
+LOGGER = logging.getLogger(__name__)
+
+@click.command("eks-login")
+@click.argument("profile")
+@click.option("--cluster", "cluster_arg", help="The eks cluster name to use instead of selecting it from the menu")
+@click.option("--sso-session", "sso_session_arg", help="The sso-session to log in to when the profile was not generated yet")
+@click.option("--verbose", "-v", count=True)
+@click.pass_context
+
+def eks_login(ctx, profile, cluster_arg, sso_session_arg, verbose):
+    """Log in to an EKS cluster with a profile.
+
+    It sets the profile credentials, selects the cluster, updates the kubeconfig
+    and verifies the identity in a single process. The accounts and roles are only
+    discovered when the profile was not generated by a previous login.
+    """
+    import boto3
+    import botocore
+
+    configure_logging(LOGGER, verbose)
+    configure_logging(EKS_LOGGER, verbose)
+
+    profile_name = _add_prefix(profile)
+    if _get_indexed_section(AWS_CONFIG_PATH, profile_name) is None:
+        LOGGER.info(f"Profile {profile} not found, gathering the accounts and roles")
+        from .login import login
+        ctx.invoke(login, profile_arg=profile, sso_session_arg=[sso_session_arg] if sso_session_arg else [])
+    else:
+        with log_phase(LOGGER, "credentials", profile=profile):
+            _set_profile_credentials(profile_name, True, None, use_cache=True)
+            _set_profile_in_use(profile_name)
+
+    # The proxy role of the profile must be configured, the eks profile assumes it
+    _get_role_name(profile, "eks")
+
+    # The SDK reads the profile from the files
+    flush_config_transaction()
+    # One session for every client, the proxy role is assumed once
+    session = boto3.session.Session(profile_name=profile)
+    region = session.region_name or AWS_DEFAULT_REGION
+    eks_client = session.client("eks", region_name=region, endpoint_url=_get_endpoint_url("eks"))
+    sts_client = session.client("sts", region_name=region, endpoint_url=_get_endpoint_url("sts"))
+
+    try:
+        with log_phase(LOGGER, "kubeconfig", profile=profile):
+            cluster_name = cluster_arg or _eks_select_cluster(eks_client)
+            with client_limiter(eks_client).slot():
+                cluster = eks_client.describe_cluster(name=cluster_name)["cluster"]
+            _eks_write_kubeconfig(cluster, region, profile)
+
+        with log_phase(LOGGER, "identity", profile=profile):
+            with client_limiter(sts_client).slot():
+                identity = sts_client.get_caller_identity()
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+        _print_error(f"\nERROR: EKS login error! {e}")
+
+    print(f"\nIdentity: {identity['Arn']}")
+    cluster_account_id = cluster["arn"].split(":")[4]
+    if identity["Account"] != cluster_account_id:
+        _print_warn(f"\nThe identity account {identity['Account']} is not the account of the cluster {cluster_account_id}")
+
+    _eks_print_instructions(profile)
+
+if __name__ == "__main__":
+    eks_login(prog_name="python -m aws_sso_magic.eks_login")  #pylint: disable=unexpected-keyword-arg,no-value-for-parameter
@@ -0,0 +1,194 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import click
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .concurrency import client_limiter
+from .filters import NameFilter
+from .list_profiles import _get_start_url
+from .token_cache import get_token_cache
+from .utils import configure_logging, log_phase, Printer, _read_config, _get_profile_name
+from .utils import _print_error
+from .utils import (
+    AWS_CONFIG_PATH,
+    AWS_DEFAULT_REGION
+)
+
+LOGGER = logging.getLogger(__name__)
+
+HEADER_FIELDS = ["Profile", "Account ID", "Exit code", "Seconds"]
+# Removed from the environment of the commands, they would take precedence over the credentials
+PROFILE_ENV_VARS = ["AWS_PROFILE", "AWS_DEFAULT_PROFILE"]
+
+Result = namedtuple("Result", ["profile_name", "account_id", "returncode", "elapsed", "error"])
+
+def _select_profiles(patterns, start_url):
+    """The generated profiles matching a pattern by profile name, account name or account id."""
+    name_filter = NameFilter(patterns)
+    config = _read_config(AWS_CONFIG_PATH)
+    for section in config.sections():
+        if not section.startswith("profile "):
+            continue
+        profile = dict(config.items(section))
+        if "sso_account_id" not in profile or "sso_role_name" not in profile:
+            continue
+        if start_url and profile.get("sso_start_url") != start_url:
+            continue
+        profile_name = _get_profile_name(section)
+        if name_filter.matches(profile_name, profile.get("sso_account_name"), profile["sso_account_id"]):
+            yield profile_name, profile
+
+def _get_tokens(profiles):
+    """The cached AWS SSO login of every start URL, the commands can't log in."""
+    token_cache = get_token_cache()
+    tokens = {}
+    for profile_name, profile in profiles:
+        start_url = profile.get("sso_start_url")
+        if start_url in tokens:
+            continue
+        token = token_cache.lookup(start_url=start_url, session_name=profile.get("sso_session"), region=profile.get("sso_region"))
+        if token is None:
+            _print_error(f"\nERROR: No valid SSO login found for {start_url}, run aws-sso-magic login first")
+        tokens[start_url] = token.data
+    return tokens
+
+def _get_sso_clients(profiles):
+    # Created up front, creating clients isn't thread safe
+    from aws_sso_lib.config import SSOInstance
+    from .login import _get_sso_client
+    clients = {}
+    for profile_name, profile in profiles:
+        region = profile["sso_region"]
+        if region not in clients:
+            clients[region] = _get_sso_client(SSOInstance(profile.get("sso_start_url"), region, "exec", "exec"))
+    return clients
+
+def _command_environment(profile_name, profile, credentials):
+    env = dict(os.environ)
+    for var in PROFILE_ENV_VARS:
+        env.pop(var, None)
+    region = profile.get("region", AWS_DEFAULT_REGION)
+    env.update({
+        "AWS_ACCESS_KEY_ID": credentials["accessKeyId"],
+        "AWS_SECRET_ACCESS_KEY": credentials["secretAccessKey"],
+        "AWS_SESSION_TOKEN": credentials["sessionToken"],
+        "AWS_REGION": region,
+        "AWS_DEFAULT_REGION": region,
+        "AWS_SSO_MAGIC_PROFILE": profile_name,
+        "AWS_SSO_MAGIC_ACCOUNT_ID": profile["sso_account_id"],
+    })
+    return env
+
+class _OutputWriter:
+    """Print the lines of the commands prefixed with their profile, whole lines at a time."""
+    def __init__(self, prefix_width):
+        self._lock = threading.Lock()
+        self._prefix_width = prefix_width
+
+    def pump(self, stream, target, profile_name):
+        prefix = f"[{profile_name}]".ljust(self._prefix_width + 2)
+        for line in iter(stream.readline, b""):
+            text = line.decode("utf-8", "replace").rstrip("\n")
+            with self._lock:
+                target.write(f"{prefix} {text}\n")
+                target.flush()
+        stream.close()
+
+def _run(command, profile_name, profile, token, client, writer):
+    started = time.monotonic()
+    try:
+        # Kept in memory only, neither the credentials cache nor any other file is written
+        with client_limiter(client).slot():
+            response = client.get_role_credentials(
+                roleName=profile["sso_role_name"],
+                accountId=profile["sso_account_id"],
+                accessToken=token["accessToken"])
+        credentials = response["roleCredentials"]
+    except Exception as e:
+        return Result(profile_name, profile["sso_account_id"], None, time.monotonic() - started, f"Unable to get the credentials: {e}")
+
+    try:
+        process = subprocess.Popen(command, env=_command_environment(profile_name, profile, credentials),
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        return Result(profile_name, profile["sso_account_id"], None, time.monotonic() - started, f"Unable to run {command[0]}: {e}")
+    stderr_pump = threading.Thread(target=writer.pump, args=(process.stderr, sys.stderr, profile_name), daemon=True)
+    stderr_pump.start()
+    writer.pump(process.stdout, sys.stdout, profile_name)
+    stderr_pump.join()
+    returncode = process.wait()
+    return Result(profile_name, profile["sso_account_id"], returncode, time.monotonic() - started, None)
+
+@click.command("exec", context_settings=dict(ignore_unknown_options=True, allow_interspersed_args=False))
+@click.option("--profiles", "profile_patterns", multiple=True, required=True, metavar="PATTERN", help="The profiles to run the command with: a profile or account name, an account id, a glob, re:REGEX or @FILE of patterns, can provide multiple times")
+@click.option("--sso-session", "sso_session", help="Only the profiles of this sso-session")
+@click.option("--parallel", type=click.IntRange(min=1), default=4, show_default=True, help="Number of commands run at the same time")
+@click.option("--verbose", "-v", count=True)
+@click.argument("command", nargs=-1, required=True, type=click.UNPROCESSED)
+
+def exec_profiles(profile_patterns, sso_session, parallel, verbose, command):
+    """Run a command with the credentials of several profiles at the same time.
+
+    The role credentials of every profile are fetched with the cached AWS SSO login
+    and given to its command as environment variables, they are kept in memory only
+    and no file is written, not even the credentials cache. The output lines are
+    prefixed with the profile and the exit codes are summarized at the end. Eg: aws-sso-magic exec --profiles 'prod-*' --parallel 8 -- aws s3 ls
+    """
+    configure_logging(LOGGER, verbose)
+
+    start_url = _get_start_url(sso_session) if sso_session else None
+    try:
+        profiles = sorted(_select_profiles(profile_patterns, start_url))
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    if not profiles:
+        _print_error("\nERROR: No profiles match, run aws-sso-magic login or aws-sso-magic list to see them")
+
+    tokens = _get_tokens(profiles)
+    clients = _get_sso_clients(profiles)
+    writer = _OutputWriter(max(len(profile_name) for profile_name, profile in profiles))
+    LOGGER.info(f"Running {' '.join(command)} with {len(profiles)} profiles, {parallel} at a time")
+
+    with log_phase(LOGGER, "exec", profiles=len(profiles), parallel=parallel) as phase:
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            results = list(executor.map(
+                lambda item: _run(list(command), item[0], item[1], tokens[item[1].get("sso_start_url")], clients[item[1]["sso_region"]], writer),
+                profiles))
+        failed = [result for result in results if result.returncode != 0]
+        phase["failed"] = len(failed)
+
+    printer = Printer(
+        separator=None,
+        default_separator="  ",
+        header_fields=HEADER_FIELDS,
+        printer=lambda line: print(line, file=sys.stderr),
+    )
+    for result in results:
+        printer.add_row([result.profile_name, result.account_id, str(result.returncode) if result.error is None else result.error, f"{result.elapsed:.1f}"])
+    printer.print_after()
+
+    if failed:
+        LOGGER.error(f"{len(failed)} of {len(results)} commands failed")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    exec_profiles(prog_name="python -m aws_sso_magic.exec_profiles")  #pylint: disable=unexpected-keyword-arg,no-value-for-parameter
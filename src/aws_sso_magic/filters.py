@@ -0,0 +1,106 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import fnmatch
+import re
+
+from .utils import _read_aws_sso_config_file, AWS_SSO_CONFIG_PATH
+
+ACCOUNT_FILTER_KEY = "account_filter"
+ROLE_FILTER_KEY = "role_filter"
+
+class NameFilter:
+    """Match account or role names and ids against a list of patterns.
+
+    A pattern is an exact name or id (case insensitive), a shell-style glob (e.g. prod-*),
+    a regex prefixed with re: (e.g. re:^prod-(web|db)$) or @path to read the patterns
+    from a file, one per line. Everything matches when there are no patterns.
+    """
+    def __init__(self, patterns):
+        self.exact = set()
+        self.globs = []
+        self.regexes = []
+        for pattern in patterns:
+            self._add(pattern)
+
+    def _add(self, pattern):
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith("#"):
+            return
+        if pattern.startswith("@"):
+            try:
+                with open(pattern[1:]) as context:
+                    for line in context:
+                        self._add(line)
+            except OSError as e:
+                raise ValueError(f"Unable to read the filter file {pattern[1:]}: {e}")
+        elif pattern.startswith("re:"):
+            try:
+                self.regexes.append(re.compile(pattern[3:]))
+            except re.error as e:
+                raise ValueError(f"Invalid filter regex {pattern[3:]}: {e}")
+        elif any(c in pattern for c in "*?["):
+            self.globs.append(pattern.lower())
+        else:
+            self.exact.add(pattern.lower())
+
+    def __bool__(self):
+        return bool(self.exact or self.globs or self.regexes)
+
+    def matches(self, *values):
+        if not self:
+            return True
+        for value in values:
+            if not value:
+                continue
+            if value.lower() in self.exact:
+                return True
+            if any(fnmatch.fnmatchcase(value.lower(), glob) for glob in self.globs):
+                return True
+            if any(regex.search(value) for regex in self.regexes):
+                return True
+        return False
+
+class DiscoveryFilter:
+    """The account and role filters of a discovery, with the number of accounts and roles they skipped."""
+    def __init__(self, account_patterns=(), role_patterns=()):
+        self.accounts = NameFilter(account_patterns)
+        self.roles = NameFilter(role_patterns)
+        self.accounts_skipped = 0
+        self.roles_skipped = 0
+
+    def __bool__(self):
+        return bool(self.accounts or self.roles)
+
+    def include_account(self, account):
+        if self.accounts.matches(account.get("accountName"), account["accountId"]):
+            return True
+        self.accounts_skipped += 1
+        return False
+
+    def include_role(self, role):
+        if self.roles.matches(role["roleName"]):
+            return True
+        self.roles_skipped += 1
+        return False
+
+def _split_patterns(value):
+    return [p.strip() for p in re.split(r"[,\n]", value or "") if p.strip()]
+
+def get_discovery_filter(sso_session, account_patterns=(), role_patterns=()):
+    """Build the filter of an sso-session, the patterns given on the command line replace
+    the defaults of the [sso-session <name>] section of the aws-sso-magic config file."""
+    defaults = _read_aws_sso_config_file(AWS_SSO_CONFIG_PATH, f"sso-session {sso_session}") if sso_session else {}
+    return DiscoveryFilter(
+        list(account_patterns) or _split_patterns(defaults.get(ACCOUNT_FILTER_KEY)),
+        list(role_patterns) or _split_patterns(defaults.get(ROLE_FILTER_KEY)))
@@ -0,0 +1,167 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import logging
+import os
+import click
+
+from collections import namedtuple
+from datetime import datetime
+from dateutil.tz import UTC
+from dateutil.parser import parse
+
+from .proxy_credentials import get_pre_assumed_section
+from .token_cache import get_token_cache
+from .utils import configure_logging, log_phase, Printer, _read_config, _write_config, _load_json
+from .utils import _get_generated_sections, _get_discoveries, _forget_sections
+from .utils import (
+    AWS_CONFIG_PATH,
+    AWS_CREDENTIAL_PATH,
+    AWS_SSO_CACHE_PATH
+)
+
+LOGGER = logging.getLogger(__name__)
+
+HEADER_FIELDS = ["Kind", "Name", "Path", "Reason"]
+
+Garbage = namedtuple("Garbage", ["kind", "name", "path", "reason"])
+
+def _expired(value, now):
+    try:
+        return parse(value).astimezone(UTC) <= now
+    except (TypeError, ValueError, OverflowError):
+        return False
+
+def _expired_tokens(token_cache, now):
+    for token in token_cache.tokens:
+        if token.expires_at > now:
+            continue
+        # The AWS CLI refreshes an sso-session token until its client registration expires
+        if token.data.get("refreshToken") and not _expired(token.data.get("registrationExpiresAt"), now):
+            continue
+        yield Garbage("token", token.start_url or token.session_name or os.path.basename(token.path), token.path,
+                      f"expired at {token.expires_at.isoformat(timespec='seconds')}")
+
+def _expired_registrations(cache_dir, now):
+    try:
+        file_names = sorted(os.listdir(cache_dir))
+    except FileNotFoundError:
+        return
+    for file_name in file_names:
+        if not file_name.endswith(".json"):
+            continue
+        path = os.path.join(cache_dir, file_name)
+        data = _load_json(path)
+        # The tokens are checked by _expired_tokens
+        if not isinstance(data, dict) or "clientId" not in data or "accessToken" in data:
+            continue
+        if _expired(data.get("expiresAt"), now):
+            yield Garbage("registration", file_name[:-len(".json")], path, f"expired at {data['expiresAt']}")
+
+def _stale_profiles(config, generated, discoveries):
+    for section in generated:
+        if not section.startswith("profile ") or not config.has_section(section):
+            continue
+        start_url = config.get(section, "sso_start_url", fallback=None)
+        discovery = discoveries.get(start_url)
+        # Without a complete discovery of its start URL a profile is never stale
+        if discovery is None or section in discovery["sections"]:
+            continue
+        yield Garbage("profile", section[len("profile "):], AWS_CONFIG_PATH, f"not in the discovery of {start_url} at {discovery['at']}")
+
+def collect_garbage(dry_run=False):
+    """Remove the expired SSO cache entries and the generated profiles that the latest
+    discovery of their start URL didn't find, with their credentials sections.
+
+    The config files are written once, through the config transaction. Returns the
+    Garbage found, which is only reported with dry_run."""
+    now = datetime.now(UTC)
+    token_cache = get_token_cache(refresh=True)
+    garbage = list(_expired_tokens(token_cache, now))
+    garbage.extend(_expired_registrations(AWS_SSO_CACHE_PATH, now))
+
+    discoveries = {start_url: {"at": d["at"], "sections": set(d["sections"])} for start_url, d in _get_discoveries().items()}
+    config = _read_config(AWS_CONFIG_PATH)
+    profiles = list(_stale_profiles(config, _get_generated_sections(AWS_CONFIG_PATH), discoveries))
+    garbage.extend(profiles)
+    if dry_run:
+        return garbage
+
+    for item in garbage:
+        if item.kind == "profile":
+            continue
+        try:
+            os.remove(item.path)
+        except OSError as e:
+            LOGGER.debug(f"Unable to delete {item.path}: {e}")
+    if any(item.kind == "token" for item in garbage):
+        token_cache.scan()
+
+    if profiles:
+        for item in profiles:
+            config.remove_section(f"profile {item.name}")
+        _write_config(AWS_CONFIG_PATH, config)
+        _forget_sections(AWS_CONFIG_PATH, [f"profile {item.name}" for item in profiles])
+
+        # The credentials sections of the profiles, named after them (and the proxy role sections) without the prefix
+        names = {item.name for item in profiles} | {get_pre_assumed_section(item.name) for item in profiles}
+        generated_credentials = [section for section in _get_generated_sections(AWS_CREDENTIAL_PATH) if section in names]
+        if generated_credentials:
+            credentials = _read_config(AWS_CREDENTIAL_PATH)
+            for section in generated_credentials:
+                credentials.remove_section(section)
+            _write_config(AWS_CREDENTIAL_PATH, credentials)
+            _forget_sections(AWS_CREDENTIAL_PATH, generated_credentials)
+    return garbage
+
+def _summary(garbage, dry_run):
+    counts = {kind: sum(1 for item in garbage if item.kind == kind) for kind in ["token", "registration", "profile"]}
+    verb = "Would remove" if dry_run else "Removed"
+    return f"{verb} {counts['token']} expired tokens, {counts['registration']} expired client registrations and {counts['profile']} stale profiles"
+
+@click.command("gc")
+@click.option("--dry-run", is_flag=True, help="Only report what would be removed")
+@click.option("--json", "as_json", is_flag=True, help="Print the report as a JSON document")
+@click.option("--verbose", "-v", count=True)
+
+def gc(dry_run, as_json, verbose):
+    """Remove the expired SSO cache entries and the stale generated profiles.
+
+    A generated profile is stale when the latest complete login of its start URL,
+    without account or role filters, didn't find it anymore. Each config file is
+    written once.
+    """
+    configure_logging(LOGGER, verbose)
+
+    with log_phase(LOGGER, "gc", dry_run=dry_run) as phase:
+        garbage = collect_garbage(dry_run)
+        phase["removed"] = len(garbage)
+
+    if as_json:
+        print(json.dumps({"dry_run": dry_run, "removed": [item._asdict() for item in garbage]}, indent=2))
+        return
+
+    if garbage:
+        printer = Printer(
+            separator=None,
+            default_separator="  ",
+            header_fields=HEADER_FIELDS,
+        )
+        for item in garbage:
+            printer.add_row(list(item))
+        printer.print_after()
+    LOGGER.info(_summary(garbage, dry_run))
+
+if __name__ == "__main__":
+    gc(prog_name="python -m aws_sso_magic.garbage_collect")  #pylint: disable=unexpected-keyword-arg,no-value-for-parameter
@@ -0,0 +1,194 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import os
+import tempfile
+
+from datetime import datetime, timezone
+from pathlib import Path
+
+from . import __version__
+from .utils import _read_config, _write_config, _create_tool_directory
+from .utils import (
+    AWS_CONFIG_PATH,
+    AWS_DEFAULT_PROFILE,
+    AWS_DEFAULT_REGION,
+    AWS_SSO_CONFIG_PATH,
+    AWS_SSO_CONFIG_ALIAS,
+    AWS_SSO_DEFAULT_PROXY_ROLE_SECTION,
+    AWS_SSO_DEFAULT_PROXY_ROLE_KEY,
+    AWS_SSO_DIR
+)
+
+INVENTORY_VERSION = 1
+PROFILE_FIELDS = ["profile_name", "account_name", "account_id", "role_name", "region", "sso_start_url", "sso_region", "proxy_role_name"]
+SSO_SESSION_FIELDS = ["sso_start_url", "sso_region"]
+
+class InventoryError(Exception):
+    pass
+
+class InventoryWriter:
+    """Write the discovered profiles to a versioned JSON inventory.
+
+    The profiles are streamed to a temporary file next to the destination, which is
+    only replaced on commit, so a failed discovery never leaves a partial inventory.
+    The temporary file is created with the first profile, and abort (or the end of a
+    with block without commit) removes it. The profile names already have the aliases
+    applied and every profile carries the proxy role resolved from the aws-sso-magic
+    config file, which is exported too.
+    """
+    def __init__(self, path, sso_sessions):
+        self.path = os.path.abspath(path)
+        self.num_profiles = 0
+        self._magic_config = _read_config(AWS_SSO_CONFIG_PATH)
+        self._file = None
+        self._temp_path = None
+        self._header = {
+            "version": INVENTORY_VERSION,
+            "exported_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "exported_by": f"aws-sso-magic {__version__}",
+            "sso_sessions": {name: {"sso_start_url": instance.start_url, "sso_region": instance.region} for name, instance in sso_sessions},
+            "aws_sso_magic_config": {section: dict(self._magic_config.items(section, raw=True)) for section in self._exported_sections()},
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.abort()
+
+    def _open(self):
+        fd, self._temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".tmp-", suffix=os.path.basename(self.path))
+        self._file = os.fdopen(fd, "w")
+        # The header is written without its closing brace, the profiles follow it
+        self._file.write(json.dumps(self._header, indent=1)[:-2])
+        self._file.write(',\n "profiles": [')
+
+    def _proxy_role_name(self, profile_name):
+        # Same lookup as _get_role_name, reading the aws-sso-magic config file once
+        for section in [profile_name, AWS_SSO_DEFAULT_PROXY_ROLE_SECTION]:
+            if self._magic_config.has_section(section):
+                return self._magic_config.get(section, AWS_SSO_DEFAULT_PROXY_ROLE_KEY, fallback="").split("#", 1)[0].strip()
+        return ""
+
+    def add(self, config):
+        if self._file is None:
+            self._open()
+        if self.num_profiles:
+            self._file.write(",")
+        values = dict(zip(PROFILE_FIELDS, config.to_tuple()))
+        values["proxy_role_name"] = self._proxy_role_name(config.profile_name)
+        self._file.write("\n  ")
+        self._file.write(json.dumps(values))
+        self.num_profiles += 1
+
+    def _exported_sections(self):
+        for section in self._magic_config.sections():
+            if section in [AWS_SSO_CONFIG_ALIAS, AWS_SSO_DEFAULT_PROXY_ROLE_SECTION] or self._magic_config.has_option(section, AWS_SSO_DEFAULT_PROXY_ROLE_KEY):
+                yield section
+
+    def commit(self):
+        if self._file is None:
+            self._open()
+        try:
+            self._file.write("\n ]\n}\n")
+            self._file.close()
+            os.replace(self._temp_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+        self._file = None
+
+    def abort(self):
+        """Remove the temporary file, nothing to do once committed."""
+        if self._file is None:
+            return
+        self._file.close()
+        try:
+            os.unlink(self._temp_path)
+        except FileNotFoundError:
+            pass
+        self._file = None
+
+def load_inventory(path):
+    """Read and validate an inventory written by InventoryWriter."""
+    try:
+        with open(path) as context:
+            inventory = json.load(context)
+    except (OSError, ValueError) as e:
+        raise InventoryError(f"Unable to read the inventory {path}: {e}")
+    if not isinstance(inventory, dict) or not isinstance(inventory.get("version"), int):
+        raise InventoryError(f"{path} is not an aws-sso-magic inventory")
+    if inventory["version"] > INVENTORY_VERSION:
+        raise InventoryError(f"The inventory {path} was exported by a newer aws-sso-magic ({inventory.get('exported_by')}), please upgrade")
+    if inventory["version"] < INVENTORY_VERSION:
+        raise InventoryError(f"The inventory {path} has the unsupported version {inventory['version']}, please export it again")
+    for name, values in inventory.get("sso_sessions", {}).items():
+        missing = [field for field in SSO_SESSION_FIELDS if not values.get(field)]
+        if missing:
+            raise InventoryError(f"The sso-session {name} of the inventory {path} has no {', '.join(missing)}")
+    for i, profile in enumerate(inventory.get("profiles", [])):
+        missing = [field for field in PROFILE_FIELDS if field not in profile]
+        if missing:
+            raise InventoryError(f"The profile #{i} of the inventory {path} has no {', '.join(missing)}")
+    return inventory
+
+def _add_sso_session(config, name, values):
+    """Add the sections of an sso-session like configure does without prompts, the
+    missing ones only. Returns True if any was added."""
+    from .configure import DEFAULT_OUTPUT, DEFAULT_REGISTRATION_SCOPES
+    added = False
+    session_section = f"sso-session {name}"
+    if not config.has_section(session_section):
+        config.add_section(session_section)
+        for field in SSO_SESSION_FIELDS:
+            config.set(session_section, field, values[field])
+        config.set(session_section, "sso_registration_scopes", DEFAULT_REGISTRATION_SCOPES)
+        added = True
+    # login reads the start url and region from the profile named like the sso-session
+    profile_section = name if name == AWS_DEFAULT_PROFILE else f"profile {name}"
+    if not config.has_section(profile_section):
+        config.add_section(profile_section)
+        config.set(profile_section, "sso_session", name)
+        config.set(profile_section, "region", AWS_DEFAULT_REGION)
+        config.set(profile_section, "output", DEFAULT_OUTPUT)
+        for field in SSO_SESSION_FIELDS:
+            config.set(profile_section, field, values[field])
+        added = True
+    return added
+
+def apply_inventory_config(inventory):
+    """Add the sso-sessions and the aws-sso-magic config sections of the inventory that
+    are missing locally, the local ones are kept. Each file is written once at most.
+
+    Returns the names of the sso-sessions and sections added."""
+    _create_tool_directory(Path.home(), ".aws")
+    config = _read_config(AWS_CONFIG_PATH)
+    added_sessions = [name for name, values in sorted(inventory.get("sso_sessions", {}).items()) if _add_sso_session(config, name, values)]
+    if added_sessions:
+        _write_config(AWS_CONFIG_PATH, config)
+
+    _create_tool_directory(Path.home(), AWS_SSO_DIR)
+    magic_config = _read_config(AWS_SSO_CONFIG_PATH)
+    added_sections = []
+    for section, values in inventory.get("aws_sso_magic_config", {}).items():
+        if magic_config.has_section(section):
+            continue
+        magic_config.add_section(section)
+        for key, value in values.items():
+            magic_config.set(section, key, value)
+        added_sections.append(section)
+    if added_sections:
+        _write_config(AWS_SSO_CONFIG_PATH, magic_config)
+    return added_sessions, added_sections
@@ -0,0 +1,200 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import logging
+import sys
+import click
+
+from datetime import datetime
+from dateutil.tz import tzlocal
+from .credentials_cache import get_credentials_cache
+from .token_cache import get_token_cache
+from .utils import configure_logging, Printer, _read_config, _read_aws_sso_config_file, _read_section_configuration
+from .utils import _get_profile_name, _get_account_alias, _print_error
+from .utils import (
+    AWS_CONFIG_PATH,
+    AWS_SSO_CONFIG_PATH,
+    AWS_SSO_CONFIG_ALIAS,
+    AWS_DEFAULT_REGION,
+    DEFAULT_COMPONENTS,
+    DEFAULT_SEPARATOR
+)
+
+LOGGER = logging.getLogger(__name__)
+
+HEADER_FIELDS = ["Account name", "Account ID", "Role", "Profile", "Alias", "Credentials expire"]
+JSON_FIELDS = ["account_name", "account_id", "role_name", "profile_name", "alias", "credentials_expire"]
+
+def _format_expiry(account_id, role_name, start_url):
+    """The expiration of the cached role credentials, empty if there are none or they expired."""
+    credentials = get_credentials_cache().get(account_id, role_name, start_url)
+    if credentials is None:
+        return ""
+    return datetime.fromtimestamp(credentials["expiration"] / 1000.0, tzlocal()).strftime("%Y-%m-%d %H:%M %Z")
+
+def _get_start_url(sso_session):
+    config_sso_session = _read_section_configuration(AWS_CONFIG_PATH, f"sso-session {sso_session}")
+    start_url = config_sso_session.get("sso_start_url")
+    if not start_url:
+        _print_error(f"\nERROR: sso-session {sso_session} not found on the file {AWS_CONFIG_PATH}, run aws-sso-magic configure")
+    return start_url
+
+def _get_sso_instance(sso_session):
+    """The AWS SSO instance of an sso-session read from the aws config file, nothing is written to it."""
+    from aws_sso_lib.config import SSOInstance
+    from .utils import get_sso_sessions
+    sso_session = sso_session or get_sso_sessions()
+    config_sso_session = _read_section_configuration(AWS_CONFIG_PATH, f"sso-session {sso_session}")
+    if not config_sso_session.get("sso_start_url") or not config_sso_session.get("sso_region"):
+        _print_error(f"\nERROR: sso-session {sso_session} not found on the file {AWS_CONFIG_PATH}, run aws-sso-magic configure")
+    return SSOInstance(config_sso_session["sso_start_url"], config_sso_session["sso_region"], "list", "list"), sso_session
+
+def _iter_local_rows(start_url, aliases):
+    """Yield the rows of the profiles generated on the aws config file, no network calls."""
+    config = _read_config(AWS_CONFIG_PATH)
+    for section in config.sections():
+        if not section.startswith("profile "):
+            continue
+        profile = config[section]
+        if "sso_account_id" not in profile or "sso_role_name" not in profile:
+            continue
+        if start_url and profile.get("sso_start_url") != start_url:
+            continue
+        account_name = profile.get("sso_account_name", profile["sso_account_id"])
+        yield [
+            account_name,
+            profile["sso_account_id"],
+            profile["sso_role_name"],
+            _get_profile_name(section),
+            _get_account_alias(account_name, aliases),
+            _format_expiry(profile["sso_account_id"], profile["sso_role_name"], profile.get("sso_start_url")),
+        ]
+
+def _iter_remote_rows(sso_session, aliases, regions, profile_name_formatter, safe_account_names):
+    """Yield the rows of every account and role as they are listed by AWS SSO, with the
+    profile names login would give them."""
+    from .login import _get_sso_client, _iter_accounts, _iter_account_configs
+
+    instance, sso_session = _get_sso_instance(sso_session)
+    token = get_token_cache().lookup(start_url=instance.start_url, session_name=sso_session, region=instance.region)
+    if token is None:
+        _print_error(f"\nERROR: No valid SSO login found for {instance.start_url}, run aws-sso-magic login first")
+
+    client = _get_sso_client(instance)
+    account_configs = _iter_account_configs(
+        client,
+        token.data,
+        _iter_accounts(client, token.data),
+        instance,
+        regions,
+        profile_name_formatter,
+        safe_account_names)
+    for account, configs in account_configs:
+        for config in configs:
+            yield [
+                config.account_name,
+                config.account_id,
+                config.role_name,
+                config.profile_name,
+                _get_account_alias(config.account_name, aliases),
+                _format_expiry(config.account_id, config.role_name, instance.start_url),
+            ]
+
+@click.command("list")
+@click.option("--sso-session", "sso_session", help="Only list the profiles of this sso-session")
+@click.option("--refresh", is_flag=True, help="List the accounts and roles from AWS SSO instead of the local profiles")
+@click.option("--json", "as_json", is_flag=True, help="Print one JSON object per line")
+@click.option("--separator", "--sep", metavar="SEP", help="Field separator, the rows are printed as they are found instead of as a table")
+@click.option("--no-header", is_flag=True, help="Don't print the header")
+@click.option("--skip-repeated-values/--show-repeated-values", default=True, help="Don't repeat the account name and id on consecutive rows of the table")
+@click.option("--region", "-r", "regions", multiple=True, metavar="REGION", help="With --refresh, AWS region of the profiles like on login, can provide multiple times")
+@click.option("--components", "profile_name_components", metavar="VALUE,VALUE,...", default=DEFAULT_COMPONENTS, help="With --refresh, profile name components to join (comma-separated) like on login")
+@click.option("--profile-name-separator", "profile_name_separator", metavar="SEP", help=f"With --refresh, separator for profile name components like the --separator of login, default is '{DEFAULT_SEPARATOR}'")
+@click.option("--include-region", "profile_name_include_region", type=click.Choice(["default", "always"]), default="default", help="With --refresh, by default the first region is left off the profile name")
+@click.option("--region-style", "profile_name_region_style", type=click.Choice(["short", "long"]), default="short", help="With --refresh, default is five character region abbreviations")
+@click.option("--trim-account-name", "profile_name_trim_account_name_patterns", multiple=True, default=[], help="With --refresh, regex to remove from account names, can provide multiple times")
+@click.option("--trim-role-name", "profile_name_trim_role_name_patterns", multiple=True, default=[], help="With --refresh, regex to remove from role names, can provide multiple times")
+@click.option("--profile-name-process")
+@click.option("--safe-account-names/--raw-account-names", default=True, help="With --refresh, in profiles, replace any character sequences not in A-Za-z0-9-._ with a single -")
+@click.option("--verbose", "-v", count=True)
+
+def list_profiles(
+        sso_session,
+        refresh,
+        as_json,
+        separator,
+        no_header,
+        skip_repeated_values,
+        regions,
+        profile_name_components,
+        profile_name_separator,
+        profile_name_include_region,
+        profile_name_region_style,
+        profile_name_trim_account_name_patterns,
+        profile_name_trim_role_name_patterns,
+        profile_name_process,
+        safe_account_names,
+        verbose):
+    """List the accounts, roles and profiles.
+
+    By default the profiles generated by the login command are read from the local
+    files, use --refresh to list them from AWS SSO, with the profile names formatted
+    by the same options as login. Neither writes the aws config file. The expiration
+    is the one of the cached role credentials of each profile.
+    """
+    configure_logging(LOGGER, verbose)
+
+    aliases = _read_aws_sso_config_file(AWS_SSO_CONFIG_PATH, AWS_SSO_CONFIG_ALIAS)
+
+    if refresh:
+        from .login import _get_profile_name_formatter
+        profile_name_formatter = _get_profile_name_formatter(
+            profile_name_components,
+            profile_name_separator,
+            profile_name_include_region,
+            profile_name_region_style,
+            profile_name_trim_account_name_patterns,
+            profile_name_trim_role_name_patterns,
+            profile_name_process)
+        rows = _iter_remote_rows(sso_session, aliases, list(regions) or [AWS_DEFAULT_REGION], profile_name_formatter, safe_account_names)
+    else:
+        start_url = _get_start_url(sso_session) if sso_session else None
+        rows = _iter_local_rows(start_url, aliases)
+
+    if as_json:
+        for row in rows:
+            print(json.dumps(dict(zip(JSON_FIELDS, row))))
+            sys.stdout.flush()
+        return
+
+    printer = Printer(
+        separator=separator,
+        default_separator="  ",
+        header_fields=HEADER_FIELDS,
+        disable_header=no_header,
+        skip_repeated_values=[True, True, False, False, False, False] if skip_repeated_values else False,
+        sort_key=None if separator else lambda r: (r[0], r[2], r[3]),
+    )
+    printer.print_header_before()
+    found = False
+    for row in rows:
+        found = True
+        printer.add_row(row)
+    printer.print_after()
+
+    if not found and not refresh:
+        LOGGER.info("No profiles found, run aws-sso-magic login or use the --refresh flag")
+
+if __name__ == "__main__":
+    list_profiles(prog_name="python -m aws_sso_magic.list_profiles")  #pylint: disable=unexpected-keyword-arg,no-value-for-parameter
@@ -0,0 +1,99 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import contextlib
+import hashlib
+import logging
+import os
+import time
+
+from pathlib import Path
+
+from .utils import AWS_SSO_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOGGER = logging.getLogger(__name__)
+
+AWS_SSO_LOCKS_PATH = f'{Path.home()}/{AWS_SSO_DIR}/locks'
+# The device authorization of a login may wait for the user for several minutes
+LOCK_TIMEOUT = 600
+LOCK_TIMEOUT_ENV_VAR = "AWS_SSO_MAGIC_LOCK_TIMEOUT"
+LOCK_POLL_INTERVAL = 0.1
+
+class LockTimeout(Exception):
+    """Raised by file_lock, the commands report it with _print_error and the API as AwsSsoMagicError."""
+    pass
+
+def _try_lock(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+def _lock_timeout():
+    try:
+        return float(os.environ.get(LOCK_TIMEOUT_ENV_VAR) or LOCK_TIMEOUT)
+    except ValueError:
+        LOGGER.warning(f"Ignoring the invalid {LOCK_TIMEOUT_ENV_VAR} {os.environ[LOCK_TIMEOUT_ENV_VAR]}")
+        return LOCK_TIMEOUT
+
+def get_lock_path(name):
+    return os.path.join(AWS_SSO_LOCKS_PATH, hashlib.sha1(name.encode("utf-8")).hexdigest() + ".lock")
+
+@contextlib.contextmanager
+def file_lock(name, timeout=None, waiting_message=None, logger=LOGGER):
+    """Hold an exclusive lock shared by every aws-sso-magic process of the user.
+
+    It yields True if another process was holding the lock and this one had to wait,
+    so the caller can reuse what that process did instead of repeating it. The lock is
+    released by the OS if the process dies. The timeout is LOCK_TIMEOUT seconds by
+    default, or the one of the AWS_SSO_MAGIC_LOCK_TIMEOUT environment variable.
+    """
+    if timeout is None:
+        timeout = _lock_timeout()
+    path = get_lock_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        waited = False
+        deadline = time.monotonic() + timeout
+        while not _try_lock(fd):
+            if not waited and waiting_message:
+                logger.info(waiting_message)
+            waited = True
+            if time.monotonic() > deadline:
+                raise LockTimeout(f"Timed out after {timeout:g} seconds waiting for the lock {path}")
+            time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield waited
+        finally:
+            _unlock(fd)
+    finally:
+        os.close(fd)
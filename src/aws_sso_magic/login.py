@@ -13,32 +13,50 @@
 
 import os
 import sys
+import json
+import queue
+import threading
+import time
 import logging
 import botocore
 import click
 
-from collections import namedtuple
+from datetime import timedelta
 from aws_sso_lib.sso import get_token_fetcher
-from aws_sso_lib.config_file_writer import ConfigFileWriter, write_values, get_config_filename
+from aws_sso_lib.config_file_writer import get_config_filename, process_profile_name
 from botocore.session import Session
-from botocore.exceptions import ProfileNotFound
 from .eks   import _eks_cluster_configuration
+from .checkpoint import DiscoveryJournal
+from .concurrency import client_limiter, limited_map
+from .filters import get_discovery_filter
+from .inventory import InventoryWriter, InventoryError, load_inventory, apply_inventory_config
+from .locks import file_lock
+from .materialize import MATERIALIZE_POLICIES, get_materialize_policy
+from .prefetch import BackgroundTask
+from .proxy_credentials import pre_assume_proxy_roles
+from .transaction import config_transaction
+from .token_cache import get_token_cache
+from .credentials_cache import get_credentials_cache
 from .utils import _create_credentials_profile, _read_aws_sso_config_file, process_profile_name_formatter 
 from .utils import _check_aws_v2, _check_flag_combinations
-from .utils import configure_logging, get_instance, GetInstanceError
+from .utils import configure_logging, log_phase, get_instance, get_sso_session_names, GetInstanceError
 from .utils import generate_profile_name_format, get_formatter, get_process_formatter
 from .utils import get_trim_formatter, get_safe_account_name, get_config_profile_list
-from .utils import _set_profile_credentials, _add_prefix, _set_profile_in_use
+from .utils import _set_profile_credentials, _add_prefix, _set_profile_in_use, _get_endpoint_url
+from .utils import _record_generated_sections, _record_discovery, _get_profile_name, _get_indexed_section, _read_section_configuration
 from .utils import (
+    AWS_CONFIG_PATH,
     AWS_SSO_CONFIG_ALIAS,
     AWS_SSO_CONFIG_PATH,
+    AWS_SSO_PROFILE_IN_USE,
     AWS_DEFAULT_REGION,
+    DEFAULT_COMPONENTS,
+    DEFAULT_SEPARATOR,
     VERBOSE
 )
 
 LOGGER = logging.getLogger(__name__)
 
-DEFAULT_SEPARATOR = "."
 UTC_TIME_FORMAT = "%Y-%m-%d %H:%M UTC"
 LOCAL_TIME_FORMAT = "%Y-%m-%d %H:%M %Z"
 
@@ -48,8 +66,610 @@ CONFIGURE_DEFAULT_REGION_VARS     = ["AWS_CONFIGURE_DEFAULT_REGION", "AWS_DEFAUL
 LOGIN_DEFAULT_START_URL_VARS      = ["AWS_SSO_LOGIN_DEFAULT_SSO_START_URL"]
 LOGIN_DEFAULT_SSO_REGION_VARS     = ["AWS_SSO_LOGIN_DEFAULT_SSO_REGION"]
 LOGIN_ALL_VAR = "AWS_SSO_LOGIN_ALL"
+TOKEN_EXPIRY_WINDOW = timedelta(minutes=15)
 
-ConfigParams = namedtuple("ConfigParams", ["profile_name", "account_name", "account_id", "role_name", "region"])
+CREDENTIALS_KEYS = ["aws_access_key_id", "aws_secret_access_key", "aws_session_token"]
+
+DISCOVERY_QUEUE_SIZE = 100
+DISCOVERY_PROGRESS_INTERVAL = 50
+
+class ConfigParams:
+    """One generated profile, the account, role, region and SSO instance strings
+    are interned because they repeat on every role and region of the same account."""
+    __slots__ = ("profile_name", "account_name", "account_id", "role_name", "region", "sso_start_url", "sso_region", "proxy_role_name")
+
+    def __init__(self, profile_name, account_name, account_id, role_name, region, sso_start_url, sso_region, proxy_role_name=None):
+        self.profile_name = profile_name
+        self.account_name = sys.intern(account_name)
+        self.account_id = sys.intern(account_id)
+        self.role_name = sys.intern(role_name)
+        self.region = sys.intern(region)
+        self.sso_start_url = sys.intern(sso_start_url)
+        self.sso_region = sys.intern(sso_region)
+        # Only known up front for the profiles imported from an inventory
+        self.proxy_role_name = proxy_role_name
+
+    def to_tuple(self):
+        return (self.profile_name, self.account_name, self.account_id, self.role_name, self.region, self.sso_start_url, self.sso_region, self.proxy_role_name)
+
+    def __repr__(self):
+        return ("ConfigParams(profile_name={!r}, account_name={!r}, account_id={!r}, role_name={!r}, region={!r}, "
+                "sso_start_url={!r}, sso_region={!r}, proxy_role_name={!r})").format(*self.to_tuple())
+
+_DISCOVERY_DONE = object()
+
+def _get_sso_client(instance, session=None):
+    config = botocore.config.Config(
+        region_name=instance.region,
+        signature_version=botocore.UNSIGNED,
+    )
+    return (session or Session()).create_client("sso", config=config, endpoint_url=_get_endpoint_url("sso"))
+
+def _get_default_profile_name_formatter():
+    region_format, no_region_format = generate_profile_name_format(DEFAULT_COMPONENTS, DEFAULT_SEPARATOR, "short")
+    return get_formatter("default", region_format, no_region_format)
+
+def _get_profile_name_formatter(components, separator, include_region, region_style, trim_account_name_patterns, trim_role_name_patterns, process):
+    """The profile name formatter of the login options, list --refresh uses the same ones."""
+    if not separator:
+        separator = os.environ.get("AWS_CONFIGURE_SSO_DEFAULT_PROFILE_NAME_SEPARATOR") or DEFAULT_SEPARATOR
+
+    if process:
+        profile_name_formatter = get_process_formatter(process)
+    else:
+        region_format, no_region_format = generate_profile_name_format(components, separator, region_style)
+        LOGGER.debug("Profile name format (region):    {}".format(region_format))
+        LOGGER.debug("Profile name format (no region): {}".format(no_region_format))
+        profile_name_formatter = get_formatter(include_region, region_format, no_region_format)
+        if trim_account_name_patterns or trim_role_name_patterns:
+            profile_name_formatter = get_trim_formatter(trim_account_name_patterns, trim_role_name_patterns, profile_name_formatter)
+
+    try:
+        profile_name_formatter(0, 1, account_name="foo", account_id="bar", role_name="baz", region="us-east-1")
+    except Exception as e:
+        raise click.UsageError("Invalid profile name format: {}".format(e))
+    return profile_name_formatter
+
+def _iter_accounts(client, token, journal=None):
+    list_accounts_args = {
+        "accessToken": token["accessToken"]
+    }
+    if journal is not None:
+        # Accounts listed by an interrupted run are replayed and the listing continues from its last page
+        yield from journal.accounts
+        if journal.accounts_complete:
+            return
+        if journal.next_token:
+            list_accounts_args["nextToken"] = journal.next_token
+    limiter = client_limiter(client)
+    while True:
+        with limiter.slot():
+            response = client.list_accounts(**list_accounts_args)
+
+        LOGGER.debug("Account page: %s accounts", len(response["accountList"]))
+        next_token = response.get("nextToken")
+        if journal is not None:
+            journal.record_accounts(response["accountList"], next_token)
+        for account in response["accountList"]:
+            yield account
+
+        if not next_token:
+            break
+        else:
+            list_accounts_args["nextToken"] = response["nextToken"]
+
+def _list_account_roles(client, token, account, journal=None):
+    if journal is not None and account["accountId"] in journal.roles:
+        return journal.roles[account["accountId"]]
+
+    LOGGER.debug("Getting roles for %s", account["accountId"])
+    list_role_args = {
+        "accessToken": token["accessToken"],
+        "accountId": account["accountId"],
+    }
+
+    roles = []
+    limiter = client_limiter(client)
+    while True:
+        with limiter.slot():
+            response = client.list_account_roles(**list_role_args)
+        roles.extend(response["roleList"])
+
+        next_token = response.get("nextToken")
+        if not next_token:
+            break
+        else:
+            list_role_args["nextToken"] = response["nextToken"]
+
+    if journal is not None:
+        journal.record_roles(account["accountId"], roles)
+    return roles
+
+def _iter_account_configs(client, token, accounts, instance, regions, profile_name_formatter, safe_account_names, journal=None, discovery_filter=None):
+    """Yield each account with its profiles as soon as its roles are listed.
+
+    The roles of several accounts are listed at the same time, within the adaptive
+    concurrency limit of AWS SSO in its region, and the accounts are yielded in order.
+    The accounts excluded by the filter are skipped before listing their roles."""
+    num_regions = len(regions)
+
+    def included_accounts():
+        for account in accounts:
+            if not account.get("accountName"):
+                account["accountName"] = account["accountId"]
+            if discovery_filter is None or discovery_filter.include_account(account):
+                yield account
+
+    account_roles = limited_map(
+        lambda account: (account, _list_account_roles(client, token, account, journal)),
+        included_accounts(),
+        client_limiter(client).maximum)
+    for account, roles in account_roles:
+        configs = []
+        for role in roles:
+            if discovery_filter is not None and not discovery_filter.include_role(role):
+                continue
+            for i, region in enumerate(regions):
+                if safe_account_names:
+                    account_name_for_profile = get_safe_account_name(account["accountName"])
+                else:
+                    account_name_for_profile = account["accountName"]
+
+                profile_name = profile_name_formatter(i, num_regions,
+                    account_name=account_name_for_profile,
+                    account_id=account["accountId"],
+                    role_name=role["roleName"],
+                    region=region,
+                )
+                profile_name = process_profile_name_formatter(profile_name)
+                if profile_name == "SKIP":
+                    continue
+                configs.append(ConfigParams(profile_name, account["accountName"], account["accountId"], role["roleName"], region, instance.start_url, instance.region))
+
+        yield account, configs
+
+def _get_token(session, instance, sso_session, force_refresh):
+    token_cache = get_token_cache()
+    cached_token = None
+    if not force_refresh:
+        cached_token = token_cache.lookup(
+            start_url=instance.start_url,
+            session_name=sso_session,
+            region=instance.region,
+            min_valid=TOKEN_EXPIRY_WINDOW)
+
+    if cached_token:
+        LOGGER.info(f"Using cached login for {instance.start_url}")
+        return cached_token.data
+
+    # Only one process logs in to a start URL at a time, the others wait and reuse its token
+    with file_lock(f"token {instance.start_url}", waiting_message=f"Waiting for another aws-sso-magic process logging in to {instance.start_url}", logger=LOGGER) as waited:
+        if not force_refresh or waited:
+            token_cache.scan()
+            cached_token = token_cache.lookup(
+                start_url=instance.start_url,
+                session_name=sso_session,
+                region=instance.region,
+                min_valid=TOKEN_EXPIRY_WINDOW)
+            if cached_token:
+                LOGGER.info(f"Using the login of another process for {instance.start_url}")
+                return cached_token.data
+
+        token_fetcher = get_token_fetcher(session,
+                instance.region,
+                interactive=True,
+                )
+
+        LOGGER.info(f"Logging in to {instance.start_url}")
+        token = token_fetcher.fetch_token(instance.start_url, force_refresh=force_refresh)
+        token_cache.scan()
+    return token
+
+def _discover(instance, sso_session, regions, profile_name_formatter, safe_account_names, force_refresh, resume=False, discovery_filter=None):
+    """Log in to one SSO instance and yield its accounts with their profiles.
+
+    The accounts and roles are checkpointed on a journal, with resume the ones
+    listed by an interrupted run are taken from it."""
+    # botocore sessions are not thread safe, each discovery gets its own
+    session = Session()
+    with log_phase(LOGGER, "token", sso_session=sso_session):
+        token = _get_token(session, instance, sso_session, force_refresh)
+    LOGGER.debug("Token: %s", token)
+    client = _get_sso_client(instance, session)
+    journal = DiscoveryJournal.for_instance(instance)
+    if resume:
+        journal.load()
+        LOGGER.info("[%s] Resuming discovery, %s accounts and the roles of %s of them already listed", sso_session, len(journal.accounts), len(journal.roles))
+    else:
+        journal.reset()
+    try:
+        yield from _iter_account_configs(
+            client,
+            token,
+            _iter_accounts(client, token, journal),
+            instance,
+            regions,
+            profile_name_formatter,
+            safe_account_names,
+            journal,
+            discovery_filter)
+    finally:
+        journal.close()
+    if discovery_filter:
+        LOGGER.info("[%s] Filters skipped %s accounts and %s roles, saving at least %s ListAccountRoles calls",
+            sso_session, discovery_filter.accounts_skipped, discovery_filter.roles_skipped, discovery_filter.accounts_skipped)
+
+def _get_recent_profile():
+    return _read_section_configuration(AWS_SSO_CONFIG_PATH, AWS_SSO_PROFILE_IN_USE).get("profile")
+
+def _get_recent_sso_session():
+    """The sso-session of the profile in use, the most likely answer of the sso-session menu."""
+    profile = _get_recent_profile()
+    if not profile:
+        return None
+    start_url = _read_section_configuration(AWS_CONFIG_PATH, _add_prefix(profile)).get("sso_start_url")
+    for sso_session in get_sso_session_names():
+        if start_url and _read_section_configuration(AWS_CONFIG_PATH, f"sso-session {sso_session}").get("sso_start_url") == start_url:
+            return sso_session
+    return None
+
+def _prefetch_discovery(cancelled, sso_session, instance, discovery_filter, resume, force_refresh):
+    """List the accounts and roles of an sso-session to its journal while its menu is open.
+
+    Only a cached token is used, a new login needs the user. Returns True if the
+    journal was filled, so the discovery can resume from it."""
+    session = Session()
+    client = _get_sso_client(instance, session)
+    cached_token = None if force_refresh else get_token_cache().lookup(
+        start_url=instance.start_url,
+        session_name=sso_session,
+        region=instance.region,
+        min_valid=TOKEN_EXPIRY_WINDOW)
+    if cached_token is None or cancelled.is_set():
+        return False
+    token = cached_token.data
+    journal = DiscoveryJournal.for_instance(instance)
+    if resume:
+        journal.load()
+    else:
+        journal.reset()
+    try:
+        for account in _iter_accounts(client, token, journal):
+            if cancelled.is_set():
+                break
+            if discovery_filter is not None and not discovery_filter.include_account(account):
+                continue
+            _list_account_roles(client, token, account, journal)
+    finally:
+        journal.close()
+    return True
+
+def _start_discovery_prefetch(account_filter, role_filter, resume, force_refresh):
+    from aws_sso_lib.config import SSOInstance
+    sso_session = _get_recent_sso_session()
+    if sso_session is None:
+        return None
+    values = _read_section_configuration(AWS_CONFIG_PATH, f"sso-session {sso_session}")
+    if not values.get("sso_start_url") or not values.get("sso_region"):
+        return None
+    try:
+        discovery_filter = get_discovery_filter(sso_session, account_filter, role_filter)
+    except ValueError:
+        return None
+    instance = SSOInstance(values["sso_start_url"], values["sso_region"], "prefetch", "prefetch")
+    LOGGER.debug(f"Prefetching the accounts and roles of {sso_session}")
+    task = BackgroundTask(sso_session, _prefetch_discovery, sso_session, instance, discovery_filter, resume, force_refresh)
+    return task.start()
+
+def _prefetch_role_credentials(cancelled, profile_opts):
+    """Fetch the role credentials of the profile in use to the cache while the profile menu is open."""
+    import boto3
+    token = get_token_cache().lookup(
+        start_url=profile_opts.get("sso_start_url"),
+        session_name=profile_opts.get("sso_session"),
+        region=profile_opts.get("sso_region"),
+        min_valid=TOKEN_EXPIRY_WINDOW)
+    if token is None or cancelled.is_set():
+        return False
+    client = boto3.client("sso", region_name=profile_opts["sso_region"], endpoint_url=_get_endpoint_url("sso"))
+    with client_limiter(client).slot():
+        response = client.get_role_credentials(
+            roleName=profile_opts["sso_role_name"],
+            accountId=profile_opts["sso_account_id"],
+            accessToken=token.data["accessToken"])
+    get_credentials_cache().put(profile_opts["sso_account_id"], profile_opts["sso_role_name"], profile_opts.get("sso_start_url"), response["roleCredentials"])
+    return True
+
+def _select_profile_with_prefetch(sso_session):
+    """Show the profile menu, fetching the credentials of the profile in use meanwhile.
+
+    Returns the profile and whether its credentials were just fetched to the cache."""
+    recent_profile = _get_recent_profile()
+    profile_opts = _get_indexed_section(AWS_CONFIG_PATH, _add_prefix(recent_profile)) if recent_profile else None
+    task = None
+    if profile_opts and profile_opts.get("sso_account_id") and profile_opts.get("sso_role_name") and profile_opts.get("sso_region"):
+        task = BackgroundTask(recent_profile, _prefetch_role_credentials, profile_opts).start()
+    profile = get_config_profile_list(sso_session)
+    if task is None:
+        return profile, False
+    task.cancel()
+    if profile != recent_profile:
+        return profile, False
+    prefetched = bool(task.wait())
+    if prefetched:
+        LOGGER.debug(f"Using the credentials of {profile} fetched while the menu was open")
+    return profile, prefetched
+
+def _remove_journals(instances, failed_sessions):
+    # The journal of a failed sso-session is kept, so it can be resumed
+    for sso_session, instance in instances:
+        if sso_session not in failed_sessions:
+            DiscoveryJournal.for_instance(instance).remove()
+
+def _discover_concurrently(discoveries, failed_sessions):
+    """Run the discovery of every sso-session on its own thread and yield the accounts
+    as they arrive. A failing sso-session is reported and added to failed_sessions
+    without stopping the others."""
+    results = queue.Queue(maxsize=DISCOVERY_QUEUE_SIZE)
+
+    def run(sso_session, discovery):
+        num_accounts = 0
+        num_profiles = 0
+        try:
+            for account, configs in discovery:
+                num_accounts += 1
+                num_profiles += len(configs)
+                if num_accounts % DISCOVERY_PROGRESS_INTERVAL == 0:
+                    LOGGER.info("[%s] %s accounts and %s profiles so far", sso_session, num_accounts, num_profiles)
+                results.put((account, configs))
+            LOGGER.info("[%s] Done, %s accounts and %s profiles", sso_session, num_accounts, num_profiles)
+        except Exception as e:
+            failed_sessions.append(sso_session)
+            LOGGER.error("[%s] Unexpected error gathering accounts and roles: %s", sso_session, e)
+        finally:
+            results.put(_DISCOVERY_DONE)
+
+    for sso_session, discovery in discoveries:
+        threading.Thread(target=run, args=(sso_session, discovery), daemon=True).start()
+
+    pending = len(discoveries)
+    while pending:
+        item = results.get()
+        if item is _DISCOVERY_DONE:
+            pending -= 1
+        else:
+            yield item
+
+def _collect_discovered(configs, discovered):
+    # The sections written per start URL, recorded as the latest discovery for gc
+    for config in configs:
+        discovered.setdefault(config.sso_start_url, set()).add("profile {}".format(process_profile_name(config.profile_name)))
+        yield config
+
+def _record_discoveries(instances, discovery_filters, failed_sessions, discovered):
+    """Record the profiles of every complete discovery, a filtered or failed one doesn't
+    list all the profiles of its start URL."""
+    for sso_session, instance in instances:
+        if sso_session in failed_sessions or discovery_filters.get(sso_session):
+            continue
+        _record_discovery(instance.start_url, discovered.get(instance.start_url, set()))
+
+def _check_failed_sessions(failed_sessions, discoveries):
+    if not failed_sessions:
+        return
+    LOGGER.error("Failed sso-sessions: {}".format(", ".join(sorted(failed_sessions))))
+    if len(failed_sessions) == len(discoveries):
+        sys.exit(1)
+
+def _iter_configs(account_configs):
+    for account, configs in account_configs:
+        for config in configs:
+            yield config
+
+def _sorted_configs(configs):
+    """Sort the profiles by name. The config transaction, the manifest and the
+    discovery record keep every profile until the end anyway, so they are sorted in
+    memory as the compact ConfigParams records."""
+    return sorted(configs, key=lambda v: v.profile_name)
+
+def _config_value(value):
+    # Nested values (e.g. s3 settings) are written as indented key = value lines
+    if isinstance(value, dict):
+        return "".join("\n{} = {}".format(k, v) for k, v in value.items())
+    return str(value)
+
+def _write_configs(session, configs, config_default, existing_config_action, sections):
+    """Add each profile to the aws config file and pass it along to the next stage.
+
+    The profiles are collected on the config transaction, so each file is written once
+    for all of them instead of once per profile."""
+    config_filename = get_config_filename(session)
+    credentials_filename = os.path.expanduser(session.get_config_variable("credentials_file"))
+    with config_transaction() as transaction:
+        for config in configs:
+            LOGGER.debug("Processing config: %s", config)
+            config_values = _get_config_values(config, config_default, existing_config_action)
+            LOGGER.debug("Config values for profile %s: %s", config.profile_name, config_values)
+            # Same split as aws_sso_lib write_values, the keys always go to the credentials file
+            credentials_values = {k: config_values.pop(k) for k in CREDENTIALS_KEYS if k in config_values}
+            if credentials_values:
+                transaction.set_section(credentials_filename, config.profile_name, credentials_values)
+            # The section is replaced, the existing values are already loaded by _get_config_values
+            section = "profile {}".format(process_profile_name(config.profile_name))
+            transaction.set_section(config_filename, section, {k: _config_value(v) for k, v in config_values.items()})
+            sections.append(section)
+            yield config
+
+def _get_config_values(config, config_default, existing_config_action):
+    config_values = {}
+    existing_config = {}
+    if existing_config_action != "discard":
+        # Read through the config transaction and the profile index, a botocore session per profile parses the whole file
+        existing_config = _get_indexed_section(AWS_CONFIG_PATH, "profile {}".format(process_profile_name(config.profile_name))) or {}
+        config_values.update(existing_config)
+
+    config_values.update({
+        "sso_start_url": config.sso_start_url,
+        "sso_region": config.sso_region,
+    })
+    if config.account_name != config.account_id:
+        config_values["sso_account_name"] = config.account_name
+    config_values.update({
+        "sso_account_id": config.account_id,
+        "sso_role_name": config.role_name,
+        "region": config.region,
+    })
+    for k, v in config_default.items():
+        if k in existing_config and existing_config_action in ["keep"]:
+            continue
+        config_values[k] = v
+    return config_values
+
+def _export_account_configs(account_configs, writer):
+    try:
+        for account, configs in account_configs:
+            for config in configs:
+                writer.add(config)
+            yield account, configs
+    except BaseException:
+        # The discovery or the writing of the profiles failed, nothing is exported
+        writer.abort()
+        raise
+
+def _inventory_configs(inventory, discovery_filters):
+    """Yield the profiles of an inventory, with the filters of their sso-session (by start URL) applied."""
+    for profile in inventory.get("profiles", []):
+        discovery_filter = discovery_filters.get(profile["sso_start_url"])
+        if discovery_filter and not (
+                discovery_filter.accounts.matches(profile["account_name"], profile["account_id"]) and
+                discovery_filter.roles.matches(profile["role_name"])):
+            continue
+        yield ConfigParams(
+            profile["profile_name"],
+            profile["account_name"],
+            profile["account_id"],
+            profile["role_name"],
+            profile["region"],
+            profile["sso_start_url"],
+            profile["sso_region"],
+            profile["proxy_role_name"])
+
+def _import_inventory(path, config_default, existing_config_action, account_filter, role_filter, materialize_policy):
+    """Write the profiles of an inventory without calling AWS SSO.
+
+    Returns the inventory, the access to each profile is only verified when it is used."""
+    try:
+        inventory = load_inventory(path)
+    except InventoryError as e:
+        raise click.UsageError(str(e))
+    LOGGER.info("Importing the inventory {} ({})".format(path, inventory.get("exported_by")))
+
+    discovery_filters = {}
+    for sso_session, values in inventory.get("sso_sessions", {}).items():
+        try:
+            discovery_filters[values["sso_start_url"]] = get_discovery_filter(sso_session, account_filter, role_filter)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+
+    session = Session()
+    with log_phase(LOGGER, "inventory_config"):
+        added_sessions, added_sections = apply_inventory_config(inventory)
+    if added_sessions:
+        LOGGER.info("Added the sso-sessions {} to {}".format(", ".join(added_sessions), AWS_CONFIG_PATH))
+    if added_sections:
+        LOGGER.info("Added the sections {} to {}".format(", ".join(added_sections), AWS_SSO_CONFIG_PATH))
+    LOGGER.info("Writing profiles to %s", get_config_filename(session))
+    with log_phase(LOGGER, "profiles") as phase:
+        sections = []
+        discovered = {}
+        configs = _sorted_configs(_inventory_configs(inventory, discovery_filters))
+        configs = _write_configs(session, configs, config_default, existing_config_action, sections)
+        _create_credentials_profile(_collect_discovered(configs, discovered), materialize_policy)
+        _record_generated_sections(get_config_filename(session), sections)
+        phase["profiles"] = len(sections)
+    # An unfiltered inventory lists every profile of its start URLs, like a discovery
+    for start_url, discovery_filter in discovery_filters.items():
+        if not discovery_filter:
+            _record_discovery(start_url, discovered.get(start_url, set()))
+    return inventory
+
+def _get_inventory_token(inventory, profile, force_refresh):
+    """Log in to the SSO instance of an imported profile only, the first access check of the inventory."""
+    from aws_sso_lib.config import SSOInstance
+    for values in inventory.get("profiles", []):
+        if values["profile_name"] == profile:
+            break
+    else:
+        raise click.UsageError(f"The profile {profile} is not on the inventory")
+    sso_session = None
+    for name, session_values in inventory.get("sso_sessions", {}).items():
+        if session_values["sso_start_url"] == values["sso_start_url"]:
+            sso_session = name
+    instance = SSOInstance(values["sso_start_url"], values["sso_region"], "inventory", "inventory")
+    with log_phase(LOGGER, "token", sso_session=sso_session):
+        _get_token(Session(), instance, sso_session, force_refresh)
+
+def _use_profile(profile_name, custom_profile_arg, pre_assume, use_cache=False):
+    with log_phase(LOGGER, "credentials", profile=_get_profile_name(profile_name)):
+        _set_profile_credentials(profile_name, custom_profile_arg is None, custom_profile_arg, use_cache=use_cache)
+        _set_profile_in_use(profile_name)
+    if pre_assume:
+        with log_phase(LOGGER, "pre_assume"):
+            pre_assume_proxy_roles()
+
+def _finish_export(inventory_writer, failed_sessions):
+    if inventory_writer is None:
+        return
+    if failed_sessions:
+        # A partial inventory would make the imports drop the profiles of the failed sso-sessions
+        inventory_writer.abort()
+        LOGGER.error(f"The inventory {inventory_writer.path} was not exported, some sso-sessions failed")
+    else:
+        inventory_writer.commit()
+        LOGGER.info(f"Exported {inventory_writer.num_profiles} profiles to {inventory_writer.path}")
+
+def _get_materialize_policy(materialize):
+    try:
+        return get_materialize_policy(materialize)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+def _collect_garbage():
+    from .garbage_collect import collect_garbage, _summary
+    with log_phase(LOGGER, "gc") as phase:
+        garbage = collect_garbage()
+        phase["removed"] = len(garbage)
+    for item in garbage:
+        LOGGER.debug(f"Removed the {item.kind} {item.name}: {item.reason}")
+    LOGGER.info(_summary(garbage, False))
+
+def _dry_run(account_configs, config_default, existing_config_action, dry_run_format):
+    """Print the profiles of every account as soon as they are discovered, then a summary."""
+    started = time.monotonic()
+    num_accounts = 0
+    num_profiles = 0
+    for account, configs in account_configs:
+        num_accounts += 1
+        for config in configs:
+            num_profiles += 1
+            config_values = _get_config_values(config, config_default, existing_config_action)
+            if dry_run_format == "json":
+                print(json.dumps({"type": "profile", "profile_name": config.profile_name, "config": config_values}))
+            else:
+                lines = [
+                    "[profile {}]".format(process_profile_name_formatter(config.profile_name))
+                ]
+                for key, value in config_values.items():
+                    lines.append("{} = {}".format(key, value))
+                lines.append("")
+                print("\n".join(lines))
+        sys.stdout.flush()
+
+    elapsed = round(time.monotonic() - started, 3)
+    if dry_run_format == "json":
+        print(json.dumps({"type": "summary", "accounts": num_accounts, "profiles": num_profiles, "elapsed_seconds": elapsed}))
+    else:
+        print("# Dry run for {} profiles from {} accounts in {}s".format(num_profiles, num_accounts, elapsed))
 
 @click.command()
 @click.option("--eks", is_flag=True, help="The flag to use for the update-kubeconfig")
@@ -57,13 +677,16 @@ ConfigParams = namedtuple("ConfigParams", ["profile_name", "account_name", "acco
 @click.option("--custom-profile", "custom_profile_arg", help="The profile name to copy the aws sso credentials")
 @click.option("--eks-profile", "eks_profile_arg", help="The eks profile name to use")
 @click.option("--cluster", "cluster_arg", help="The eks cluster name to use, this argument is only allowed using the --eks flag")
+@click.option("--sso-session", "sso_session_arg", multiple=True, help="The sso-session name to use instead of selecting it from the menu, can provide multiple times")
+@click.option("--all-sessions", is_flag=True, help="Log in to every sso-session on the aws config file at the same time")
 @click.option("--sso-start-url", "-u", metavar="URL", help="Your AWS SSO start URL")
 @click.option("--sso-region", help="The AWS region your AWS SSO instance is deployed in")
 @click.option("--region", "-r", "regions", multiple=True, metavar="REGION", help="AWS region for the profiles, can provide multiple times")
 @click.option("--dry-run", is_flag=True, help="Print the config to stdout instead of writing to your config file")
+@click.option("--dry-run-format", type=click.Choice(["ini", "json"]), default="ini", help="Print the dry run profiles as INI blocks or JSON Lines, streamed per account")
 @click.option("--config-default", "-c", multiple=True, metavar="KEY=VALUE", help="Additional config field to set, can provide multiple times")
 @click.option("--existing-config-action", type=click.Choice(["keep", "overwrite", "discard"]), default="keep", help="Action when config defaults conflict with existing settings")
-@click.option("--components", "profile_name_components", metavar="VALUE,VALUE,...", default="account_name,role_name,default_style_region", help="Profile name components to join (comma-separated)")
+@click.option("--components", "profile_name_components", metavar="VALUE,VALUE,...", default=DEFAULT_COMPONENTS, help="Profile name components to join (comma-separated)")
 @click.option("--separator", "--sep", "profile_name_separator", metavar="SEP", help=f"Separator for profile name components, default is '{DEFAULT_SEPARATOR}'")
 @click.option("--include-region", "profile_name_include_region", type=click.Choice(["default", "always"]), default="default", help="By default, the first region is left off the profile name")
 @click.option("--region-style", "profile_name_region_style", type=click.Choice(["short", "long"]), default="short", help="Default is five character region abbreviations")
@@ -72,6 +695,14 @@ ConfigParams = namedtuple("ConfigParams", ["profile_name", "account_name", "acco
 @click.option("--profile-name-process")
 @click.option("--safe-account-names/--raw-account-names", default=True, help="In profiles, replace any character sequences not in A-Za-z0-9-._ with a single -")
 @click.option("--force-refresh", is_flag=True, help="Re-login")
+@click.option("--account-filter", "account_filter", multiple=True, metavar="PATTERN", help="Only the accounts matching a name, id, glob, re:REGEX or @FILE of patterns, can provide multiple times")
+@click.option("--role-filter", "role_filter", multiple=True, metavar="PATTERN", help="Only the roles matching a name, glob, re:REGEX or @FILE of patterns, can provide multiple times")
+@click.option("--pre-assume", is_flag=True, help="Assume the proxy role of every profile up front and write its credentials, so the SDKs don't assume it on every process")
+@click.option("--resume", is_flag=True, help="Continue the discovery of accounts and roles where an interrupted login stopped")
+@click.option("--export-inventory", metavar="FILE", help="Also write the discovered profiles, with the aliases and proxy roles applied, to a JSON inventory to share")
+@click.option("--import-inventory", metavar="FILE", help="Write the profiles of an exported inventory instead of discovering them, only the selected profile is checked on AWS SSO")
+@click.option("--materialize", type=click.Choice(MATERIALIZE_POLICIES), help="Which profiles get their proxy role on the credentials file: all, pinned, recent or on-demand, the others are written when used. Default from the [materialize] section of the aws-sso-magic config file, or all")
+@click.option("--gc", is_flag=True, envvar="AWS_SSO_MAGIC_GC", help="Remove the expired SSO cache entries and the generated profiles not found anymore, like the gc command")
 @click.option("--verbose", "-v", count=True)
 
 def login(
@@ -80,10 +711,13 @@ def login(
         custom_profile_arg,
         eks_profile_arg,
         cluster_arg,
+        sso_session_arg,
+        all_sessions,
         sso_start_url,
         sso_region,    
         regions,
         dry_run,
+        dry_run_format,
         config_default,
         existing_config_action,
         profile_name_components,
@@ -95,6 +729,14 @@ def login(
         profile_name_process,
         safe_account_names,
         force_refresh,
+        account_filter,
+        role_filter,
+        pre_assume,
+        resume,
+        export_inventory,
+        import_inventory,
+        materialize,
+        gc,
         verbose):
     """Log in to the AWS SSO instance.
 
@@ -103,20 +745,72 @@ def login(
     """
     configure_logging(LOGGER, verbose)
     _check_flag_combinations(eks, profile_arg, cluster_arg, eks_profile_arg, custom_profile_arg)
-    _check_aws_v2()
+    if not dry_run:
+        # the dry run output is meant to be piped, and it doesn't use the aws cli
+        _check_aws_v2()
+
+    if import_inventory:
+        conflicts = [name for name, value in [("--export-inventory", export_inventory), ("--dry-run", dry_run), ("--resume", resume),
+                                              ("--sso-session", sso_session_arg), ("--all-sessions", all_sessions)] if value]
+        if conflicts:
+            raise click.UsageError("--import-inventory can't be used with {}".format(", ".join(conflicts)))
+        config_default = dict(v.split("=", 1) for v in config_default)
+        inventory = _import_inventory(import_inventory, config_default, existing_config_action, account_filter, role_filter, _get_materialize_policy(materialize))
+        if gc:
+            _collect_garbage()
+        if eks:
+            with log_phase(LOGGER, "eks"):
+                _eks_cluster_configuration(cluster_arg, eks_profile_arg)
+        elif profile_arg is None:
+            LOGGER.info("Run aws-sso-magic login --profile <profile> or aws-sso-magic use <profile> to use one of the profiles")
+        else:
+            _get_inventory_token(inventory, profile_arg, force_refresh)
+            _use_profile(_add_prefix(profile_arg), custom_profile_arg, pre_assume)
+        return
 
     missing = []
 
-    try:
-        instance, sso_session_selected = get_instance(
-            sso_start_url,
-            sso_region,
-            sso_start_url_vars=CONFIGURE_DEFAULT_START_URL_VARS,
-            sso_region_vars=CONFIGURE_DEFAULT_SSO_REGION_VARS,
-            profile_name=profile_arg)
-    except GetInstanceError as e:
-        LOGGER.fatal(str(e))
+    if all_sessions:
+        sso_sessions = get_sso_session_names()
+    else:
+        sso_sessions = list(sso_session_arg) or [None]
+
+    # The sso-session menu is shown, the most recently used one is discovered meanwhile
+    prefetch = None
+    if sso_sessions == [None]:
+        prefetch = _start_discovery_prefetch(account_filter, role_filter, resume, force_refresh)
+
+    instances = []
+    with log_phase(LOGGER, "instances") as phase:
+        for sso_session in sso_sessions:
+            try:
+                instance, sso_session = get_instance(
+                    sso_start_url,
+                    sso_region,
+                    sso_start_url_vars=CONFIGURE_DEFAULT_START_URL_VARS,
+                    sso_region_vars=CONFIGURE_DEFAULT_SSO_REGION_VARS,
+                    profile_name=profile_arg,
+                    sso_session=sso_session)
+            except GetInstanceError as e:
+                LOGGER.fatal(str(e))
+                if len(sso_sessions) == 1:
+                    sys.exit(1)
+                continue
+            instances.append((sso_session, instance))
+        phase["instances"] = len(instances)
+
+    if prefetch is not None:
+        # Stops after the call in flight, what it listed is on the journal of its sso-session
+        prefetch.cancel()
+        prefetched = prefetch.wait()
+        if prefetched and instances and instances[0][0] == prefetch.name:
+            LOGGER.info(f"Continuing the discovery of {prefetch.name} started while the menu was open")
+            resume = True
+
+    if not instances:
+        LOGGER.fatal("No AWS SSO instance found, run aws-sso-magic configure")
         sys.exit(1)
+    sso_session_selected = instances[0][0]
 
     if not regions:
         for var_name in CONFIGURE_DEFAULT_REGION_VARS:
@@ -137,42 +831,17 @@ def login(
     else:
         config_default = {}
 
-    if not profile_name_separator:
-        profile_name_separator = os.environ.get("AWS_CONFIGURE_SSO_DEFAULT_PROFILE_NAME_SEPARATOR") or DEFAULT_SEPARATOR
-
-    if profile_name_process:
-        profile_name_formatter = get_process_formatter(profile_name_process)
-    else:
-        region_format, no_region_format = generate_profile_name_format(profile_name_components, profile_name_separator, profile_name_region_style)
-        LOGGER.debug("Profile name format (region):    {}".format(region_format))
-        LOGGER.debug("Profile name format (no region): {}".format(no_region_format))
-        profile_name_formatter = get_formatter(profile_name_include_region, region_format, no_region_format)
-        if profile_name_trim_account_name_patterns or profile_name_trim_role_name_patterns:
-            profile_name_formatter = get_trim_formatter(profile_name_trim_account_name_patterns, profile_name_trim_role_name_patterns, profile_name_formatter)
-
-    try:
-        profile_name_formatter(0, 1, account_name="foo", account_id="bar", role_name="baz", region="us-east-1")
-    except Exception as e:
-        raise click.UsageError("Invalid profile name format: {}".format(e))
+    profile_name_formatter = _get_profile_name_formatter(
+        profile_name_components,
+        profile_name_separator,
+        profile_name_include_region,
+        profile_name_region_style,
+        profile_name_trim_account_name_patterns,
+        profile_name_trim_role_name_patterns,
+        profile_name_process)
 
     session = Session()
 
-    token_fetcher = get_token_fetcher(session,
-            instance.region,
-            interactive=True,
-            )
-
-    LOGGER.info(f"Logging in to {instance.start_url}")
-    token = token_fetcher.fetch_token(instance.start_url, force_refresh=force_refresh)
-
-    LOGGER.debug("Token: {}".format(token))
-
-    config = botocore.config.Config(
-        region_name=instance.region,
-        signature_version=botocore.UNSIGNED,
-    )
-    client = session.create_client("sso", config=config)
-
     LOGGER.info("Gathering accounts and roles")
 
     aws_sso_magic_conf = _read_aws_sso_config_file(AWS_SSO_CONFIG_PATH, AWS_SSO_CONFIG_ALIAS)
@@ -182,133 +851,66 @@ def login(
     else:
         LOGGER.info(f"No section: {AWS_SSO_CONFIG_ALIAS} found on the file {AWS_SSO_CONFIG_PATH}")        
 
-    accounts = []
-    list_accounts_args = {
-        "accessToken": token["accessToken"]
-    }
-    while True:
-        response = client.list_accounts(**list_accounts_args)
-
-        accounts.extend(response["accountList"])
-
-        next_token = response.get("nextToken")
-        if not next_token:
-            break
-        else:
-            list_accounts_args["nextToken"] = response["nextToken"]
-
-    LOGGER.debug("Account list: {} {}".format(len(accounts), accounts))
-
-    configs = []
-    for account in accounts:
-        if not account.get("accountName"):
-            account["accountName"] = account["accountId"]
-
-        LOGGER.debug("Getting roles for {}".format(account["accountId"]))
-        list_role_args = {
-            "accessToken": token["accessToken"],
-            "accountId": account["accountId"],
-        }
-
-        num_regions = len(regions)
-        while True:
-            response = client.list_account_roles(**list_role_args)
-
-            for role in response["roleList"]:
-                for i, region in enumerate(regions):
-                    if safe_account_names:
-                        account_name_for_profile = get_safe_account_name(account["accountName"])
-                    else:
-                        account_name_for_profile = account["accountName"]
-
-                    profile_name = profile_name_formatter(i, num_regions,
-                        account_name=account_name_for_profile,
-                        account_id=account["accountId"],
-                        role_name=role["roleName"],
-                        region=region,
-                    )
-                    profile_name = process_profile_name_formatter(profile_name)
-                    if profile_name == "SKIP":
-                        continue
-                    configs.append(ConfigParams(profile_name, account["accountName"], account["accountId"], role["roleName"], region))
-
-            next_token = response.get("nextToken")
-            if not next_token:
-                break
-            else:
-                list_role_args["nextToken"] = response["nextToken"]
-
-
-    configs.sort(key=lambda v: v.profile_name)
-
-    LOGGER.debug("Got configs: {}".format(configs))
-
-    if not dry_run:
-        LOGGER.info("Writing {} profiles to {}".format(len(configs), get_config_filename(session)))
-
-        config_writer = ConfigFileWriter()
-        def write_config(profile_name, config_values):
-            # discard because we're already loading the existing values
-            write_values(session, profile_name, config_values, existing_config_action="discard", config_file_writer=config_writer)
+    discoveries = []
+    discovery_filters = {}
+    for sso_session, instance in instances:
+        try:
+            discovery_filter = discovery_filters[sso_session] = get_discovery_filter(sso_session, account_filter, role_filter)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        discoveries.append((sso_session, _discover(instance, sso_session, regions, profile_name_formatter, safe_account_names, force_refresh, resume, discovery_filter)))
+    failed_sessions = []
+    if len(discoveries) == 1:
+        account_configs = discoveries[0][1]
     else:
-        LOGGER.info("Dry run for {} profiles".format(len(configs)))
-        def write_config(profile_name, config_values):
-            lines = [
-                "[profile {}]".format(process_profile_name_formatter(profile_name))
-            ]
-            for key, value in config_values.items():
-                lines.append("{} = {}".format(key, value))
-            lines.append("")
-            print("\n".join(lines))
-
-    for config in configs:
-        LOGGER.debug("Processing config: {}".format(config))
-        config_values = {}
-        existing_profile = False
-        existing_config = {}
-        if existing_config_action != "discard":
-            try:
-                existing_config = Session(profile=config.profile_name).get_scoped_config()
-                config_values.update(existing_config)
-                existing_profile = True
-            except ProfileNotFound:
-                pass
-
-        config_values.update({
-            "sso_start_url": instance.start_url,
-            "sso_region": instance.region,
-        })
-        if config.account_name != config.account_id:
-            config_values["sso_account_name"] = config.account_name
-        config_values.update({
-            "sso_account_id": config.account_id,
-            "sso_role_name": config.role_name,
-            "region": config.region,
-        })
-        for k, v in config_default.items():
-            if k in existing_config and existing_config_action in ["keep"]:
-                continue
-            config_values[k] = v
-        LOGGER.debug("Config values for profile {}: {}".format(config.profile_name, config_values))
-        write_config(config.profile_name, config_values)
+        account_configs = _discover_concurrently(discoveries, failed_sessions)
+    inventory_writer = None
+    if export_inventory:
+        inventory_writer = InventoryWriter(export_inventory, instances)
+        # Its temporary file is removed if the command ends before the export is committed
+        click.get_current_context().call_on_close(inventory_writer.abort)
+        account_configs = _export_account_configs(account_configs, inventory_writer)
+
+    if dry_run:
+        with log_phase(LOGGER, "dry_run"):
+            _dry_run(account_configs, config_default, existing_config_action, dry_run_format)
+        _finish_export(inventory_writer, failed_sessions)
+        _remove_journals(instances, failed_sessions)
+        _check_failed_sessions(failed_sessions, discoveries)
+        return
+
+    materialize_policy = _get_materialize_policy(materialize)
+    LOGGER.info("Writing profiles to %s", get_config_filename(session))
+
+    # Discovery, sorting and writing are streamed, so they are timed as a single phase
+    with log_phase(LOGGER, "profiles") as phase:
+        sections = []
+        discovered = {}
+        configs = _sorted_configs(_iter_configs(account_configs))
+        configs = _write_configs(session, configs, config_default, existing_config_action, sections)
+        _create_credentials_profile(_collect_discovered(configs, discovered), materialize_policy)
+        _record_generated_sections(get_config_filename(session), sections)
+        phase["profiles"] = len(sections)
+    _finish_export(inventory_writer, failed_sessions)
+    _remove_journals(instances, failed_sessions)
+    _record_discoveries(instances, discovery_filters, failed_sessions, discovered)
+    if gc:
+        _collect_garbage()
+    _check_failed_sessions(failed_sessions, discoveries)
 
     global VERBOSE
 
-    default_profile = True
-
-    _create_credentials_profile(configs)
-
     if not eks:
+        prefetched = False
         if profile_arg == None:
-            profile_name = _add_prefix(get_config_profile_list(sso_session_selected))
+            profile, prefetched = _select_profile_with_prefetch(sso_session_selected)
+            profile_name = _add_prefix(profile)
         else:
             profile_name = _add_prefix(profile_arg)
-        if custom_profile_arg != None:
-            default_profile = False
-        _set_profile_credentials(profile_name, default_profile, custom_profile_arg)
-        _set_profile_in_use(profile_name)
+        _use_profile(profile_name, custom_profile_arg, pre_assume, use_cache=prefetched)
     else:
-        _eks_cluster_configuration(cluster_arg, eks_profile_arg)
+        with log_phase(LOGGER, "eks"):
+            _eks_cluster_configuration(cluster_arg, eks_profile_arg)
 
 if __name__ == "__main__":
     login(prog_name="python -m aws_sso_magic.login")  #pylint: disable=unexpected-keyword-arg,no-value-for-parameter
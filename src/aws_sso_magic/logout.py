@@ -11,24 +11,80 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
-import subprocess
+import json
 import logging
+import os
+import boto3
+import botocore
 import click
-import sys
 
-from .utils import _check_aws_v2, configure_logging, _read_config, _write_config
+from pathlib import Path
+from .credentials_cache import get_credentials_cache
+from .proxy_credentials import PRE_ASSUMED_ROLE_ARN_KEY
+from .token_cache import get_token_cache
+from .utils import configure_logging, log_phase, _read_config, _write_config, _get_endpoint_url
+from .utils import _forget_generated_sections, _load_manifest
 from .utils import (
-    AWS_CREDENTIAL_PATH
+    AWS_CONFIG_PATH,
+    AWS_CREDENTIAL_PATH,
+    AWS_SSO_PROFILE,
+    AWS_DEFAULT_PROFILE
 )
 
 LOGGER = logging.getLogger(__name__)
 
+AWS_CLI_CACHE_PATH = f'{Path.home()}/.aws/cli/cache'
 
-def _default_profile_exists(config):
-    if config.has_section('default'):
-        config.remove_section('default')
-        return True
-    return False
+
+def _generated_credentials_sections(config):
+    # Sections written before the manifest existed are recognised by the aws-sso source profile
+    sections = [AWS_DEFAULT_PROFILE, AWS_SSO_PROFILE]
+    for section in config.sections():
+        if config.get(section, "source_profile", fallback=None) == AWS_SSO_PROFILE:
+            sections.append(section)
+        elif config.has_option(section, PRE_ASSUMED_ROLE_ARN_KEY):
+            sections.append(section)
+    return sections
+
+def _remove_sections(path, sections):
+    if not os.path.isfile(path):
+        return 0
+    config = _read_config(path)
+    removed = [section for section in set(sections) if config.remove_section(section)]
+    if removed:
+        _write_config(path, config)
+    LOGGER.info(f"{len(removed)} generated sections removed from {path}")
+    return len(removed)
+
+def _sso_logout(token_cache):
+    for token in token_cache.tokens:
+        try:
+            client = boto3.client("sso", region_name=token.region, endpoint_url=_get_endpoint_url("sso"))
+            client.logout(accessToken=token.access_token)
+            LOGGER.info(f"Logged out of {token.start_url or token.session_name}")
+        except botocore.exceptions.ClientError as e:
+            # An expired or already revoked token is logged out anyway
+            LOGGER.debug(f"Logout of {token.start_url} returned {e}")
+        except (botocore.exceptions.BotoCoreError, ValueError) as e:
+            # No region or an invalid endpoint, the other tokens are still logged out
+            LOGGER.error(f"Unexpected error logging out of {token.start_url}: {e}")
+        try:
+            os.remove(token.path)
+        except OSError as e:
+            LOGGER.debug(f"Unable to delete {token.path}: {e}")
+
+def _remove_cli_cached_credentials():
+    if not os.path.isdir(AWS_CLI_CACHE_PATH):
+        return
+    for file_name in os.listdir(AWS_CLI_CACHE_PATH):
+        path = os.path.join(AWS_CLI_CACHE_PATH, file_name)
+        try:
+            with open(path) as context:
+                data = json.load(context)
+            if data.get("ProviderType") == "sso":
+                os.remove(path)
+        except (OSError, ValueError, AttributeError):
+            continue
 
 @click.command("logout")
 
@@ -37,26 +93,36 @@ def logout():
 
     Note this only needs to be done once for a given SSO instance (i.e., start URL),
     as all profiles sharing the same start URL will share the same login.
-    """    
-    configure_logging(LOGGER, False)
-    _check_aws_v2()
-    
-    try:
-        subprocess.run(['aws'] + [ 'sso', 'logout'], stderr=sys.stderr, stdout=sys.stdout, check=True)
-        LOGGER.info("aws sso logout command executed successfully")
-    except subprocess.CalledProcessError as e:
-        LOGGER.error("Unexpected error on the logout command")
-        exit(1)
-
-    config = _read_config(AWS_CREDENTIAL_PATH)
-
-    if _default_profile_exists(config):
-        _write_config(AWS_CREDENTIAL_PATH, config)
-        LOGGER.info("default profile credentials deleted")
-    else:
-        LOGGER.info("Nothing to do, default profile credentials not found")
-    
+
+    It also removes the profiles generated by the login command.
+    """
+    configure_logging(LOGGER, 0)
+
+    with log_phase(LOGGER, "sso_logout"):
+        _sso_logout(get_token_cache())
+        _remove_cli_cached_credentials()
+        get_credentials_cache().clear()
+    LOGGER.info("aws sso logout executed successfully")
+
+    manifest_files = _load_manifest()["files"]
+    files = {
+        AWS_CONFIG_PATH: [AWS_SSO_PROFILE],
+        AWS_CREDENTIAL_PATH: _generated_credentials_sections(_read_config(AWS_CREDENTIAL_PATH)),
+    }
+    for path in manifest_files:
+        files.setdefault(path, [])
+
+    with log_phase(LOGGER, "purge") as phase:
+        removed = 0
+        for path, sections in files.items():
+            removed += _remove_sections(path, sections + manifest_files.get(path, []))
+        _forget_generated_sections(list(manifest_files))
+        phase["removed"] = removed
+
+    if not removed:
+        LOGGER.info("Nothing to do, generated profiles not found")
+
     LOGGER.info("Done!, please use the aws-sso-magic login command to come back again")
 
 if __name__ == "__main__":
-    logout(prog_name="python -m aws_sso_magic.logout") 
\ No newline at end of file
+    logout(prog_name="python -m aws_sso_magic.logout")
@@ -0,0 +1,102 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import logging
+
+from datetime import datetime, timedelta
+from dateutil.tz import UTC
+
+from .filters import NameFilter
+from .proxy_credentials import PRE_ASSUMED_ROLE_ARN_KEY
+from .utils import configure_logging, _read_config, _write_config, _read_aws_sso_config_file, _get_indexed_section
+from .utils import _get_profile_name, _add_prefix, _get_role_name, _create_profilename_child_credentials
+from .utils import _record_generated_sections, _get_profile_uses
+from .utils import (
+    AWS_CONFIG_PATH,
+    AWS_CREDENTIAL_PATH,
+    AWS_SSO_CONFIG_PATH,
+    AWS_SSO_PROFILE,
+    AWS_SSO_PROFILE_IN_USE
+)
+
+LOGGER = logging.getLogger(__name__)
+
+MATERIALIZE_SECTION = "materialize"
+MATERIALIZE_POLICIES = ["all", "pinned", "recent", "on-demand"]
+MATERIALIZE_DEFAULT_POLICY = "all"
+POLICY_KEY = "policy"
+PINNED_KEY = "pinned"
+RECENT_DAYS_KEY = "recent_days"
+DEFAULT_RECENT_DAYS = 7
+
+def _is_child_section(credentials, section):
+    return (credentials.get(section, "source_profile", fallback=None) == AWS_SSO_PROFILE
+            or credentials.has_option(section, PRE_ASSUMED_ROLE_ARN_KEY))
+
+class MaterializePolicy:
+    """Which generated profiles get their child section (the proxy role) on the credentials file.
+
+    all writes every profile, pinned the ones matching the pinned patterns, recent also the
+    ones used within recent_days, on-demand none of them. The profile in use is always
+    written, and any other one is written the first time it's used.
+    """
+    def __init__(self, policy, pinned=(), recent_days=DEFAULT_RECENT_DAYS, used=None, in_use=None):
+        if policy not in MATERIALIZE_POLICIES:
+            raise ValueError(f"Invalid materialize policy {policy}, use one of {', '.join(MATERIALIZE_POLICIES)}")
+        self.policy = policy
+        self.pinned = NameFilter(pinned)
+        self.in_use = in_use
+        self.recently_used = set()
+        if policy == "recent":
+            from dateutil.parser import parse
+            since = datetime.now(UTC) - timedelta(days=recent_days)
+            self.recently_used = {name for name, at in (used or {}).items() if parse(at) >= since}
+
+    def includes(self, profile_name):
+        if self.policy == "all" or profile_name == self.in_use:
+            return True
+        if self.policy in ["pinned", "recent"] and self.pinned and self.pinned.matches(profile_name):
+            return True
+        return profile_name in self.recently_used
+
+def get_materialize_policy(policy=None):
+    """The policy given (e.g. by the --materialize option) or the one of the [materialize]
+    section of the aws-sso-magic config file, all by default."""
+    values = _read_aws_sso_config_file(AWS_SSO_CONFIG_PATH, MATERIALIZE_SECTION)
+    try:
+        recent_days = int(values.get(RECENT_DAYS_KEY) or DEFAULT_RECENT_DAYS)
+    except ValueError:
+        raise ValueError(f"Invalid {RECENT_DAYS_KEY} {values.get(RECENT_DAYS_KEY)} on the [{MATERIALIZE_SECTION}] section of {AWS_SSO_CONFIG_PATH}")
+    return MaterializePolicy(
+        policy or values.get(POLICY_KEY) or MATERIALIZE_DEFAULT_POLICY,
+        [pattern for pattern in (values.get(PINNED_KEY) or "").split(",")],
+        recent_days,
+        _get_profile_uses(),
+        _read_aws_sso_config_file(AWS_SSO_CONFIG_PATH, AWS_SSO_PROFILE_IN_USE).get("profile"))
+
+def materialize_profile(profile_name):
+    """Write the child section of a generated profile left out by the materialize policy,
+    the SDKs need it to assume the proxy role. Returns True if it was written."""
+    configure_logging(LOGGER, False)
+    profile_name = _get_profile_name(profile_name)
+    credentials = _read_config(AWS_CREDENTIAL_PATH)
+    if credentials.has_section(profile_name):
+        return False
+    profile = _get_indexed_section(AWS_CONFIG_PATH, _add_prefix(profile_name))
+    if profile is None or not profile.get("sso_account_id"):
+        return False
+    _create_profilename_child_credentials(credentials, AWS_SSO_PROFILE, profile_name, _get_role_name(profile_name))
+    _write_config(AWS_CREDENTIAL_PATH, credentials)
+    _record_generated_sections(AWS_CREDENTIAL_PATH, [profile_name])
+    LOGGER.debug(f"Profile {profile_name} written to {AWS_CREDENTIAL_PATH} on first use")
+    return True
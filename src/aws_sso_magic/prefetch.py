@@ -0,0 +1,56 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+class BackgroundTask:
+    """Speculative work run on a daemon thread while a prompt waits for the user.
+
+    The target gets a threading.Event as its first argument, set when the task is
+    cancelled, and it should check it between calls. Errors are only logged at debug
+    level, whatever the task didn't finish is done again in the foreground.
+    """
+    def __init__(self, name, target, *args, **kwargs):
+        self.name = name
+        self.cancelled = threading.Event()
+        self.result = None
+        self.elapsed = None
+        self._target = target
+        self._args = args
+        self._kwargs = kwargs
+        self._thread = threading.Thread(target=self._run, name=f"prefetch-{name}", daemon=True)
+
+    def _run(self):
+        started = time.monotonic()
+        try:
+            self.result = self._target(self.cancelled, *self._args, **self._kwargs)
+        except Exception as e:
+            LOGGER.debug(f"Prefetch {self.name} failed: {e}")
+        finally:
+            self.elapsed = time.monotonic() - started
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def wait(self, timeout=None):
+        """Wait for the task, a cancelled one only finishes the call in flight. Returns its result."""
+        self._thread.join(timeout)
+        return self.result if not self._thread.is_alive() else None
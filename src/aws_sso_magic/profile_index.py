@@ -0,0 +1,197 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+from configparser import ConfigParser
+from pathlib import Path
+
+from .utils import AWS_SSO_DIR
+
+LOGGER = logging.getLogger(__name__)
+
+AWS_SSO_INDEX_DIR = f'{Path.home()}/{AWS_SSO_DIR}/index'
+# Smaller files are parsed directly, it is as fast as loading the index
+INDEX_MIN_SIZE = 64 * 1024
+INDEX_VERSION = 1
+
+SECTION_HEADER = re.compile(rb"^\[(?P<header>.+)\]\s*$")
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as context:
+        for chunk in iter(lambda: context.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _section_offsets(path):
+    offsets = {}
+    section, start, position = None, 0, 0
+    with open(path, "rb") as context:
+        for line in context:
+            match = SECTION_HEADER.match(line)
+            if match:
+                if section is not None:
+                    offsets[section] = [start, position - start]
+                section, start = match.group("header").decode("utf-8").strip(), position
+            position += len(line)
+    if section is not None:
+        offsets[section] = [start, position - start]
+    return offsets
+
+class ProfileIndex:
+    """Sidecar index of an INI config file, kept under ~/.aws-sso-magic/index.
+
+    It maps section name -> byte offset and length on the source file, start URL ->
+    profile sections and account id -> profile sections, so a single section is read
+    without parsing the whole file. The index is validated against the mtime and size
+    of the source file (and its hash when they differ) and rebuilt only when the file changed.
+    """
+    def __init__(self, source_path, index_dir=AWS_SSO_INDEX_DIR):
+        self.source_path = source_path
+        self.index_path = os.path.join(index_dir, hashlib.sha1(source_path.encode("utf-8")).hexdigest()[:16] + ".json")
+        self._index = None
+        self._stamp = None
+        self._lock = threading.RLock()
+
+    def _source_stamp(self):
+        try:
+            stat = os.stat(self.source_path)
+        except FileNotFoundError:
+            return None
+        return {"version": INDEX_VERSION, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    def _load(self):
+        stamp = self._source_stamp()
+        if stamp is None:
+            self.close()
+            return None
+        if self._index is not None and self._stamp == stamp:
+            return self._index
+        try:
+            with open(self.index_path) as context:
+                index = json.load(context)
+            source = index["source"]
+            if {k: source.get(k) for k in stamp} != stamp:
+                # Touched but unchanged files keep their index
+                if source.get("version") != INDEX_VERSION or source.get("sha1") != _file_hash(self.source_path):
+                    index = None
+                else:
+                    index["source"] = dict(stamp, sha1=source["sha1"])
+                    self._save(index)
+        except (OSError, ValueError, KeyError, AttributeError):
+            index = None
+        if index is None:
+            index = self._rebuild(stamp)
+        self._index = index
+        self._stamp = stamp
+        return index
+
+    def _rebuild(self, stamp):
+        LOGGER.debug(f"Rebuilding the index of {self.source_path}")
+        config = ConfigParser()
+        config.read(self.source_path)
+        sso_session_urls = {}
+        for section in config.sections():
+            if section.startswith("sso-session "):
+                sso_session_urls[section[len("sso-session "):]] = config.get(section, "sso_start_url", fallback=None)
+
+        start_urls = {}
+        accounts = {}
+        for section in config.sections():
+            start_url = config.get(section, "sso_start_url", fallback=None) or sso_session_urls.get(config.get(section, "sso_session", fallback=None))
+            if start_url:
+                start_urls.setdefault(start_url, []).append(section)
+            account_id = config.get(section, "sso_account_id", fallback=None)
+            if account_id:
+                accounts.setdefault(account_id, []).append(section)
+
+        index = {
+            "source": dict(stamp, sha1=_file_hash(self.source_path)),
+            "sections": _section_offsets(self.source_path),
+            "start_urls": start_urls,
+            "accounts": accounts,
+        }
+        self._save(index)
+        return index
+
+    def _save(self, index):
+        directory = os.path.dirname(self.index_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as destination:
+                json.dump(index, destination, separators=(",", ":"))
+            os.replace(temp_path, self.index_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def get_section(self, section):
+        """Return the values of a section as a dict, None if it doesn't exist."""
+        with self._lock:
+            index = self._load()
+            if index is None or section not in index["sections"]:
+                return None
+            text = ""
+            # Values of the DEFAULT section are inherited by every section, as ConfigParser does
+            for name in ["DEFAULT", section]:
+                if name in index["sections"]:
+                    offset, length = index["sections"][name]
+                    with open(self.source_path, "rb") as context:
+                        context.seek(offset)
+                        text += context.read(length).decode("utf-8") + "\n"
+        config = ConfigParser()
+        config.read_string(text)
+        if not config.has_section(section):
+            return None
+        return dict(config.items(section))
+
+    def sections_for_start_url(self, start_url):
+        with self._lock:
+            index = self._load()
+            return list(index["start_urls"].get(start_url, [])) if index else []
+
+    def sections_for_account(self, account_id):
+        with self._lock:
+            index = self._load()
+            return list(index["accounts"].get(account_id, [])) if index else []
+
+    def close(self):
+        with self._lock:
+            self._index = None
+            self._stamp = None
+
+_INDEXES = {}
+
+def get_profile_index(source_path):
+    if source_path not in _INDEXES:
+        _INDEXES[source_path] = ProfileIndex(source_path)
+    return _INDEXES[source_path]
+
+def is_indexed(source_path):
+    try:
+        return os.path.getsize(source_path) >= INDEX_MIN_SIZE
+    except OSError:
+        return False
+
+def invalidate_profile_index(source_path):
+    index = _INDEXES.get(source_path)
+    if index is not None:
+        index.close()
@@ -0,0 +1,157 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import logging
+
+from datetime import datetime, timedelta, timezone
+
+from .concurrency import client_limiter, limited_map
+from .credentials_cache import get_credentials_cache
+from .utils import configure_logging, _read_config, _write_config, _get_endpoint_url, _print_warn, _record_generated_sections
+from .utils import (
+    AWS_CREDENTIAL_PATH,
+    AWS_SSO_PROFILE,
+    AWS_DEFAULT_REGION
+)
+
+LOGGER = logging.getLogger(__name__)
+
+# The pre-assumed credentials of a profile go to a section of their own, the profile keeps its
+# source_profile and role_arn so the SDKs assume the role by themselves once they expire. The
+# role arn is kept on that section under a key the SDKs ignore, a role_arn key would make them
+# assume the role again
+PRE_ASSUMED_SECTION_SUFFIX = "-pre-assumed"
+PRE_ASSUMED_ROLE_ARN_KEY = "aws_sso_magic_role_arn"
+PRE_ASSUMED_EXPIRATION_KEY = "aws_sso_magic_expiration"
+PRE_ASSUME_EXPIRY_WINDOW = timedelta(minutes=15)
+ROLE_SESSION_NAME = "aws-sso-magic"
+
+def _cache_source(role_arn):
+    return f"assume-role {role_arn}"
+
+def get_pre_assumed_section(profile_name):
+    return f"{profile_name}{PRE_ASSUMED_SECTION_SUFFIX}"
+
+def _iter_proxy_profiles(config):
+    """Yield the section and role arn of every child profile of the aws-sso profile."""
+    for section in config.sections():
+        if section.endswith(PRE_ASSUMED_SECTION_SUFFIX) and config.has_option(section, PRE_ASSUMED_ROLE_ARN_KEY):
+            continue
+        role_arn = None
+        if config.get(section, "source_profile", fallback=None) == AWS_SSO_PROFILE:
+            role_arn = config.get(section, "role_arn", fallback=None)
+        if role_arn is None:
+            # Written on the profile itself by the previous versions
+            role_arn = config.get(section, PRE_ASSUMED_ROLE_ARN_KEY, fallback=None)
+        if role_arn:
+            yield section, role_arn
+
+def _account_and_role(role_arn):
+    # arn:aws:iam::123456789012:role/RoleName
+    account_id = role_arn.split(":")[4]
+    role_name = role_arn.split(":role/", 1)[-1]
+    return account_id, role_name
+
+def _assume_role(client, role_arn):
+    with client_limiter(client).slot():
+        response = client.assume_role(RoleArn=role_arn, RoleSessionName=ROLE_SESSION_NAME)
+    credentials = response["Credentials"]
+    # Same format as the sso:GetRoleCredentials credentials
+    return {
+        "accessKeyId": credentials["AccessKeyId"],
+        "secretAccessKey": credentials["SecretAccessKey"],
+        "sessionToken": credentials["SessionToken"],
+        "expiration": int(credentials["Expiration"].timestamp() * 1000),
+    }
+
+def pre_assume_proxy_roles():
+    """Assume the proxy role of every child profile of aws-sso with its credentials and write
+    the resulting credentials on the <profile>-pre-assumed section of each one, the processes
+    using that profile don't call AssumeRole. The roles are assumed concurrently, within the
+    adaptive concurrency limit of STS.
+
+    The child profiles keep their source_profile and role_arn, so they still work once the
+    pre-assumed credentials expire. Credentials still valid for more than 15 minutes are
+    taken from the cache, the pre-assumed section of a role that can't be assumed is removed.
+    Returns the number of profiles pre-assumed.
+    """
+    import boto3
+    import botocore
+    configure_logging(LOGGER, False)
+
+    config = _read_config(AWS_CREDENTIAL_PATH)
+    if not config.has_section(AWS_SSO_PROFILE):
+        _print_warn(f"\nThe [{AWS_SSO_PROFILE}] profile was not found on {AWS_CREDENTIAL_PATH}, the proxy roles are not pre-assumed")
+        return 0
+    source = config[AWS_SSO_PROFILE]
+    client = boto3.client(
+        "sts",
+        region_name=source.get("region", AWS_DEFAULT_REGION),
+        aws_access_key_id=source.get("aws_access_key_id"),
+        aws_secret_access_key=source.get("aws_secret_access_key"),
+        aws_session_token=source.get("aws_session_token"),
+        endpoint_url=_get_endpoint_url("sts"))
+
+    cache = get_credentials_cache()
+    profiles = list(_iter_proxy_profiles(config))
+    credentials = {}
+    to_assume = []
+    for section, role_arn in profiles:
+        account_id, role_name = _account_and_role(role_arn)
+        cached = cache.get(account_id, role_name, _cache_source(role_arn), min_valid=PRE_ASSUME_EXPIRY_WINDOW)
+        if cached:
+            credentials[section] = cached
+        else:
+            to_assume.append((section, role_arn))
+
+    def assume(item):
+        section, role_arn = item
+        try:
+            return section, role_arn, _assume_role(client, role_arn)
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            LOGGER.debug(f"Unable to assume {role_arn}: {e}")
+            return section, role_arn, None
+
+    failed = 0
+    for section, role_arn, assumed in limited_map(assume, to_assume, client_limiter(client).maximum):
+        if assumed is None:
+            failed += 1
+            continue
+        account_id, role_name = _account_and_role(role_arn)
+        cache.put(account_id, role_name, _cache_source(role_arn), assumed)
+        credentials[section] = assumed
+
+    pre_assumed_sections = []
+    for section, role_arn in profiles:
+        # The SDKs can always assume the role by themselves
+        config.remove_section(section)
+        config.add_section(section)
+        config.set(section, "source_profile", AWS_SSO_PROFILE)
+        config.set(section, "role_arn", role_arn)
+        pre_assumed_section = get_pre_assumed_section(section)
+        config.remove_section(pre_assumed_section)
+        if section in credentials:
+            expiration = datetime.fromtimestamp(credentials[section]["expiration"] / 1000.0, timezone.utc)
+            config.add_section(pre_assumed_section)
+            config.set(pre_assumed_section, "aws_access_key_id", credentials[section]["accessKeyId"])
+            config.set(pre_assumed_section, "aws_secret_access_key", credentials[section]["secretAccessKey"])
+            config.set(pre_assumed_section, "aws_session_token", credentials[section]["sessionToken"])
+            config.set(pre_assumed_section, PRE_ASSUMED_ROLE_ARN_KEY, role_arn)
+            config.set(pre_assumed_section, PRE_ASSUMED_EXPIRATION_KEY, expiration.strftime("%Y-%m-%dT%H:%M:%SZ"))
+            pre_assumed_sections.append(pre_assumed_section)
+    _write_config(AWS_CREDENTIAL_PATH, config)
+    _record_generated_sections(AWS_CREDENTIAL_PATH, pre_assumed_sections)
+
+    LOGGER.info("Pre-assumed {} proxy roles ({} from the cache, {} failed)".format(
+        len(credentials), len(profiles) - len(to_assume), failed))
+    return len(credentials)
@@ -0,0 +1,150 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from configparser import ConfigParser
+from dateutil.tz import UTC
+from dateutil.parser import parse
+
+from .utils import AWS_CONFIG_PATH, AWS_SSO_CACHE_PATH
+
+LOGGER = logging.getLogger(__name__)
+
+SSOToken = namedtuple("SSOToken", ["path", "start_url", "region", "session_name", "access_token", "expires_at", "data"])
+
+def _cache_key(value):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+def _configured_session_names(config_path):
+    config = ConfigParser()
+    try:
+        config.read(config_path)
+    except Exception as e:
+        LOGGER.debug(f"Unable to read {config_path}: {e}")
+        return []
+    return [s[len("sso-session "):].strip() for s in config.sections() if s.startswith("sso-session ")]
+
+class SSOTokenCache:
+    """Index of the tokens in the AWS SSO cache directory.
+
+    The AWS CLI stores the token under sha1(start_url).json for legacy profiles
+    and under sha1(session_name).json for sso-session profiles, so the directory
+    is scanned once and the tokens are indexed by start URL, session name and region.
+    """
+    def __init__(self, cache_dir=AWS_SSO_CACHE_PATH, config_path=AWS_CONFIG_PATH):
+        self.cache_dir = cache_dir
+        self.config_path = config_path
+        self.tokens = []
+        self.by_start_url = defaultdict(list)
+        self.by_session_name = defaultdict(list)
+        self.by_region = defaultdict(list)
+        self._lock = threading.RLock()
+        self.scan()
+
+    def scan(self):
+        with self._lock:
+            self._scan()
+
+    def _scan(self):
+        self.tokens = []
+        self.by_start_url.clear()
+        self.by_session_name.clear()
+        self.by_region.clear()
+
+        session_names = {_cache_key(name): name for name in _configured_session_names(self.config_path)}
+        try:
+            file_names = sorted(os.listdir(self.cache_dir))
+        except FileNotFoundError:
+            file_names = []
+
+        for file_name in file_names:
+            if not file_name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                with open(path) as context:
+                    data = json.load(context)
+                # Client registrations share the directory but carry no token
+                if not isinstance(data, dict) or "accessToken" not in data or "expiresAt" not in data:
+                    continue
+                expires_at = parse(data["expiresAt"]).astimezone(UTC)
+            except (OSError, ValueError, OverflowError) as e:
+                LOGGER.debug(f"Skipping SSO cache entry {path}: {e}")
+                continue
+            token = SSOToken(
+                path=path,
+                start_url=data.get("startUrl"),
+                region=data.get("region"),
+                session_name=session_names.get(file_name[:-len(".json")]),
+                access_token=data["accessToken"],
+                expires_at=expires_at,
+                data=data)
+            self.tokens.append(token)
+            if token.start_url:
+                self.by_start_url[token.start_url].append(token)
+            if token.session_name:
+                self.by_session_name[token.session_name].append(token)
+            if token.region:
+                self.by_region[token.region].append(token)
+
+        LOGGER.debug(f"Indexed {len(self.tokens)} SSO tokens from {self.cache_dir}")
+
+    def find(self, start_url=None, session_name=None, region=None):
+        with self._lock:
+            return self._find(start_url, session_name, region)
+
+    def _find(self, start_url, session_name, region):
+        # The tokens of the session go first, several sso-sessions can share a start URL
+        candidates = {}
+        if session_name:
+            candidates.update((t.path, t) for t in self.by_session_name.get(session_name, []))
+        if start_url:
+            candidates.update((t.path, t) for t in self.by_start_url.get(start_url, []) if t.path not in candidates)
+        if not start_url and not session_name:
+            candidates.update((t.path, t) for t in self.tokens)
+        tokens = candidates.values()
+        if region:
+            tokens = [t for t in tokens if t.region == region]
+        return sorted(tokens, key=lambda t: (bool(session_name) and t.session_name == session_name, t.expires_at), reverse=True)
+
+    def lookup(self, start_url=None, session_name=None, region=None, min_valid=timedelta(0)):
+        """Return the token matching the start URL or session name that is valid for more than
+        min_valid, the ones of the session first and then the freshest one. None if there's none."""
+        tokens = self.find(start_url=start_url, session_name=session_name, region=region)
+        now = datetime.now().astimezone(UTC)
+        for token in tokens:
+            if token.expires_at > now + min_valid:
+                return token
+        return None
+
+    def latest(self, start_url=None, session_name=None, region=None):
+        """Like lookup, but return the first token even if all of them are already expired."""
+        tokens = self.find(start_url=start_url, session_name=session_name, region=region)
+        return self.lookup(start_url=start_url, session_name=session_name, region=region) or (tokens[0] if tokens else None)
+
+_TOKEN_CACHE = None
+
+def get_token_cache(refresh=False):
+    global _TOKEN_CACHE
+    if _TOKEN_CACHE is None:
+        _TOKEN_CACHE = SSOTokenCache()
+    elif refresh:
+        _TOKEN_CACHE.scan()
+    return _TOKEN_CACHE
@@ -0,0 +1,198 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import contextlib
+import itertools
+import json
+import logging
+import threading
+import weakref
+
+from configparser import ConfigParser
+
+from .utils import configure_logging, log_phase, _write_config_file
+
+LOGGER = logging.getLogger(__name__)
+
+# Scoped to the thread, the threads started by a command don't join its transaction
+_CURRENT = threading.local()
+# Attribute of a config read through a transaction with the key of its snapshot
+SNAPSHOT_ATTRIBUTE = "_aws_sso_magic_snapshot"
+_READS = itertools.count()
+# The transactions of different threads commit one at a time
+_COMMIT_LOCK = threading.Lock()
+
+def _own_sections(config):
+    return {section: dict(config.items(section, raw=True)) for section in config.sections()}
+
+def _parse(path):
+    config = ConfigParser()
+    config.read(path)
+    return config
+
+class ConfigTransaction:
+    """The config file mutations of a command, committed with a single write per file.
+
+    The mutations are kept per section, a read sees them on top of the file on disk
+    and the commit applies them to the file as it is at that moment, so the sections
+    changed by another process in the meantime are kept. A file whose sections end up
+    with the same values is not written. write_file writes a whole file, the commands
+    print its errors and exit while the API raises them.
+    """
+    def __init__(self, write_file=None):
+        self._write_file = write_file or _write_config_file
+        self._sections = {}
+        self._snapshots = {}
+        self._documents = {}
+        self.writes = {}
+        self.unchanged = set()
+
+    def has_changes(self, path):
+        return bool(self._sections.get(path))
+
+    def get_section(self, path, section):
+        """Return (True, values) for a section with pending changes, values is None if it was removed."""
+        sections = self._sections.get(path, {})
+        if section not in sections:
+            return False, None
+        values = sections[section]
+        return True, dict(values) if values is not None else None
+
+    def _apply(self, config, path):
+        for section, values in self._sections.get(path, {}).items():
+            if values is None:
+                config.remove_section(section)
+                continue
+            if config.has_section(section):
+                for key in config.options(section):
+                    config.remove_option(section, key)
+            else:
+                config.add_section(section)
+            for key, value in values.items():
+                config.set(section, key, value)
+        return config
+
+    def read(self, path):
+        config = self._apply(_parse(path), path)
+        # Kept per path and read to find out which sections the caller changes when it writes
+        # the config back, two configs read from the same path are diffed against their own read
+        key = (path, next(_READS))
+        self._snapshots[key] = _own_sections(config)
+        setattr(config, SNAPSHOT_ATTRIBUTE, key)
+        weakref.finalize(config, self._snapshots.pop, key, None)
+        return config
+
+    def record(self, path, config):
+        key = getattr(config, SNAPSHOT_ATTRIBUTE, None)
+        base = self._snapshots.get(key) if key is not None and key[0] == path else None
+        if base is None:
+            base = _own_sections(self._apply(_parse(path), path))
+            key = (path, next(_READS))
+            setattr(config, SNAPSHOT_ATTRIBUTE, key)
+            weakref.finalize(config, self._snapshots.pop, key, None)
+        sections = self._sections.setdefault(path, {})
+        current = _own_sections(config)
+        for section in base:
+            if section not in current:
+                sections[section] = None
+        for section, values in current.items():
+            if base.get(section) != values:
+                sections[section] = values
+        self._snapshots[key] = current
+
+    def set_section(self, path, section, values):
+        self._sections.setdefault(path, {})[section] = dict(values)
+
+    def get_document(self, path):
+        return self._documents.get(path, (None, None))[0]
+
+    def set_document(self, path, data, write):
+        self._documents[path] = (data, write)
+
+    def _count_write(self, path, changed):
+        if changed:
+            self.writes[path] = self.writes.get(path, 0) + 1
+        elif path not in self.writes:
+            self.unchanged.add(path)
+
+    def commit(self):
+        """Write every file with pending changes, can be called again for the changes made after it."""
+        with _COMMIT_LOCK:
+            self._commit()
+
+    def _commit(self):
+        for path, sections in self._sections.items():
+            if not sections:
+                self._count_write(path, False)
+                continue
+            config = _parse(path)
+            on_disk = _own_sections(config)
+            changed = any(on_disk.get(section) != values for section, values in sections.items())
+            if changed:
+                self._write_file(path, self._apply(config, path))
+            self._count_write(path, changed)
+        self._sections = {}
+
+        for path, (data, write) in self._documents.items():
+            try:
+                with open(path) as context:
+                    changed = json.load(context) != data
+            except (OSError, ValueError):
+                changed = True
+            if changed:
+                write(data)
+            self._count_write(path, changed)
+        self._documents = {}
+
+    def stats(self):
+        return {
+            "files_written": len(self.writes),
+            "files_unchanged": len(self.unchanged),
+            "max_writes_per_file": max(self.writes.values(), default=0),
+        }
+
+def get_current_transaction():
+    return getattr(_CURRENT, "transaction", None)
+
+@contextlib.contextmanager
+def config_transaction(write_file=None):
+    """Collect the config file mutations until the end of the block and commit them.
+
+    The transaction belongs to the thread that opened it, a nested block on the same
+    thread joins it and another thread opens its own. The mutations are committed even
+    if the block fails, like they were when every mutation was written right away.
+    write_file replaces the function writing each file, it's only used by the block
+    that opens the transaction.
+    """
+    current = get_current_transaction()
+    if current is not None:
+        yield current
+        return
+    transaction = _CURRENT.transaction = ConfigTransaction(write_file)
+    try:
+        yield transaction
+    finally:
+        _CURRENT.transaction = None
+        # Configured at the end, with the verbosity of the command
+        configure_logging(LOGGER, False)
+        with log_phase(LOGGER, "commit") as phase:
+            transaction.commit()
+            phase.update(transaction.stats())
+        for path, writes in transaction.writes.items():
+            LOGGER.debug(f"{path} written {writes} times")
+
+def flush_config_transaction():
+    """Commit the pending mutations before another process (aws cli, SDK) reads the files."""
+    transaction = get_current_transaction()
+    if transaction is not None:
+        transaction.commit()
@@ -0,0 +1,54 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import logging
+import click
+
+from configparser import NoSectionError
+from .utils import configure_logging, log_phase, _print_error
+from .utils import _set_profile_credentials, _set_profile_in_use, _add_prefix
+from .utils import AWS_CONFIG_PATH
+
+LOGGER = logging.getLogger(__name__)
+
+@click.command("use")
+@click.argument("profile")
+@click.option("--custom-profile", "custom_profile_arg", help="Copy the credentials to this profile instead of the default and aws-sso profiles")
+@click.option("--refresh", is_flag=True, help="Fetch new role credentials even if the cached ones are still valid")
+@click.option("--pre-assume", is_flag=True, help="Refresh the pre-assumed credentials of the proxy roles that expire within 15 minutes")
+@click.option("--verbose", "-v", count=True)
+
+def use(profile, custom_profile_arg, refresh, pre_assume, verbose):
+    """Switch the profile in use.
+
+    The profile must have been generated by the login command. The cached role
+    credentials are used while they are valid for more than 15 minutes, otherwise
+    new ones are fetched with the cached AWS SSO login, so it doesn't rediscover
+    the accounts and roles.
+    """
+    configure_logging(LOGGER, verbose)
+
+    profile_name = _add_prefix(profile)
+    with log_phase(LOGGER, "credentials", profile=profile):
+        try:
+            _set_profile_credentials(profile_name, custom_profile_arg is None, custom_profile_arg, use_cache=not refresh)
+        except NoSectionError:
+            _print_error(f"\nERROR: Profile {profile} not found on the file {AWS_CONFIG_PATH}, run aws-sso-magic login first")
+        _set_profile_in_use(profile_name)
+    if pre_assume:
+        from .proxy_credentials import pre_assume_proxy_roles
+        with log_phase(LOGGER, "pre_assume"):
+            pre_assume_proxy_roles()
+
+if __name__ == "__main__":
+    use(prog_name="python -m aws_sso_magic.use")  #pylint: disable=unexpected-keyword-arg,no-value-for-parameter
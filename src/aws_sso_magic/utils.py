@@ -11,29 +11,21 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
-import boto3
-import botocore
-from typing import Optional
+import contextlib
 import hashlib
 import json
 import logging
-import logging.handlers
 import os
 import re
-import subprocess
+import shutil
 import sys
+import tempfile
+import time
 
-from PyInquirer import prompt, Separator
 from datetime import datetime, timedelta
 from pathlib import Path
-from configparser import ConfigParser
+from configparser import ConfigParser, NoSectionError
 from dateutil.tz import UTC, tzlocal
-from dateutil.parser import parse
-from aws_sso_lib.compat import shell_join
-from aws_sso_lib.config import find_instances, SSOInstance
-from botocore.compat import compat_shell_split as shell_split
-from aws_sso_lib.config_file_writer import process_profile_name
-from botocore.exceptions import ProfileNotFound
 
 AWS_CONFIG_PATH = f'{Path.home()}/.aws/config'
 AWS_CREDENTIAL_PATH = f'{Path.home()}/.aws/credentials'
@@ -41,6 +33,8 @@ AWS_SSO_CACHE_PATH = f'{Path.home()}/.aws/sso/cache'
 AWS_SSO_PROFILE = "aws-sso"
 AWS_SSO_DIR = f".{AWS_SSO_PROFILE}-magic"
 AWS_SSO_CONFIG_PATH = f'{Path.home()}/{AWS_SSO_DIR}/config'
+AWS_SSO_MANIFEST_PATH = f'{Path.home()}/{AWS_SSO_DIR}/manifest.json'
+AWS_SSO_MANIFEST_VERSION = 1
 AWS_SSO_DEFAULT_PROXY_ROLE_SECTION="default-proxy-role-name"
 AWS_SSO_DEFAULT_PROXY_ROLE_KEY="proxy_role_name"
 AWS_SSO_PROFILE_IN_USE = "ProfileInUse"
@@ -48,6 +42,8 @@ AWS_SSO_CONFIG_ALIAS = "AliasAccounts"
 AWS_SSO_EKS_ROLE_NAME_DEFAULT = "replacethis"
 AWS_DEFAULT_PROFILE = 'default'
 AWS_DEFAULT_REGION = 'us-east-1'
+DEFAULT_SEPARATOR = "."
+DEFAULT_COMPONENTS = "account_name,role_name,default_style_region"
 VERBOSE = True
 
 KNOWN_COMPONENTS = [
@@ -70,25 +66,91 @@ PROCESS_FORMATTER_ARGS = [
 
 LOGGER = logging.getLogger(__name__)
 
+LOG_FORMATS = ["text", "json"]
+LOG_FORMAT_ENV_VAR = "AWS_SSO_MAGIC_LOG_FORMAT"
+
+# Logging is configured once per process, the commands and the helpers share this state
+_LOGGING_STATE = {"verbose": None, "format": None, "loggers": {}}
+_LOG_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line, the extra fields of the record (e.g. phase, elapsed_ms) are included."""
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, UTC).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _LOG_RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def set_log_format(log_format):
+    if log_format not in LOG_FORMATS:
+        raise ValueError("Unknown log format {}".format(log_format))
+    _LOGGING_STATE["format"] = log_format
+    formatter = _get_log_formatter()
+    for handler in logging.getLogger().handlers + [_get_log_handler()]:
+        handler.setFormatter(formatter)
+
+def _get_log_format():
+    if _LOGGING_STATE["format"] is None:
+        log_format = os.environ.get(LOG_FORMAT_ENV_VAR, "text").lower()
+        _LOGGING_STATE["format"] = log_format if log_format in LOG_FORMATS else "text"
+    return _LOGGING_STATE["format"]
+
+def _get_log_formatter():
+    if _get_log_format() == "json":
+        return JsonLogFormatter()
+    return logging.Formatter("%(message)s")
+
+def _get_log_handler():
+    if "handler" not in _LOGGING_STATE:
+        handler = logging.StreamHandler()
+        handler.setFormatter(_get_log_formatter())
+        _LOGGING_STATE["handler"] = handler
+    return _LOGGING_STATE["handler"]
+
 def configure_logging(logger, verbose, **config_args):
-    if verbose in [False, None]:
-        verbose = 0
-    elif verbose == True:
+    if verbose is False or verbose is None:
+        # The helpers keep the verbosity requested by the command, without a command
+        # (the Python API) the logging is left to the program
+        if _LOGGING_STATE["verbose"] is None:
+            return
+        verbose = _LOGGING_STATE["verbose"]
+    elif verbose is True:
         verbose = 1
+    _LOGGING_STATE["verbose"] = max(verbose, _LOGGING_STATE["verbose"] or 0)
+
+    if _LOGGING_STATE["loggers"].get(logger.name) == verbose:
+        return
+    _LOGGING_STATE["loggers"][logger.name] = verbose
 
     logging.basicConfig(**config_args)
+    if _get_log_format() == "json":
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(_get_log_formatter())
 
     aws_sso_magic_logger = logging.getLogger("aws_sso_magic")
     aws_sso_lib_logger = logging.getLogger("aws_sso_lib")
     root_logger = logging.getLogger()
 
+    handler = _get_log_handler()
     if verbose == 0:
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter("%(message)s"))
-        logger.addHandler(handler)
+        if handler not in logger.handlers:
+            logger.addHandler(handler)
         logger.propagate = False
         logger.setLevel(logging.INFO)
-    elif verbose == 1:
+        return
+
+    if handler in logger.handlers:
+        logger.removeHandler(handler)
+        logger.propagate = True
+    if verbose == 1:
         logger.setLevel(logging.DEBUG)
         aws_sso_magic_logger.setLevel(logging.INFO)
         aws_sso_lib_logger.setLevel(logging.INFO)
@@ -108,10 +170,24 @@ def configure_logging(logger, verbose, **config_args):
         aws_sso_lib_logger.setLevel(logging.DEBUG)
         root_logger.setLevel(logging.DEBUG)
 
+@contextlib.contextmanager
+def log_phase(logger, phase, **fields):
+    """Time a phase of a command, the yielded dict can be updated with more fields for the log record.
+
+    The timing is logged at INFO level on the json log format and at DEBUG level otherwise.
+    """
+    started = time.monotonic()
+    try:
+        yield fields
+    finally:
+        elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+        level = logging.INFO if _get_log_format() == "json" else logging.DEBUG
+        logger.log(level, f"Phase {phase} took {elapsed_ms} ms", extra=dict(fields, phase=phase, elapsed_ms=elapsed_ms))
+
 class GetInstanceError(Exception):
     pass
 
-def get_sso_sessions():
+def get_sso_session_names():
     sso_sessions = []
     config = _read_config(AWS_CONFIG_PATH)
     for section in config.sections():
@@ -119,6 +195,11 @@ def get_sso_sessions():
             section_name = _get_section_name(section, "sso-session ")
             sso_sessions.append(section_name)
     sso_sessions.sort()
+    return sso_sessions
+
+def get_sso_sessions():
+    from PyInquirer import prompt
+    sso_sessions = get_sso_session_names()
     questions = [{
         'type': 'list',
         'name': 'name',
@@ -133,13 +214,14 @@ def get_sso_details(profile_name):
     config_sso_profile = _read_section_configuration(AWS_CONFIG_PATH, f"sso-session {profile_name}")
     sso_start_url = config_sso_profile.get("sso_start_url")
     sso_region = config_sso_profile.get("sso_region")
-    print(f"sso_region: {sso_region}")
+    LOGGER.debug(f"sso_region: {sso_region}")
     add_new_key_value_conf_file(AWS_CONFIG_PATH, f"profile {profile_name}", "sso_start_url", sso_start_url)
     add_new_key_value_conf_file(AWS_CONFIG_PATH, f"profile {profile_name}", "sso_region", sso_region)
     return sso_start_url, sso_region
 
-def get_instance(sso_start_url, sso_region, sso_start_url_vars=None, sso_region_vars=None, profile_name=None):
-    profile_name = get_sso_sessions()
+def get_instance(sso_start_url, sso_region, sso_start_url_vars=None, sso_region_vars=None, profile_name=None, sso_session=None):
+    from aws_sso_lib.config import find_instances, SSOInstance
+    profile_name = sso_session or get_sso_sessions()
     sso_start_url, sso_region = get_sso_details(profile_name)
     instances, specifier, all_instances = find_instances(
         profile_name=profile_name,
@@ -245,6 +327,13 @@ class Printer:
             prev_row = row
             first_loop = False
 
+# Endpoint Utils
+
+def _get_endpoint_url(service_name):
+    # Same variables as the AWS SDKs, read here so older botocore versions honour them too
+    service_var = "AWS_ENDPOINT_URL_{}".format(service_name.upper().replace("-", "_"))
+    return os.environ.get(service_var) or os.environ.get("AWS_ENDPOINT_URL")
+
 # Check Utils
 
 def _check_flag_combinations(eks, profile_arg, cluster_arg, eks_profile_arg, custom_profile_arg):
@@ -258,6 +347,7 @@ def _check_flag_combinations(eks, profile_arg, cluster_arg, eks_profile_arg, cus
         _print_error(f"\nERROR: Not use the flag combination login --eks-profile")                      
 
 def _check_kubectl():
+    import subprocess
     try:
         kubectl_version = subprocess.run(['kubectl'] + ['version'], capture_output=True).stdout.decode('utf-8')
         if 'GitVersion:' not in kubectl_version:
@@ -272,6 +362,7 @@ def _check_kubectl():
 
 
 def _check_aws_v2():
+    import subprocess
     # validate aws v2
     try:
         aws_version = subprocess.run(['aws'] + ['--version'], capture_output=True).stdout.decode('utf-8')
@@ -338,6 +429,9 @@ def get_formatter(include_region, region_format, no_region_format):
         raise ValueError("Unknown include_region value {}".format(include_region))
 
 def get_process_formatter(command):
+    import subprocess
+    from aws_sso_lib.compat import shell_join
+    from botocore.compat import compat_shell_split as shell_split
     configure_logging(LOGGER, VERBOSE)
     def formatter(i, n, **kwargs):
         kwargs["region_index"] = str(i)
@@ -383,19 +477,19 @@ def _get_profile_name(profile):
 
 def _profile_filter(sso_session):
     profiles = []
-    config = _read_config(AWS_CONFIG_PATH)
     config_sso_profile = _read_section_configuration(AWS_CONFIG_PATH, f"sso-session {sso_session}")
     sso_start_url_selected = config_sso_profile.get("sso_start_url")
-    for section in config.sections():
-        profile = _read_section_configuration(AWS_CONFIG_PATH, f"profile {sso_session}")
-        if sso_start_url_selected in profile.get("sso_start_url"):
-            if sso_session not in section and "aws-sso" not in section and "default" not in section:
-                x = _get_profile_name(section)
-                profiles.append(x)
+    for section in _get_sections_for_start_url(AWS_CONFIG_PATH, sso_start_url_selected):
+        if not section.startswith("profile "):
+            continue
+        if sso_session not in section and "aws-sso" not in section and "default" not in section:
+            x = _get_profile_name(section)
+            profiles.append(x)
     profiles.sort()
     return profiles
 
 def _select_profile(sso_session):
+    from PyInquirer import prompt
     profiles = _profile_filter(sso_session)
     questions = [{
         'type': 'list',
@@ -423,19 +517,50 @@ def _get_account_id_profile(path, profile_name):
 
 # Credentials Utils
 def _read_config(path):
+    from .transaction import get_current_transaction
+    transaction = get_current_transaction()
+    if transaction is not None:
+        # The pending changes of the command are seen on top of the file
+        return transaction.read(path)
     config = ConfigParser()
     try:
         config.read(path)
     except FileNotFoundError as e:
-        _print_error(e)
+        _print_error(str(e))
     return config
 
 def _write_config(path, config):
+    from .transaction import get_current_transaction
+    transaction = get_current_transaction()
+    if transaction is not None:
+        # Written once when the command finishes
+        transaction.record(path, config)
+        return
+    _write_config_file(path, config)
+
+def _write_config_file(path, config):
+    try:
+        _replace_config_file(path, config)
+    except OSError as e:
+        _print_error(str(e))
+
+def _replace_config_file(path, config):
+    """Write to a temporary file on the same directory and swap it in, so readers never
+    see a partial file. Raises OSError, the API turns it into its own error."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
     try:
-        with open(path, "w") as destination:
+        with os.fdopen(fd, "w") as destination:
             config.write(destination)
-    except FileNotFoundError as e:
-        _print_error(e)
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    from .profile_index import invalidate_profile_index
+    invalidate_profile_index(path)
 
 def _load_json(path):
     try:
@@ -454,17 +579,20 @@ class Colour:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
-def _set_profile_credentials(profile_name, default_profile, custom_profile_name):
+def _set_profile_credentials(profile_name, default_profile, custom_profile_name, use_cache=False):
     profile_opts = _get_aws_profile(profile_name)
-    cache_login = _get_sso_cached_login(profile_opts)
-    credentials = _get_sso_role_credentials(profile_opts, cache_login)
+    credentials = _get_cached_role_credentials(profile_opts) if use_cache else None
+    if credentials is None:
+        cache_login = _get_sso_cached_login(profile_opts)
+        credentials = _get_sso_role_credentials(profile_opts, cache_login)
     if default_profile == True:
-        _store_aws_credentials(AWS_DEFAULT_PROFILE, profile_opts, credentials)
-        _store_aws_credentials(AWS_SSO_PROFILE, profile_opts, credentials)
-        _copy_to_default_profile(profile_name)
-        _copy_to_aws_sso_profile(profile_name)
+        _store_aws_credentials([AWS_DEFAULT_PROFILE, AWS_SSO_PROFILE], profile_opts, credentials)
+        _copy_to_profiles(profile_name, [AWS_DEFAULT_PROFILE, AWS_SSO_PROFILE])
+        _record_generated_sections(AWS_CREDENTIAL_PATH, [AWS_DEFAULT_PROFILE, AWS_SSO_PROFILE])
+        _record_generated_sections(AWS_CONFIG_PATH, [AWS_DEFAULT_PROFILE, AWS_SSO_PROFILE])
     else:
-        _store_aws_credentials(custom_profile_name, profile_opts, credentials)
+        _store_aws_credentials([custom_profile_name], profile_opts, credentials)
+        _record_generated_sections(AWS_CREDENTIAL_PATH, [custom_profile_name])
 
 def _get_role_arn(profile_name, role_name):
     account_id = _get_account_id_profile(AWS_CONFIG_PATH, profile_name)
@@ -473,8 +601,8 @@ def _get_role_arn(profile_name, role_name):
 
 def _get_role_name(profile_name, origin_request = "main"):
     #origin_request variable to know the origin of the call of this function and apply the validations on the role_arn to assume
-    configure_logging(LOGGER, False)
     role_name = ""
+    config = {}
     section = AWS_SSO_DEFAULT_PROXY_ROLE_SECTION
     role_name_key= AWS_SSO_DEFAULT_PROXY_ROLE_KEY
     config_profile = _read_aws_sso_config_file(AWS_SSO_CONFIG_PATH, profile_name)
@@ -510,17 +638,34 @@ def _get_role_name(profile_name, origin_request = "main"):
 
     return role_name
 
-def _create_credentials_profile(configs):
+def _create_credentials_profile(configs, policy=None):
+    from .materialize import get_materialize_policy, _is_child_section
     configure_logging(LOGGER, False)
-    LOGGER.info("Writing {} profiles to {}".format(len(configs), AWS_CREDENTIAL_PATH))
+    policy = policy or get_materialize_policy()
+    sections = []
+    skipped = 0
+    # Read and written once, not once per profile
+    credentials = _read_config(AWS_CREDENTIAL_PATH)
     for config in configs:
-        role_name = _get_role_name(config.profile_name)
-        _create_profilename_child_credentials(AWS_SSO_PROFILE, config.profile_name, role_name)
-
-def _create_profilename_child_credentials(parent_profile, profile_name, role_name):
+        profile_name = _get_profile_name(config.profile_name)
+        if not policy.includes(profile_name):
+            # Written on first use by materialize_profile
+            if credentials.has_section(profile_name) and _is_child_section(credentials, profile_name):
+                credentials.remove_section(profile_name)
+            skipped += 1
+            continue
+        role_name = config.proxy_role_name if config.proxy_role_name is not None else _get_role_name(config.profile_name)
+        _create_profilename_child_credentials(credentials, AWS_SSO_PROFILE, config.profile_name, role_name)
+        sections.append(profile_name)
+    _write_config(AWS_CREDENTIAL_PATH, credentials)
+    LOGGER.info("Wrote {} profiles to {}".format(len(sections), AWS_CREDENTIAL_PATH))
+    if skipped:
+        LOGGER.info("{} profiles left out by the materialize policy {}, each one is written when it's used".format(skipped, policy.policy))
+    _record_generated_sections(AWS_CREDENTIAL_PATH, sections)
+
+def _create_profilename_child_credentials(config, parent_profile, profile_name, role_name):
     profile_name = _get_profile_name(profile_name)
     role_arn = _get_role_arn(profile_name,role_name)
-    config = _read_config(AWS_CREDENTIAL_PATH)
     if config.has_section(profile_name):
         config.remove_section(profile_name)
 
@@ -528,67 +673,60 @@ def _create_profilename_child_credentials(parent_profile, profile_name, role_nam
     
     config.set(profile_name , "source_profile", parent_profile)
     config.set(profile_name , "role_arn", role_arn)
-    _write_config(AWS_CREDENTIAL_PATH, config)
-
-def _copy_to_aws_sso_profile(profile_name):
-    print(f"\nCopying profile [{profile_name}] to [{AWS_SSO_PROFILE}]")
 
+def _copy_to_profiles(profile_name, target_profiles):
     config = _read_config(AWS_CONFIG_PATH)
 
-    if config.has_section(AWS_SSO_PROFILE):
-        config.remove_section(AWS_SSO_PROFILE)
-
-    config.add_section(AWS_SSO_PROFILE)
+    for target_profile in target_profiles:
+        print(f"\nCopying profile [{profile_name}] to [{target_profile}]")
 
-    for key, value in config.items(profile_name):
-        if key != "role_arn" and key != "source_profile" :
-            config.set(AWS_SSO_PROFILE, key, value)        
+        if config.has_section(target_profile):
+            config.remove_section(target_profile)
 
-    _write_config(AWS_CONFIG_PATH, config)
-    print("\nCredentials copied successfully") 
+        config.add_section(target_profile)
 
-def _copy_to_default_profile(profile_name):
-    print(f"\nCopying profile [{profile_name}] to [default]")
-
-    config = _read_config(AWS_CONFIG_PATH)
-
-    if config.has_section(AWS_DEFAULT_PROFILE):
-        config.remove_section(AWS_DEFAULT_PROFILE)
-
-    config.add_section(AWS_DEFAULT_PROFILE)
-
-    for key, value in config.items(profile_name):
-        if key != "role_arn" and key != "source_profile" :
-            config.set(AWS_DEFAULT_PROFILE, key, value)
+        for key, value in config.items(profile_name):
+            if key != "role_arn" and key != "source_profile" :
+                config.set(target_profile, key, value)
 
     _write_config(AWS_CONFIG_PATH, config)
     print("\nCredentials copied successfully") 
 
 def _get_aws_profile(profile_name):
     print(f'\nReading profile: [{profile_name}]')
-    config = _read_config(AWS_CONFIG_PATH)
-    profile_opts = config.items(profile_name)
-    profile = dict(profile_opts)
+    profile = _get_indexed_section(AWS_CONFIG_PATH, profile_name)
+    if profile is None:
+        raise NoSectionError(profile_name)
     return profile
 
 def _get_sso_cached_login(profile):
+    from .token_cache import get_token_cache
     print('\nChecking for SSO credentials...')
 
-    cache = hashlib.sha1(profile["sso_start_url"].encode("utf-8")).hexdigest()
-    sso_cache_file = f'{AWS_SSO_CACHE_PATH}/{cache}.json'
+    token_cache = get_token_cache()
+    start_url = profile.get("sso_start_url")
+    session_name = profile.get("sso_session")
+    token = token_cache.latest(start_url=start_url, session_name=session_name, region=profile.get('sso_region'))
+
+    if start_url and (token is None or token.expires_at < datetime.now().astimezone(UTC)):
+        # Another process may be logging in right now, its token is used once it finishes
+        from .locks import file_lock
+        with file_lock(f"token {start_url}", waiting_message=f"Waiting for another aws-sso-magic process logging in to {start_url}", logger=LOGGER) as waited:
+            pass
+        if waited:
+            token_cache.scan()
+            token = token_cache.latest(start_url=start_url, session_name=session_name, region=profile.get('sso_region'))
 
-    if not Path(sso_cache_file).is_file():
+    if token is None:
+        if token_cache.latest(start_url=start_url, session_name=session_name):
+            _print_error(
+                'SSO authentication region in cache does not match region defined in profile')
         _print_error(
             'Current cached SSO login is invalid/missing. Login with the AWS CLI tool or use --login')
 
     else:
-        data = _load_json(sso_cache_file)
         now = datetime.now().astimezone(UTC)
-        expires_at = parse(data['expiresAt']).astimezone(UTC)
-
-        if data.get('region') != profile['sso_region']:
-            _print_error(
-                'SSO authentication region in cache does not match region defined in profile')
+        expires_at = token.expires_at
 
         if now > expires_at:
             _print_error(
@@ -598,32 +736,53 @@ def _get_sso_cached_login(profile):
             _print_warn('Your current SSO credentials will expire in less than 15 minutes!')
 
         print(f'Found credentials. Valid until {expires_at.astimezone(tzlocal())}')
-        return data
-
-def _get_sso_role_credentials(profile, login):
-    print('\nFetching short-term CLI/Boto3 session token...')
-    client = boto3.client('sso', region_name=profile['sso_region'])
-    response = client.get_role_credentials(
-        roleName=profile['sso_role_name'],
-        accountId=profile['sso_account_id'],
-        accessToken=login['accessToken'],
-    )
+        return token.data
+
+def _get_sso_role_credentials(profile, login, client=None, quiet=False):
+    import boto3
+    if not quiet:
+        print('\nFetching short-term CLI/Boto3 session token...')
+    from .concurrency import client_limiter
+    if client is None:
+        client = boto3.client('sso', region_name=profile['sso_region'], endpoint_url=_get_endpoint_url("sso"))
+    with client_limiter(client).slot():
+        response = client.get_role_credentials(
+            roleName=profile['sso_role_name'],
+            accountId=profile['sso_account_id'],
+            accessToken=login['accessToken'],
+        )
     expires = datetime.utcfromtimestamp(response['roleCredentials']['expiration'] / 1000.0).astimezone(UTC)
-    print(f'Got session token. Valid until {expires.astimezone(tzlocal())}')
+    if not quiet:
+        print(f'Got session token. Valid until {expires.astimezone(tzlocal())}')
+    from .credentials_cache import get_credentials_cache
+    get_credentials_cache().put(profile['sso_account_id'], profile['sso_role_name'], profile.get('sso_start_url'), response["roleCredentials"])
     return response["roleCredentials"]
 
-def _store_aws_credentials(profile_name, profile_opts, credentials):
-    print(f'\nAdding to credential files under [{profile_name}]')
+def _get_cached_role_credentials(profile):
+    from .credentials_cache import get_credentials_cache
+    credentials = get_credentials_cache().get(
+        profile['sso_account_id'],
+        profile['sso_role_name'],
+        profile.get('sso_start_url'),
+        min_valid=timedelta(minutes=15))
+    if credentials:
+        expires = datetime.utcfromtimestamp(credentials['expiration'] / 1000.0).astimezone(UTC)
+        print(f'\nUsing cached session token. Valid until {expires.astimezone(tzlocal())}')
+    return credentials
+
+def _store_aws_credentials(profile_names, profile_opts, credentials):
     region = profile_opts.get("region", AWS_DEFAULT_REGION)
     config = _read_config(AWS_CREDENTIAL_PATH)
-    if config.has_section(profile_name):
-        config.remove_section(profile_name)
-
-    config.add_section(profile_name)
-    config.set(profile_name, "region", region)
-    config.set(profile_name, "aws_access_key_id", credentials["accessKeyId"])
-    config.set(profile_name, "aws_secret_access_key ", credentials["secretAccessKey"])
-    config.set(profile_name, "aws_session_token", credentials["sessionToken"])
+    for profile_name in profile_names:
+        print(f'\nAdding to credential files under [{profile_name}]')
+        if config.has_section(profile_name):
+            config.remove_section(profile_name)
+
+        config.add_section(profile_name)
+        config.set(profile_name, "region", region)
+        config.set(profile_name, "aws_access_key_id", credentials["accessKeyId"])
+        config.set(profile_name, "aws_secret_access_key", credentials["secretAccessKey"])
+        config.set(profile_name, "aws_session_token", credentials["sessionToken"])
     _write_config(AWS_CREDENTIAL_PATH, config)
 
 def _add_prefix(name):
@@ -646,12 +805,54 @@ def _print_error(message, kill_exec = True):
     _print_colour(Colour.FAIL, message, always=True)
     if kill_exec: sys.exit(1)
 
-def _read_section_configuration(path, section):
+def _get_indexed_section(path, section):
+    # Big config files are read through the profile index, small ones are parsed directly
+    from .profile_index import get_profile_index, is_indexed
+    from .transaction import get_current_transaction
+    transaction = get_current_transaction()
+    if transaction is not None:
+        pending, values = transaction.get_section(path, section)
+        if pending:
+            return values
+    if is_indexed(path):
+        try:
+            return get_profile_index(path).get_section(section)
+        except (OSError, ValueError, KeyError) as e:
+            LOGGER.debug(f"Unable to use the profile index of {path}: {e}")
     config = ConfigParser()
+    config.read(path)
+    if not config.has_section(section):
+        return None
+    return dict(config.items(section))
+
+def _get_sections_for_start_url(path, start_url):
+    from .profile_index import get_profile_index, is_indexed
+    from .transaction import get_current_transaction
+    if not start_url:
+        return []
+    transaction = get_current_transaction()
+    # The index only knows the file on disk
+    if is_indexed(path) and (transaction is None or not transaction.has_changes(path)):
+        try:
+            return get_profile_index(path).sections_for_start_url(start_url)
+        except (OSError, ValueError, KeyError) as e:
+            LOGGER.debug(f"Unable to use the profile index of {path}: {e}")
+    config = _read_config(path)
+    session_urls = {
+        _get_section_name(section, "sso-session "): config.get(section, "sso_start_url", fallback=None)
+        for section in config.sections() if section.startswith("sso-session ")
+    }
+    sections = []
+    for section in config.sections():
+        section_start_url = config.get(section, "sso_start_url", fallback=None) or session_urls.get(config.get(section, "sso_session", fallback=None))
+        if section_start_url == start_url:
+            sections.append(section)
+    return sections
+
+def _read_section_configuration(path, section):
     par    = {}
     try:
-        config.read(path)
-        par=dict(config.items(section))
+        par=_get_indexed_section(path, section) or {}
         for p in par:
             par[p]=par[p].split("#",1)[0].strip()
         return par        
@@ -659,16 +860,7 @@ def _read_section_configuration(path, section):
         return par  
 
 def _read_aws_sso_config_file(path, section):
-    config = ConfigParser()
-    par    = {}
-    try:
-        config.read(path)
-        par=dict(config.items(section))
-        for p in par:
-            par[p]=par[p].split("#",1)[0].strip()
-        return par        
-    except Exception as e :
-        return par    
+    return _read_section_configuration(path, section)
 
 def _set_profile_in_use(profile_name):
     profile_name = _get_profile_name(profile_name)
@@ -682,6 +874,10 @@ def _set_profile_in_use(profile_name):
     config.set(AWS_SSO_PROFILE_IN_USE , "profile", profile_name)
 
     _write_config(AWS_SSO_CONFIG_PATH, config)
+    _record_profile_use(profile_name)
+    # Left out of the credentials file by the materialize policy until now
+    from .materialize import materialize_profile
+    materialize_profile(profile_name)
 
 
 def _get_profile_in_use():
@@ -706,9 +902,18 @@ def _role_shortening(profile_name):
     profile_name = profile_name.replace("viewonlyaccess", "viewonly")
     return profile_name
 
+def _get_alias_key(profile_name):
+    # The aliases are keyed by the first component of the profile name, the account name
+    return profile_name.partition('-')[0]
+
+def _get_account_alias(account_name, aliases):
+    """The alias of an account, looked up like _replace_alias does on its profile names."""
+    from aws_sso_lib.config_file_writer import process_profile_name
+    profile_name = process_profile_name(get_safe_account_name(account_name)).replace(".", "-").lower()
+    return aliases.get(_get_alias_key(profile_name), "")
+
 def _replace_alias(profile_name):
-    partitioned_string = profile_name.partition('-')
-    account_name = partitioned_string[0]
+    account_name = _get_alias_key(profile_name)
     config = _read_aws_sso_config_file(AWS_SSO_CONFIG_PATH, AWS_SSO_CONFIG_ALIAS)
     res = bool(config)
     if res:
@@ -724,6 +929,7 @@ def _replace_alias(profile_name):
     return profile_name
 
 def process_profile_name_formatter(profile_name):
+    from aws_sso_lib.config_file_writer import process_profile_name
     profile_name = process_profile_name(profile_name)
     profile_name = profile_name.replace(".", "-").lower() 
     profile = _replace_alias(profile_name)
@@ -756,6 +962,84 @@ def _create_aws_sso_conf_file(configfile_name):
         cfgfile.close()
         print(f"{configfile_name} file created")
 
+# Generated State Utils
+
+def _load_manifest():
+    from .transaction import get_current_transaction
+    transaction = get_current_transaction()
+    if transaction is not None and transaction.get_document(AWS_SSO_MANIFEST_PATH) is not None:
+        return transaction.get_document(AWS_SSO_MANIFEST_PATH)
+    manifest = {"version": AWS_SSO_MANIFEST_VERSION, "files": {}}
+    if os.path.isfile(AWS_SSO_MANIFEST_PATH):
+        data = _load_json(AWS_SSO_MANIFEST_PATH)
+        if isinstance(data, dict) and data.get("version") == AWS_SSO_MANIFEST_VERSION:
+            manifest = data
+    return manifest
+
+def _save_manifest(manifest):
+    from .transaction import get_current_transaction
+    transaction = get_current_transaction()
+    if transaction is not None:
+        transaction.set_document(AWS_SSO_MANIFEST_PATH, manifest, _write_manifest)
+        return
+    _write_manifest(manifest)
+
+def _write_manifest(manifest):
+    _create_tool_directory(Path.home(), AWS_SSO_DIR)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(AWS_SSO_MANIFEST_PATH), prefix=".tmp-")
+    with os.fdopen(fd, "w") as destination:
+        json.dump(manifest, destination, indent=1, sort_keys=True)
+    os.replace(temp_path, AWS_SSO_MANIFEST_PATH)
+
+def _record_generated_sections(path, sections):
+    # Keeps track of the sections written by the tool, so logout can remove them
+    manifest = _load_manifest()
+    recorded = set(manifest["files"].get(path, []))
+    if recorded.issuperset(sections):
+        return
+    recorded.update(sections)
+    manifest["files"][path] = sorted(recorded)
+    _save_manifest(manifest)
+
+def _get_generated_sections(path):
+    return _load_manifest()["files"].get(path, [])
+
+def _forget_generated_sections(paths):
+    manifest = _load_manifest()
+    for path in paths:
+        manifest["files"].pop(path, None)
+    _save_manifest(manifest)
+
+def _forget_sections(path, sections):
+    manifest = _load_manifest()
+    recorded = [section for section in manifest["files"].get(path, []) if section not in set(sections)]
+    if recorded:
+        manifest["files"][path] = recorded
+    else:
+        manifest["files"].pop(path, None)
+    _save_manifest(manifest)
+
+def _record_discovery(start_url, sections):
+    # The profiles of the latest complete discovery of a start URL, the generated ones missing from it are stale
+    manifest = _load_manifest()
+    manifest.setdefault("discoveries", {})[start_url] = {
+        "at": datetime.now(UTC).isoformat(timespec="seconds"),
+        "sections": sorted(sections),
+    }
+    _save_manifest(manifest)
+
+def _get_discoveries():
+    return _load_manifest().get("discoveries", {})
+
+def _record_profile_use(profile_name):
+    # The recent materialize policy keeps the profiles used lately on the credentials file
+    manifest = _load_manifest()
+    manifest.setdefault("used", {})[profile_name] = datetime.now(UTC).isoformat(timespec="seconds")
+    _save_manifest(manifest)
+
+def _get_profile_uses():
+    return _load_manifest().get("used", {})
+
 def add_new_key_value_conf_file(configfile_name, section_name, key, value):
     config = _read_config(configfile_name)
     config.set(section_name, key, value)
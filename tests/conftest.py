@@ -0,0 +1,90 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+LOAD_HARNESS = os.path.join(ROOT, "utilities", "load_harness")
+sys.path[:0] = [SRC, LOAD_HARNESS]
+
+# The paths of aws_sso_magic are read from HOME when it's imported, the tests that
+# import it get a HOME of their own and the commands run on a new HOME each
+os.environ["HOME"] = os.environ["USERPROFILE"] = tempfile.mkdtemp(prefix="aws-sso-magic-tests-")
+
+from harness import SSO_SESSION, default_profile_name, prepare_home
+from stand_in import StandInConfig, StandInServer, DEFAULT_TOKEN
+
+# login checks the version of the AWS CLI v2 before anything else
+requires_aws_cli = pytest.mark.skipif(shutil.which("aws") is None, reason="the login command needs the AWS CLI v2")
+
+CLEARED_ENV_VARS = ["AWS_PROFILE", "AWS_DEFAULT_PROFILE", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN",
+                    "AWS_CONFIG_FILE", "AWS_SHARED_CREDENTIALS_FILE", "KUBECONFIG"]
+
+@pytest.fixture
+def stand_in():
+    server = StandInServer(StandInConfig(accounts=5, roles_per_account=2)).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def home():
+    """A HOME with the stand-in sso-session, a cached login and the proxy role config."""
+    path = prepare_home(DEFAULT_TOKEN)
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+@pytest.fixture
+def empty_home():
+    path = tempfile.mkdtemp(prefix="aws-sso-magic-empty-")
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+def command_environment(home, server=None, **extra):
+    env = dict(os.environ)
+    for var in CLEARED_ENV_VARS:
+        env.pop(var, None)
+    env.update({
+        "HOME": home,
+        "USERPROFILE": home,
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "CLI_NO_COLOR": "1",
+        "PYTHONPATH": os.pathsep.join([SRC] + [p for p in [os.environ.get("PYTHONPATH")] if p]),
+    })
+    if server is not None:
+        env.update(server.endpoint_environment())
+    env.update(extra)
+    return env
+
+def run_command(home, server, *args, timeout=120, **extra_env):
+    """Run aws-sso-magic on a new process with the HOME and the stand-in endpoints."""
+    return subprocess.run([sys.executable, "-m", "aws_sso_magic"] + list(args),
+                          env=command_environment(home, server, **extra_env),
+                          stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True, timeout=timeout)
+
+def run_python(home, server, code, timeout=120, **extra_env):
+    """Run a snippet on a new process, so aws_sso_magic reads the paths of the HOME."""
+    return subprocess.run([sys.executable, "-c", code],
+                          env=command_environment(home, server, **extra_env),
+                          stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True, timeout=timeout)
+
+def login_args():
+    return ["login", "--sso-session", SSO_SESSION, "--profile", default_profile_name()]
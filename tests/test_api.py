@@ -0,0 +1,112 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import os
+import shutil
+import textwrap
+
+from configparser import ConfigParser
+
+from conftest import run_python
+from harness import SSO_SESSION, SSO_START_URL, SSO_REGION
+from stand_in import account_id, role_name
+
+CONCURRENT_WRITES = textwrap.dedent("""
+    import json, logging, threading
+    from aws_sso_magic.api import SsoMagic, Profile
+
+    def profiles(prefix, count):
+        return [Profile("%s-%04d" % (prefix, i), prefix + "-account", "%012d" % i, "Role0", "us-east-1", {start_url!r}, {region!r})
+                for i in range(count)]
+
+    magic = SsoMagic()
+    errors = []
+    def write(prefix, count):
+        try:
+            magic.write_profiles(profiles(prefix, count))
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=write, args=args) for args in [("t1", 50), ("t2", 500)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(json.dumps({{"errors": errors, "root_handlers": len(logging.getLogger().handlers)}}))
+""").format(start_url=SSO_START_URL, region=SSO_REGION)
+
+def _sections(path):
+    config = ConfigParser()
+    config.read(path)
+    return config.sections()
+
+def test_write_profiles_from_several_threads(home):
+    result = run_python(home, None, CONCURRENT_WRITES)
+    assert result.returncode == 0, result.stdout
+    report = json.loads(result.stdout.splitlines()[-1])
+    assert report == {"errors": [], "root_handlers": 0}
+
+    config_sections = _sections(os.path.join(home, ".aws", "config"))
+    credentials_sections = _sections(os.path.join(home, ".aws", "credentials"))
+    for prefix, count in [("t1", 50), ("t2", 500)]:
+        assert sum(1 for section in config_sections if section.startswith(f"profile {prefix}-")) == count
+        assert sum(1 for section in credentials_sections if section.startswith(f"{prefix}-")) == count
+
+    with open(os.path.join(home, ".aws-sso-magic", "manifest.json")) as f:
+        manifest = json.load(f)
+    assert len(manifest["files"][os.path.join(home, ".aws", "config")]) == 550
+
+def test_write_profiles_without_a_proxy_role(home):
+    os.remove(os.path.join(home, ".aws-sso-magic", "config"))
+    result = run_python(home, None, textwrap.dedent("""
+        from aws_sso_magic.api import SsoMagic, Profile, AwsSsoMagicError
+        try:
+            SsoMagic().write_profiles([Profile("p", "a", "000000000000", "Role0", "us-east-1", {!r}, {!r})])
+        except AwsSsoMagicError as e:
+            print("AwsSsoMagicError", e)
+    """).format(SSO_START_URL, SSO_REGION))
+    assert result.returncode == 0, result.stdout
+    assert result.stdout.startswith("AwsSsoMagicError No proxy role for p")
+    assert not os.path.exists(os.path.join(home, ".aws", "credentials"))
+
+def test_an_unwritable_aws_directory_raises_the_api_error(home):
+    # A file where the directory should be, unwritable even for root
+    shutil.rmtree(os.path.join(home, ".aws"))
+    with open(os.path.join(home, ".aws"), "w") as f:
+        f.write("not a directory")
+    result = run_python(home, None, textwrap.dedent("""
+        from aws_sso_magic.api import SsoMagic, Profile, AwsSsoMagicError
+        try:
+            SsoMagic().write_profiles([Profile("p", "a", "000000000000", "Role0", "us-east-1", {!r}, {!r})])
+        except AwsSsoMagicError as e:
+            print("AwsSsoMagicError", e)
+    """).format(SSO_START_URL, SSO_REGION))
+    assert result.returncode == 0, result.stdout
+    assert result.stdout.startswith("AwsSsoMagicError Unable to write the profiles")
+
+def test_an_unwritable_credentials_cache_raises_the_api_error(home, stand_in):
+    with open(os.path.join(home, ".aws", "config"), "a") as f:
+        f.write("\n[profile p]\nsso_session = {}\nsso_start_url = {}\nsso_region = {}\nsso_account_id = {}\nsso_role_name = {}\n".format(
+            SSO_SESSION, SSO_START_URL, SSO_REGION, account_id(0), role_name(0)))
+    with open(os.path.join(home, ".aws-sso-magic", "cache"), "w") as f:
+        f.write("not a directory")
+    result = run_python(home, stand_in, textwrap.dedent("""
+        from aws_sso_magic.api import SsoMagic, AwsSsoMagicError
+        try:
+            SsoMagic().get_credentials("p")
+        except AwsSsoMagicError as e:
+            print("AwsSsoMagicError", e)
+    """))
+    assert result.returncode == 0, result.stdout
+    assert result.stdout.startswith("AwsSsoMagicError Unable to write the credentials of p")
@@ -0,0 +1,73 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import botocore
+import pytest
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from botocore.session import Session
+
+from aws_sso_magic import concurrency
+from aws_sso_magic.concurrency import client_limiter, concurrency_stats, DEFAULT_INITIAL_LIMIT
+from stand_in import StandInConfig, StandInServer, DEFAULT_TOKEN
+
+ATTEMPTS = 3
+
+@pytest.fixture
+def throttling_stand_in():
+    # A fixed latency, so the limit grows back on every call answered
+    server = StandInServer(StandInConfig(accounts=5, roles_per_account=2, latency_ms=5)).start()
+    yield server
+    server.stop()
+
+@pytest.fixture(autouse=True)
+def new_limiters():
+    concurrency._LIMITERS.clear()
+    yield
+    concurrency._LIMITERS.clear()
+
+def _client(server, service):
+    config = Config(region_name="us-east-1", retries={"total_max_attempts": ATTEMPTS, "mode": "standard"})
+    if service == "sso":
+        config = config.merge(Config(signature_version=botocore.UNSIGNED))
+    return Session().create_client(service, config=config, endpoint_url=server.url,
+                                   aws_access_key_id="AKIAEXAMPLE", aws_secret_access_key="secret")
+
+def _call(client):
+    if client.meta.service_model.service_name == "sso":
+        return client.list_accounts(accessToken=DEFAULT_TOKEN)
+    return client.list_clusters()
+
+@pytest.mark.parametrize("service, error_code", [("sso", "TooManyRequestsException"), ("eks", "ThrottlingException")])
+def test_the_limit_shrinks_on_throttling_and_grows_back(throttling_stand_in, service, error_code):
+    client = _client(throttling_stand_in, service)
+    limiter = client_limiter(client)
+
+    throttling_stand_in.config = throttling_stand_in.config._replace(throttle_rate=1.0)
+    with pytest.raises(ClientError) as error:
+        with limiter.slot():
+            _call(client)
+    assert error.value.response["Error"]["Code"] == error_code
+    # Every attempt is reported by the needs-retry hook, the limit is only halved once per call
+    stats = limiter.stats()
+    assert stats["throttled"] == ATTEMPTS
+    assert stats["decreases"] == 1
+    assert limiter.limit == DEFAULT_INITIAL_LIMIT / 2
+
+    throttling_stand_in.config = throttling_stand_in.config._replace(throttle_rate=0.0)
+    for _ in range(10):
+        with limiter.slot():
+            _call(client)
+    assert limiter.limit > DEFAULT_INITIAL_LIMIT
+    assert [s["service"] for s in concurrency_stats()] == [service]
@@ -0,0 +1,42 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+
+from conftest import run_command
+from harness import SSO_SESSION, SSO_START_URL, SSO_REGION
+from stand_in import account_id, role_name
+
+PROFILES = ["acct0000-role0", "acct0001-role0"]
+
+def _add_profiles(home):
+    with open(os.path.join(home, ".aws", "config"), "a") as f:
+        for index, profile_name in enumerate(PROFILES):
+            f.write("\n[profile {}]\nsso_session = {}\nsso_start_url = {}\nsso_region = {}\nsso_account_id = {}\nsso_role_name = {}\nregion = {}\n".format(
+                profile_name, SSO_SESSION, SSO_START_URL, SSO_REGION, account_id(index), role_name(0), SSO_REGION))
+
+def _files(home):
+    return sorted(os.path.relpath(os.path.join(root, name), home) for root, dirs, names in os.walk(home) for name in names)
+
+def test_exec_keeps_the_credentials_in_memory(home, stand_in):
+    _add_profiles(home)
+    before = _files(home)
+
+    result = run_command(home, stand_in, "exec", "--profiles", "acct*", "--",
+                         sys.executable, "-c", "import os; print(bool(os.environ['AWS_SESSION_TOKEN']))")
+
+    assert result.returncode == 0, result.stdout
+    for profile_name in PROFILES:
+        assert "[{}] True".format(profile_name) in result.stdout
+    assert _files(home) == before
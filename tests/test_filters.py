@@ -0,0 +1,78 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import os
+import sys
+
+import pytest
+
+from aws_sso_magic.filters import NameFilter
+from conftest import run_command
+from harness import SSO_SESSION, SSO_START_URL, SSO_REGION
+from stand_in import account_id, account_name, role_name
+
+def test_name_filter_patterns(tmp_path):
+    patterns_file = tmp_path / "accounts"
+    patterns_file.write_text("# production accounts\nprod-web\n\nre:^prod-db-\\d+$\n")
+
+    name_filter = NameFilter(["Shared", "dev-*", "@" + str(patterns_file)])
+
+    assert name_filter.matches("shared")
+    assert name_filter.matches("DEV-api")
+    assert name_filter.matches("prod-web")
+    assert name_filter.matches("prod-db-01")
+    assert not name_filter.matches("prod-db-primary")
+    assert not name_filter.matches("# production accounts")
+    # Any of the values, eg: the account name or its id
+    assert name_filter.matches(None, "shared")
+    assert NameFilter([]).matches("anything")
+
+def test_name_filter_errors(tmp_path):
+    with pytest.raises(ValueError, match="Invalid filter regex"):
+        NameFilter(["re:prod-("])
+    with pytest.raises(ValueError, match="Unable to read the filter file"):
+        NameFilter(["@" + str(tmp_path / "missing")])
+
+def _requests(server, operation):
+    return len(server.stats.snapshot()["latencies"].get(operation, []))
+
+def test_the_roles_of_filtered_out_accounts_are_never_listed(home, stand_in, tmp_path):
+    patterns_file = tmp_path / "accounts"
+    patterns_file.write_text("{}\n".format(account_name(3)))
+
+    result = run_command(home, stand_in, "login", "--sso-session", SSO_SESSION, "--dry-run", "--dry-run-format", "json",
+                         "--account-filter", "re:^acct000[02]$", "--account-filter", "@" + str(patterns_file),
+                         "--role-filter", role_name(1))
+
+    assert result.returncode == 0, result.stdout
+    profiles = [json.loads(line) for line in result.stdout.splitlines() if line.startswith('{"type": "profile"')]
+    assert sorted(p["config"]["sso_account_id"] for p in profiles) == [account_id(0), account_id(2), account_id(3)]
+    assert {p["config"]["sso_role_name"] for p in profiles} == {role_name(1)}
+    assert _requests(stand_in, "sso:ListAccountRoles") == 3
+
+def test_exec_selects_the_profiles_with_the_same_patterns(home, stand_in, tmp_path):
+    with open(os.path.join(home, ".aws", "config"), "a") as f:
+        for index in range(4):
+            f.write("\n[profile {}]\nsso_session = {}\nsso_start_url = {}\nsso_region = {}\nsso_account_id = {}\nsso_account_name = {}\nsso_role_name = {}\n".format(
+                account_name(index), SSO_SESSION, SSO_START_URL, SSO_REGION, account_id(index), account_name(index), role_name(0)))
+    patterns_file = tmp_path / "profiles"
+    patterns_file.write_text("{}\n".format(account_id(3)))
+
+    result = run_command(home, stand_in, "exec", "--profiles", "re:000[01]$", "--profiles", "@" + str(patterns_file), "--",
+                         sys.executable, "-c", "pass")
+
+    assert result.returncode == 0, result.stdout
+    assert _requests(stand_in, "sso:GetRoleCredentials") == 3
+    selected = sorted(line.split()[0] for line in result.stdout.splitlines() if line.startswith("acct"))
+    assert selected == [account_name(0), account_name(1), account_name(3)]
@@ -0,0 +1,117 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import os
+
+from configparser import ConfigParser
+from datetime import datetime, timedelta, timezone
+
+from conftest import requires_aws_cli, run_command, login_args
+from stand_in import account_name
+
+STALE_PROFILES = ["{}-role0".format(account_name(4)), "{}-role1".format(account_name(4))]
+
+def _timestamp(delta):
+    return (datetime.now(timezone.utc) + delta).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _write_cache_file(home, file_name, data):
+    path = os.path.join(home, ".aws", "sso", "cache", file_name)
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
+
+def _write_expired_cache(home):
+    """An expired token the AWS CLI can still refresh, an expired one it can't and an
+    expired client registration. Returns their paths."""
+    refreshable = _write_cache_file(home, "refreshable.json", {
+        "startUrl": "https://refreshable.awsapps.com/start", "region": "us-east-1", "accessToken": "token",
+        "expiresAt": _timestamp(timedelta(hours=-1)), "clientId": "id", "clientSecret": "secret",
+        "refreshToken": "refresh", "registrationExpiresAt": _timestamp(timedelta(days=30)),
+    })
+    expired = _write_cache_file(home, "expired.json", {
+        "startUrl": "https://expired.awsapps.com/start", "region": "us-east-1", "accessToken": "token",
+        "expiresAt": _timestamp(timedelta(hours=-1)),
+    })
+    registration = _write_cache_file(home, "botocore-client-id-us-east-1.json", {
+        "clientId": "id", "clientSecret": "secret", "expiresAt": _timestamp(timedelta(days=-1)),
+    })
+    return refreshable, expired, registration
+
+def _gc(home, *args):
+    result = run_command(home, None, "gc", "--json", *args)
+    assert result.returncode == 0, result.stdout
+    return json.loads(result.stdout[result.stdout.index("{"):])["removed"]
+
+def _sections(path):
+    config = ConfigParser()
+    config.read(path)
+    return config.sections()
+
+def test_expired_cache_entries_are_removed_unless_the_token_can_be_refreshed(home):
+    refreshable, expired, registration = _write_expired_cache(home)
+
+    removed = _gc(home)
+
+    assert sorted((item["kind"], item["path"]) for item in removed) == [("registration", registration), ("token", expired)]
+    assert os.path.isfile(refreshable)
+    assert not os.path.exists(expired)
+    assert not os.path.exists(registration)
+
+@requires_aws_cli
+def test_profiles_are_stale_only_after_a_complete_discovery(home, stand_in):
+    assert run_command(home, stand_in, *login_args()).returncode == 0
+    config_path = os.path.join(home, ".aws", "config")
+    credentials_path = os.path.join(home, ".aws", "credentials")
+    assert set(STALE_PROFILES).issubset(_sections(credentials_path))
+
+    stand_in.config = stand_in.config._replace(accounts=4)
+    # A filtered discovery doesn't list every profile of the start URL
+    result = run_command(home, stand_in, *login_args(), "--account-filter", account_name(0))
+    assert result.returncode == 0, result.stdout
+    assert _gc(home) == []
+    assert "profile {}".format(STALE_PROFILES[0]) in _sections(config_path)
+
+    assert run_command(home, stand_in, *login_args()).returncode == 0
+    removed = _gc(home)
+
+    assert sorted(item["name"] for item in removed if item["kind"] == "profile") == STALE_PROFILES
+    config_sections = _sections(config_path)
+    credentials_sections = _sections(credentials_path)
+    for profile in STALE_PROFILES:
+        assert "profile {}".format(profile) not in config_sections
+        assert profile not in credentials_sections
+    assert "profile {}-role0".format(account_name(3)) in config_sections
+    assert "{}-role0".format(account_name(3)) in credentials_sections
+    assert _gc(home) == []
+
+@requires_aws_cli
+def test_dry_run_deletes_nothing(home, stand_in):
+    assert run_command(home, stand_in, *login_args()).returncode == 0
+    stand_in.config = stand_in.config._replace(accounts=4)
+    assert run_command(home, stand_in, *login_args()).returncode == 0
+    paths = _write_expired_cache(home)
+    files = {}
+    for path in [os.path.join(home, ".aws", "config"), os.path.join(home, ".aws", "credentials"),
+                 os.path.join(home, ".aws-sso-magic", "manifest.json")]:
+        with open(path) as f:
+            files[path] = f.read()
+
+    removed = _gc(home, "--dry-run")
+
+    assert sorted(item["kind"] for item in removed) == ["profile", "profile", "registration", "token"]
+    for path in paths:
+        assert os.path.isfile(path)
+    for path, content in files.items():
+        with open(path) as f:
+            assert f.read() == content
@@ -0,0 +1,71 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import shutil
+
+import pytest
+
+from configparser import ConfigParser
+
+from aws_sso_magic.inventory import InventoryWriter, load_inventory
+from aws_sso_magic.login import ConfigParams
+from conftest import run_command, login_args, requires_aws_cli
+from harness import SSO_SESSION, SSO_START_URL, SSO_REGION, default_profile_name
+
+@requires_aws_cli
+def test_import_then_login_on_an_empty_home(home, empty_home, stand_in, tmp_path):
+    inventory = str(tmp_path / "inventory.json")
+    result = run_command(home, stand_in, *login_args(), "--export-inventory", inventory)
+    assert result.returncode == 0, result.stdout
+
+    # Only the SSO login is cached on the new workstation
+    shutil.copytree(os.path.join(home, ".aws", "sso"), os.path.join(empty_home, ".aws", "sso"))
+    result = run_command(empty_home, stand_in, "login", "--import-inventory", inventory, "--profile", default_profile_name())
+    assert result.returncode == 0, result.stdout
+
+    config = ConfigParser()
+    config.read(os.path.join(empty_home, ".aws", "config"))
+    assert dict(config.items(f"profile {SSO_SESSION}")) == {
+        "sso_session": SSO_SESSION,
+        "region": "us-east-1",
+        "output": "json",
+        "sso_start_url": SSO_START_URL,
+        "sso_region": SSO_REGION,
+    }
+
+    result = run_command(empty_home, stand_in, *login_args())
+    assert result.returncode == 0, result.stdout
+    result = run_command(empty_home, stand_in, "list", "--refresh", "--sso-session", SSO_SESSION, "--json")
+    assert result.returncode == 0, result.stdout
+
+def _profile(index):
+    return ConfigParams(f"p{index}", "acct", "000000000000", "Role0", "us-east-1", SSO_START_URL, SSO_REGION)
+
+def test_writer_only_leaves_the_committed_inventory(tmp_path):
+    path = str(tmp_path / "inventory.json")
+    writer = InventoryWriter(path, [])
+    assert os.listdir(str(tmp_path)) == []
+
+    with pytest.raises(RuntimeError):
+        with InventoryWriter(path, []) as failed:
+            failed.add(_profile(0))
+            raise RuntimeError("discovery failed")
+    assert os.listdir(str(tmp_path)) == []
+
+    with writer:
+        writer.add(_profile(0))
+        writer.add(_profile(1))
+        writer.commit()
+    assert os.listdir(str(tmp_path)) == ["inventory.json"]
+    assert [profile["profile_name"] for profile in load_inventory(path)["profiles"]] == ["p0", "p1"]
@@ -0,0 +1,58 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import os
+import time
+
+from conftest import run_command, run_python
+from harness import SSO_SESSION, SSO_START_URL, SSO_REGION
+from stand_in import account_id, role_name
+
+def _rows(result):
+    assert result.returncode == 0, result.stdout
+    return [json.loads(line) for line in result.stdout.splitlines() if line.startswith("{")]
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+def test_list_shows_the_role_credentials_expiry_and_the_aliases(home):
+    with open(os.path.join(home, ".aws", "config"), "a") as f:
+        for index, account_name in enumerate(["Team.Prod", "Team.Dev"]):
+            f.write("\n[profile {}-role0]\nsso_session = {}\nsso_start_url = {}\nsso_region = {}\nsso_account_id = {}\nsso_account_name = {}\nsso_role_name = {}\n".format(
+                account_name.lower().replace(".", "-"), SSO_SESSION, SSO_START_URL, SSO_REGION, account_id(index), account_name, role_name(0)))
+    with open(os.path.join(home, ".aws-sso-magic", "config"), "a") as f:
+        # Keyed like on login, by the first component of the profile name
+        f.write("\n[AliasAccounts]\nteam = squad\n")
+    expiration = int((time.time() + 3600) * 1000)
+    result = run_python(home, None, "from aws_sso_magic.credentials_cache import get_credentials_cache\n"
+                        "get_credentials_cache().put(%r, %r, %r, {'accessKeyId': 'a', 'secretAccessKey': 's', 'sessionToken': 't', 'expiration': %d})"
+                        % (account_id(0), role_name(0), SSO_START_URL, expiration))
+    assert result.returncode == 0, result.stdout
+
+    rows = {row["account_name"]: row for row in _rows(run_command(home, None, "list", "--json"))}
+
+    assert rows["Team.Prod"]["credentials_expire"] != ""
+    assert rows["Team.Dev"]["credentials_expire"] == ""
+    assert rows["Team.Prod"]["alias"] == rows["Team.Dev"]["alias"] == "squad"
+
+def test_list_refresh_formats_the_names_without_writing_the_config(home, stand_in):
+    config_path = os.path.join(home, ".aws", "config")
+    config = _read(config_path)
+
+    rows = _rows(run_command(home, stand_in, "list", "--refresh", "--sso-session", SSO_SESSION, "--json", "--components", "account_id,role_name"))
+
+    assert len(rows) == 10
+    assert all(row["profile_name"].startswith(row["account_id"]) for row in rows)
+    assert _read(config_path) == config
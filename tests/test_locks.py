@@ -0,0 +1,87 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import textwrap
+
+from conftest import command_environment, run_command, login_args, requires_aws_cli
+from harness import SSO_SESSION, SSO_START_URL, SSO_REGION
+
+PROCESSES = 6
+
+HOLD_TOKEN_LOCK = textwrap.dedent("""
+    import sys
+    from aws_sso_magic.locks import file_lock
+    with file_lock("token {}"):
+        print("locked", flush=True)
+        sys.stdin.read()
+""").format(SSO_START_URL)
+
+@requires_aws_cli
+def test_lock_timeout_is_reported_by_the_command(home, stand_in):
+    # Without a cached login, login waits for the process holding the lock of the start URL
+    shutil.rmtree(os.path.join(home, ".aws", "sso", "cache"))
+    holder = subprocess.Popen([sys.executable, "-c", HOLD_TOKEN_LOCK], env=command_environment(home, stand_in),
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        result = run_command(home, stand_in, *login_args(), AWS_SSO_MAGIC_LOCK_TIMEOUT="1")
+    finally:
+        holder.communicate("")
+    assert result.returncode == 1, result.stdout
+    assert "ERROR: Timed out after 1 seconds waiting for the lock" in result.stdout
+    assert "Traceback" not in result.stdout
+
+# A token fetcher that takes a while, like a device authorization, and counts its logins
+FAKE_LOGIN = textwrap.dedent("""
+    import hashlib, json, os, sys, time
+    from datetime import datetime, timedelta, timezone
+    from botocore.session import Session
+    from aws_sso_lib.config import SSOInstance
+    from aws_sso_magic import login
+
+    class FakeTokenFetcher:
+        def fetch_token(self, start_url, force_refresh=False):
+            with open(sys.argv[1], "a") as f:
+                f.write(str(os.getpid()) + "\\n")
+            time.sleep(1)
+            expires_at = (datetime.now(timezone.utc) + timedelta(hours=8)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            token = {{"startUrl": start_url, "region": {region!r}, "accessToken": "token-" + str(os.getpid()), "expiresAt": expires_at}}
+            path = os.path.expanduser(os.path.join("~", ".aws", "sso", "cache", hashlib.sha1(start_url.encode("utf-8")).hexdigest() + ".json"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(token, f)
+            return token
+
+    login.get_token_fetcher = lambda *args, **kwargs: FakeTokenFetcher()
+    instance = SSOInstance({start_url!r}, {region!r}, "test", "test")
+    print(json.dumps(login._get_token(Session(), instance, {sso_session!r}, False)["accessToken"]))
+""").format(start_url=SSO_START_URL, region=SSO_REGION, sso_session=SSO_SESSION)
+
+def test_only_one_process_logs_in(home, tmp_path):
+    shutil.rmtree(os.path.join(home, ".aws", "sso", "cache"))
+    logins = str(tmp_path / "logins")
+    processes = [subprocess.Popen([sys.executable, "-c", FAKE_LOGIN, logins], env=command_environment(home),
+                                  stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+                 for _ in range(PROCESSES)]
+    outputs = [process.communicate(timeout=120)[0] for process in processes]
+    assert all(process.returncode == 0 for process in processes), outputs
+
+    with open(logins) as f:
+        assert len(f.read().splitlines()) == 1
+    tokens = {json.loads(output.splitlines()[-1]) for output in outputs}
+    assert len(tokens) == 1, outputs
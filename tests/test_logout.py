@@ -0,0 +1,32 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import os
+
+from datetime import datetime, timedelta, timezone
+
+from conftest import run_command
+
+def test_a_token_with_an_invalid_region_doesnt_stop_the_logout(home, stand_in):
+    cache_dir = os.path.join(home, ".aws", "sso", "cache")
+    expires_at = (datetime.now(timezone.utc) + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    # Sorted before the token of the stand-in, the client of its region can't be created
+    with open(os.path.join(cache_dir, "0000.json"), "w") as f:
+        json.dump({"startUrl": "https://broken.awsapps.com/start", "region": "not a region", "accessToken": "broken", "expiresAt": expires_at}, f)
+
+    result = run_command(home, stand_in, "logout")
+
+    assert result.returncode == 0, result.stdout
+    assert "Traceback" not in result.stdout
+    assert [f for f in os.listdir(cache_dir) if f.endswith(".json")] == []
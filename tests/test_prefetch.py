@@ -0,0 +1,70 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import os
+import shutil
+import textwrap
+
+from conftest import run_command, run_python, login_args, requires_aws_cli
+from harness import SSO_SESSION, default_profile_name
+
+# A login answering both menus once the prefetch threads are done, like a user reading them
+LOGIN_WITH_MENUS = textwrap.dedent("""
+    import json, threading, time
+    from aws_sso_magic import login, utils
+    from aws_sso_magic.concurrency import concurrency_stats
+
+    def wait_for_prefetch():
+        deadline = time.monotonic() + 30
+        while any(t.name.startswith("prefetch-") for t in threading.enumerate()) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def sso_session_menu():
+        wait_for_prefetch()
+        return {sso_session!r}
+
+    def profile_menu(sso_session):
+        wait_for_prefetch()
+        return {profile!r}
+
+    utils.get_sso_sessions = sso_session_menu
+    login.get_config_profile_list = profile_menu
+    try:
+        login.login.main([], standalone_mode=False)
+    except SystemExit as e:
+        assert not e.code, e.code
+    print(json.dumps([s for s in concurrency_stats() if s["service"] == "sso"]))
+""").format(sso_session=SSO_SESSION, profile=default_profile_name())
+
+@requires_aws_cli
+def test_the_menus_reuse_the_prefetched_discovery_and_credentials(home, stand_in):
+    # A first login leaves the profile in use, the answer the prefetch bets on
+    result = run_command(home, stand_in, *login_args())
+    assert result.returncode == 0, result.stdout
+    shutil.rmtree(os.path.join(home, ".aws-sso-magic", "cache", "credentials"))
+    stand_in.stats.reset()
+
+    result = run_python(home, stand_in, LOGIN_WITH_MENUS, AWS_SSO_MAGIC_MAX_CONCURRENCY="1")
+    assert result.returncode == 0, result.stdout
+    assert "while the menu was open" in result.stdout
+
+    requests = {operation: len(latencies) for operation, latencies in stand_in.stats.snapshot()["latencies"].items()}
+    # Nothing was listed or fetched again once the menus were answered
+    assert requests["sso:ListAccounts"] == 1
+    assert requests["sso:ListAccountRoles"] == stand_in.config.accounts
+    assert requests["sso:GetRoleCredentials"] == 1
+    # Every call, the prefetched ones too, went through the limiter of AWS SSO
+    [sso_stats] = json.loads(result.stdout.splitlines()[-1])
+    assert sso_stats["calls"] == sum(count for operation, count in requests.items() if operation.startswith("sso:"))
+    assert sso_stats["max_in_flight"] == 1
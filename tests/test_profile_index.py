@@ -0,0 +1,103 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+
+import pytest
+
+from configparser import ConfigParser
+
+from aws_sso_magic import profile_index
+from aws_sso_magic.profile_index import ProfileIndex, INDEX_MIN_SIZE, get_profile_index, is_indexed
+from aws_sso_magic.utils import _get_indexed_section, _write_config_file
+
+def _write_profiles(path, count, region="us-east-1"):
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write("[profile p{:05d}]\nsso_account_id = {:012d}\nsso_role_name = Role0\nregion = {}\n\n".format(i, i, region))
+
+@pytest.fixture
+def big_config(tmp_path):
+    path = str(tmp_path / "config")
+    _write_profiles(path, 2000)
+    assert os.path.getsize(path) >= INDEX_MIN_SIZE
+    return path
+
+@pytest.fixture
+def rebuilds(monkeypatch):
+    calls = []
+    rebuild = ProfileIndex._rebuild
+    def counted(self, stamp):
+        calls.append(self.source_path)
+        return rebuild(self, stamp)
+    monkeypatch.setattr(ProfileIndex, "_rebuild", counted)
+    return calls
+
+def test_only_files_from_64kb_are_indexed(tmp_path):
+    path = str(tmp_path / "config")
+    _write_profiles(path, 10)
+    with open(path, "a") as f:
+        f.write("#" * (INDEX_MIN_SIZE - 1 - os.path.getsize(path)))
+    assert not is_indexed(path)
+    assert _get_indexed_section(path, "profile p00001")["sso_account_id"] == "000000000001"
+    assert path not in profile_index._INDEXES
+
+    with open(path, "a") as f:
+        f.write("#")
+    assert is_indexed(path)
+    assert _get_indexed_section(path, "profile p00001")["sso_account_id"] == "000000000001"
+    assert path in profile_index._INDEXES
+
+def test_the_index_is_invalidated_by_the_config_writes(big_config):
+    index = get_profile_index(big_config)
+    assert index.get_section("profile p00010")["region"] == "us-east-1"
+
+    config = ConfigParser()
+    config.read(big_config)
+    config.set("profile p00000", "region", "ap-southeast-2")
+    config.add_section("profile new")
+    config.set("profile new", "sso_account_id", "999999999999")
+    _write_config_file(big_config, config)
+
+    assert index._index is None
+    assert index.get_section("profile p00000")["region"] == "ap-southeast-2"
+    assert index.get_section("profile p00010")["region"] == "us-east-1"
+    assert index.sections_for_account("999999999999") == ["profile new"]
+
+def test_an_edit_outside_the_tool_rebuilds_the_index(big_config, tmp_path, rebuilds):
+    index_dir = str(tmp_path / "index")
+    assert ProfileIndex(big_config, index_dir).get_section("profile p00010")["region"] == "us-east-1"
+    assert len(rebuilds) == 1
+
+    # Loaded from the sidecar by another process
+    assert ProfileIndex(big_config, index_dir).get_section("profile p00010")["region"] == "us-east-1"
+    assert len(rebuilds) == 1
+
+    # Touched but unchanged, the hash still matches
+    stat = os.stat(big_config)
+    os.utime(big_config, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert ProfileIndex(big_config, index_dir).get_section("profile p00010")["region"] == "us-east-1"
+    assert len(rebuilds) == 1
+
+    # Same size, another mtime and content
+    _write_profiles(big_config, 2000, region="eu-west-1")
+    assert os.path.getsize(big_config) == stat.st_size
+    assert ProfileIndex(big_config, index_dir).get_section("profile p00010")["region"] == "eu-west-1"
+    assert len(rebuilds) == 2
+
+    # Another size, the sections moved
+    _write_profiles(big_config, 1500, region="eu-central-1")
+    index = ProfileIndex(big_config, index_dir)
+    assert index.get_section("profile p01499")["region"] == "eu-central-1"
+    assert index.get_section("profile p01500") is None
+    assert len(rebuilds) == 3
@@ -0,0 +1,88 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import os
+
+from configparser import ConfigParser
+
+from conftest import run_python
+from stand_in import account_id, role_name
+
+ROLE_ARN = "arn:aws:iam::{}:role/{}".format(account_id(0), role_name(0))
+
+PRE_ASSUME = "from aws_sso_magic.proxy_credentials import pre_assume_proxy_roles; print(pre_assume_proxy_roles())"
+
+# The credentials the SDKs resolve for the profile p
+RESOLVE = """
+import json
+from botocore.session import Session
+credentials = Session(profile="p").get_credentials()
+print(json.dumps({"method": credentials.method, "access_key": credentials.get_frozen_credentials().access_key}))
+"""
+
+def _credentials(home):
+    config = ConfigParser()
+    config.read(os.path.join(home, ".aws", "credentials"))
+    return config
+
+def _write_credentials(home, config):
+    with open(os.path.join(home, ".aws", "credentials"), "w") as f:
+        config.write(f)
+
+def _expire(home):
+    # The pre-assumed credentials and their cache entry as they are an hour later
+    config = _credentials(home)
+    config.set("p-pre-assumed", "aws_sso_magic_expiration", "2020-01-01T00:00:00Z")
+    _write_credentials(home, config)
+    cache_dir = os.path.join(home, ".aws-sso-magic", "cache", "credentials")
+    for file_name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, file_name)
+        with open(path) as f:
+            data = json.load(f)
+        data["expiration"] = 1577836800000
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+def test_the_profile_keeps_working_after_the_pre_assumed_credentials_expire(home, stand_in):
+    config = ConfigParser()
+    config.read_dict({
+        "aws-sso": {"aws_access_key_id": "AKIAEXAMPLE", "aws_secret_access_key": "secret", "aws_session_token": "token"},
+        "p": {"source_profile": "aws-sso", "role_arn": ROLE_ARN},
+    })
+    _write_credentials(home, config)
+
+    result = run_python(home, stand_in, PRE_ASSUME)
+    assert result.returncode == 0, result.stdout
+    assert result.stdout.splitlines()[-1] == "1"
+    credentials = _credentials(home)
+    assert dict(credentials.items("p")) == {"source_profile": "aws-sso", "role_arn": ROLE_ARN}
+    pre_assumed = dict(credentials.items("p-pre-assumed"))
+    assert pre_assumed["aws_access_key_id"].startswith("ASIA")
+    assert pre_assumed["aws_sso_magic_role_arn"] == ROLE_ARN
+
+    _expire(home)
+
+    # The SDKs assume the role by themselves, the expired credentials are never used
+    result = run_python(home, stand_in, RESOLVE)
+    assert result.returncode == 0, result.stdout
+    resolved = json.loads(result.stdout.splitlines()[-1])
+    assert resolved["method"] == "assume-role"
+    assert resolved["access_key"] != pre_assumed["aws_access_key_id"]
+
+    # And the next pre-assume assumes the role again instead of taking the expired cache entry
+    result = run_python(home, stand_in, PRE_ASSUME)
+    assert result.returncode == 0, result.stdout
+    refreshed = dict(_credentials(home).items("p-pre-assumed"))
+    assert refreshed["aws_access_key_id"] != pre_assumed["aws_access_key_id"]
+    assert refreshed["aws_sso_magic_expiration"] > "2020-01-01T00:00:00Z"
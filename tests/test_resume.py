@@ -0,0 +1,87 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from configparser import ConfigParser
+
+from conftest import command_environment, run_command, login_args, requires_aws_cli
+from harness import prepare_home
+from stand_in import StandInConfig, StandInServer, DEFAULT_TOKEN
+
+INTERRUPTIONS = 3
+# Pinned with the environment variable to replay a failure
+SEED = int(os.environ.get("AWS_SSO_MAGIC_TEST_SEED", time.time_ns() % 100000))
+GENERATED_CREDENTIALS_SKIPPED = {"default", "aws-sso"}
+
+@pytest.fixture
+def slow_stand_in():
+    # Small pages and some latency, so the discovery takes long enough to interrupt it anywhere
+    server = StandInServer(StandInConfig(accounts=60, roles_per_account=2, page_size=5, latency_ms=5.0, jitter_ms=5.0)).start()
+    yield server
+    server.stop()
+
+def _profiles(home):
+    """The generated profiles of the config file and their credentials sections, the
+    credentials of default and aws-sso change on every login."""
+    config = ConfigParser()
+    config.read(os.path.join(home, ".aws", "config"))
+    credentials = ConfigParser()
+    credentials.read(os.path.join(home, ".aws", "credentials"))
+    return (
+        {section: dict(config.items(section)) for section in config.sections() if section.startswith("profile ")},
+        {section: dict(credentials.items(section)) for section in credentials.sections() if section not in GENERATED_CREDENTIALS_SKIPPED},
+    )
+
+@requires_aws_cli
+def test_resume_after_random_interruptions(slow_stand_in):
+    rng = random.Random(SEED)
+    homes = []
+    try:
+        reference_home = prepare_home(DEFAULT_TOKEN)
+        homes.append(reference_home)
+        started = time.monotonic()
+        result = run_command(reference_home, slow_stand_in, *login_args())
+        duration = time.monotonic() - started
+        assert result.returncode == 0, result.stdout
+        reference = _profiles(reference_home)
+        assert len(reference[0]) > 100
+
+        for i in range(INTERRUPTIONS):
+            home = prepare_home(DEFAULT_TOKEN)
+            homes.append(home)
+            delay = rng.uniform(0.1, duration)
+            sig = rng.choice([signal.SIGINT, signal.SIGKILL])
+            context = f"seed {SEED}, interruption {i} after {delay:.2f}s with {sig.name}"
+
+            process = subprocess.Popen([sys.executable, "-m", "aws_sso_magic"] + login_args(),
+                                       env=command_environment(home, slow_stand_in),
+                                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            time.sleep(delay)
+            process.send_signal(sig)
+            process.wait(60)
+
+            result = run_command(home, slow_stand_in, *login_args(), "--resume")
+            assert result.returncode == 0, f"{context}\n{result.stdout}"
+            assert _profiles(home) == reference, context
+    finally:
+        for home in homes:
+            shutil.rmtree(home, ignore_errors=True)
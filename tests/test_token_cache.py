@@ -0,0 +1,93 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import hashlib
+import json
+import os
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from aws_sso_magic.token_cache import SSOTokenCache
+
+START_URL = "https://example.awsapps.com/start"
+
+def _expires_at(delta):
+    return (datetime.now(timezone.utc) + delta).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _write(cache_dir, key, data):
+    # Named like the AWS CLI does, sha1 of the sso-session name or of the start URL
+    path = os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
+
+def _token(access_token, delta, region="us-east-1", start_url=START_URL):
+    return {"startUrl": start_url, "region": region, "accessToken": access_token, "expiresAt": _expires_at(delta)}
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    path = tmp_path / "cache"
+    path.mkdir()
+    return str(path)
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "config"
+    path.write_text("".join("[sso-session {}]\nsso_start_url = {}\nsso_region = us-east-1\n\n".format(name, START_URL) for name in ["admin", "readonly"]))
+    return str(path)
+
+def test_two_sessions_on_the_same_start_url(cache_dir, config_path):
+    admin = _write(cache_dir, "admin", _token("admin", timedelta(hours=1)))
+    readonly = _write(cache_dir, "readonly", _token("readonly", timedelta(hours=8)))
+    cache = SSOTokenCache(cache_dir, config_path)
+
+    assert cache.lookup(start_url=START_URL, session_name="admin").path == admin
+    assert cache.lookup(start_url=START_URL, session_name="readonly").path == readonly
+    # Without a session the freshest token of the start URL
+    assert cache.lookup(start_url=START_URL).path == readonly
+    assert {t.session_name for t in cache.by_start_url[START_URL]} == {"admin", "readonly"}
+
+def test_expired_tokens_are_skipped(cache_dir, config_path):
+    expired = _write(cache_dir, "admin", _token("admin", timedelta(hours=-1)))
+    legacy = _write(cache_dir, START_URL, _token("legacy", timedelta(minutes=30)))
+    cache = SSOTokenCache(cache_dir, config_path)
+
+    # The token of the session expired, another one of its start URL is still valid
+    assert cache.lookup(start_url=START_URL, session_name="admin").path == legacy
+    assert cache.latest(start_url=START_URL, session_name="admin").path == legacy
+    assert cache.lookup(start_url=START_URL, session_name="admin", min_valid=timedelta(hours=1)) is None
+    assert cache.latest(start_url=START_URL, session_name="admin", region="us-east-1").path in [expired, legacy]
+    assert cache.lookup(start_url=START_URL, region="eu-west-1") is None
+
+def test_scan_picks_up_the_files_written_by_the_aws_cli(cache_dir, config_path):
+    cache = SSOTokenCache(cache_dir, config_path)
+    assert cache.lookup(start_url=START_URL, session_name="admin") is None
+
+    # A client registration and a token of an sso-session, as the AWS CLI v2 writes them
+    _write(cache_dir, "botocore-client-id-us-east-1", {"clientId": "id", "clientSecret": "secret", "expiresAt": _expires_at(timedelta(days=90))})
+    token = _token("admin", timedelta(hours=8))
+    token.update({"clientId": "id", "clientSecret": "secret", "refreshToken": "refresh", "registrationExpiresAt": _expires_at(timedelta(days=90))})
+    path = _write(cache_dir, "admin", token)
+    # And a legacy one with the expiration format of the AWS CLI v1
+    _write(cache_dir, "https://other.awsapps.com/start", dict(_token("other", timedelta(hours=8), start_url="https://other.awsapps.com/start"),
+                                                               expiresAt=(datetime.now(timezone.utc) + timedelta(hours=8)).strftime("%Y-%m-%dT%H:%M:%SUTC")))
+    cache.scan()
+
+    found = cache.lookup(start_url=START_URL, session_name="admin")
+    assert found.path == path
+    assert found.session_name == "admin"
+    assert found.access_token == "admin"
+    assert cache.lookup(start_url="https://other.awsapps.com/start").access_token == "other"
+    assert len(cache.tokens) == 2
@@ -0,0 +1,90 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import shutil
+import textwrap
+import threading
+
+from configparser import ConfigParser
+
+from aws_sso_magic.transaction import config_transaction, get_current_transaction
+from conftest import run_python
+from harness import SSO_START_URL, SSO_REGION
+
+def _sections(path):
+    config = ConfigParser()
+    config.read(path)
+    return {section: dict(config.items(section)) for section in config.sections()}
+
+def test_threads_get_their_own_transaction(tmp_path):
+    path = str(tmp_path / "config")
+    opened = threading.Event()
+    committed = threading.Event()
+    seen = {}
+
+    def other_thread():
+        opened.wait()
+        seen["current"] = get_current_transaction()
+        with config_transaction() as transaction:
+            seen["transaction"] = transaction
+            transaction.set_section(path, "profile other", {"region": "eu-west-1"})
+        committed.set()
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    with config_transaction() as transaction:
+        transaction.set_section(path, "profile main", {"region": "us-east-1"})
+        opened.set()
+        committed.wait(10)
+        # The other thread committed its own section, the one of this thread is still pending
+        assert _sections(path) == {"profile other": {"region": "eu-west-1"}}
+        with config_transaction() as nested:
+            assert nested is transaction
+    thread.join()
+
+    assert seen["current"] is None
+    assert seen["transaction"] is not transaction
+    assert _sections(path) == {
+        "profile other": {"region": "eu-west-1"},
+        "profile main": {"region": "us-east-1"},
+    }
+    assert get_current_transaction() is None
+
+def test_configs_read_from_the_same_path_keep_their_own_snapshot(tmp_path):
+    path = str(tmp_path / "config")
+    with open(path, "w") as f:
+        f.write("[a]\nkey = 1\n\n[b]\nkey = 1\n")
+
+    with config_transaction() as transaction:
+        first = transaction.read(path)
+        second = transaction.read(path)
+        second.set("b", "key", "2")
+        transaction.record(path, second)
+        # Diffed against its own read, the first config doesn't revert the change of the second
+        first.set("a", "key", "2")
+        transaction.record(path, first)
+
+    assert _sections(path) == {"a": {"key": "2"}, "b": {"key": "2"}}
+
+def test_write_profiles_creates_the_aws_directory(home):
+    shutil.rmtree(os.path.join(home, ".aws"))
+    result = run_python(home, None, textwrap.dedent("""
+        from aws_sso_magic.api import SsoMagic, Profile
+        print(SsoMagic().write_profiles([Profile("p", "a", "000000000000", "Role0", "us-east-1", {!r}, {!r})]))
+    """).format(SSO_START_URL, SSO_REGION))
+
+    assert result.returncode == 0, result.stdout
+    assert result.stdout.splitlines()[-1] == "1"
+    assert "profile p" in _sections(os.path.join(home, ".aws", "config"))
+    assert "p" in _sections(os.path.join(home, ".aws", "credentials"))
@@ -0,0 +1,61 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import subprocess
+import sys
+import time
+
+from configparser import ConfigParser
+
+from conftest import command_environment, run_command, login_args, requires_aws_cli
+
+# Time of use on top of the startup of the interpreter, with the cached role credentials,
+# a slow machine can raise it with the environment variable
+USE_BUDGET_SECONDS = float(os.environ.get("AWS_SSO_MAGIC_USE_BUDGET_MS", "100")) / 1000
+RUNS = 7
+# Nothing listens there, a call to AWS SSO would fail the command
+OFFLINE_ENDPOINT = "http://127.0.0.1:9"
+
+def _best_time(args, env):
+    """The fastest of several runs, the others are slowed down by the machine."""
+    best = None
+    for _ in range(RUNS):
+        started = time.monotonic()
+        result = subprocess.run(args, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        elapsed = time.monotonic() - started
+        assert result.returncode == 0, result.stdout
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+@requires_aws_cli
+def test_use_switches_offline_within_the_startup_budget(home, stand_in):
+    result = run_command(home, stand_in, *login_args())
+    assert result.returncode == 0, result.stdout
+    # Fills the credentials cache of the profile
+    result = run_command(home, stand_in, "use", "acct0001-role1")
+    assert result.returncode == 0, result.stdout
+    credentials = ConfigParser()
+    credentials.read(os.path.join(home, ".aws", "credentials"))
+    access_key_id = credentials.get("default", "aws_access_key_id")
+    result = run_command(home, stand_in, "use", "acct0000-role0")
+    assert result.returncode == 0, result.stdout
+
+    env = command_environment(home, None, AWS_ENDPOINT_URL_SSO=OFFLINE_ENDPOINT, AWS_ENDPOINT_URL_STS=OFFLINE_ENDPOINT)
+    startup = _best_time([sys.executable, "-c", "pass"], env)
+    elapsed = _best_time([sys.executable, "-m", "aws_sso_magic", "use", "acct0001-role1"], env)
+    assert elapsed - startup < USE_BUDGET_SECONDS, f"use took {elapsed:.3f}s, {startup:.3f}s of them starting the interpreter"
+
+    credentials.read(os.path.join(home, ".aws", "credentials"))
+    assert credentials.get("default", "aws_access_key_id") == access_key_id
+    assert credentials.get("aws-sso", "aws_access_key_id") == access_key_id
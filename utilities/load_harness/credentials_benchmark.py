@@ -0,0 +1,90 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""Benchmark of the SDK credential loading time against the size of the credentials file.
+
+Every SDK process parses the whole config and credentials files to resolve a profile,
+so this measures how long a new botocore session takes to load the credentials of
+the default profile when the credentials file has N child profiles like the ones
+written by the login command (source_profile plus role_arn). It shows what the
+materialize policies save. Example:
+
+    python utilities/load_harness/credentials_benchmark.py --profiles 0 100 1000 5000 --runs 20
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from harness import percentile
+
+def write_files(directory, num_profiles):
+    config_path = os.path.join(directory, "config")
+    credentials_path = os.path.join(directory, "credentials")
+    with open(config_path, "w") as f:
+        f.write("[default]\nregion = us-east-1\n")
+    with open(credentials_path, "w") as f:
+        f.write("[default]\naws_access_key_id = AKIAEXAMPLE\naws_secret_access_key = secret\naws_session_token = token\n\n")
+        f.write("[aws-sso]\naws_access_key_id = AKIAEXAMPLE\naws_secret_access_key = secret\naws_session_token = token\n\n")
+        for i in range(num_profiles):
+            f.write("[acct{:04d}-role{}]\nsource_profile = aws-sso\nrole_arn = arn:aws:iam::{:012d}:role/Proxy\n\n".format(i // 2, i % 2, i // 2))
+    return config_path, credentials_path
+
+def load_credentials(config_path, credentials_path):
+    from botocore.session import Session
+    started = time.monotonic()
+    session = Session()
+    session.set_config_variable("config_file", config_path)
+    session.set_config_variable("credentials_file", credentials_path)
+    session.set_config_variable("profile", "default")
+    credentials = session.get_credentials()
+    elapsed = time.monotonic() - started
+    assert credentials.access_key == "AKIAEXAMPLE"
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="SDK credential loading time against the credentials file size")
+    parser.add_argument("--profiles", type=int, nargs="+", default=[0, 100, 1000, 5000], help="Numbers of child profiles to measure")
+    parser.add_argument("--runs", type=int, default=20, help="Sessions created per size")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    # Imported and warmed up once, only the parsing of the files is measured
+    directory = tempfile.mkdtemp(prefix="aws-sso-magic-credentials-")
+    try:
+        load_credentials(*write_files(directory, 0))
+        results = []
+        for num_profiles in args.profiles:
+            config_path, credentials_path = write_files(directory, num_profiles)
+            timings = [load_credentials(config_path, credentials_path) for _ in range(args.runs)]
+            results.append({
+                "profiles": num_profiles,
+                "file_bytes": os.path.getsize(credentials_path),
+                "p50_ms": percentile(timings, 50) * 1000,
+                "p90_ms": percentile(timings, 90) * 1000,
+            })
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("{:>9} {:>11} {:>9} {:>9}".format("Profiles", "File bytes", "p50 ms", "p90 ms"))
+    for result in results:
+        print("{profiles:>9} {file_bytes:>11} {p50_ms:>9.2f} {p90_ms:>9.2f}".format(**result))
+
+if __name__ == "__main__":
+    main()
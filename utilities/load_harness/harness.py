@@ -0,0 +1,163 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""End-to-end load harness for aws-sso-magic against the local stand-in server.
+
+Every run gets its own temporary HOME with an sso-session, a seeded SSO token
+cache and the aws-sso-magic config, then executes the login command with the
+endpoint overrides pointing at the stand-in. Example:
+
+    python utilities/load_harness/harness.py --accounts 1000 --roles 3 --runs 5 --parallel 2
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from stand_in import StandInServer, account_name, add_config_arguments, config_from_args, role_name
+
+SSO_SESSION = "stand-in"
+SSO_START_URL = "https://stand-in.awsapps.com/start"
+SSO_REGION = "us-east-1"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+def default_profile_name():
+    return "{}-{}".format(account_name(0), role_name(0)).lower()
+
+def prepare_home(access_token, cache_key=None):
+    home = tempfile.mkdtemp(prefix="aws-sso-magic-load-")
+    aws_dir = os.path.join(home, ".aws")
+    os.makedirs(os.path.join(aws_dir, "sso", "cache"))
+    os.makedirs(os.path.join(home, ".aws-sso-magic"))
+    with open(os.path.join(aws_dir, "config"), "w") as f:
+        f.write("[sso-session {}]\nsso_start_url = {}\nsso_region = {}\nsso_registration_scopes = sso:account:access\n\n".format(
+            SSO_SESSION, SSO_START_URL, SSO_REGION))
+        f.write("[profile {}]\nsso_session = {}\nsso_start_url = {}\nsso_region = {}\nregion = {}\n".format(
+            SSO_SESSION, SSO_SESSION, SSO_START_URL, SSO_REGION, SSO_REGION))
+    with open(os.path.join(home, ".aws-sso-magic", "config"), "w") as f:
+        f.write("[default-proxy-role-name]\nproxy_role_name = {}\n".format(role_name(0)))
+    expires_at = (datetime.now(timezone.utc) + timedelta(hours=8)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    token = {"startUrl": SSO_START_URL, "region": SSO_REGION, "accessToken": access_token, "expiresAt": expires_at}
+    cache_key = hashlib.sha1((cache_key or SSO_START_URL).encode("utf-8")).hexdigest()
+    with open(os.path.join(aws_dir, "sso", "cache", "{}.json".format(cache_key)), "w") as f:
+        json.dump(token, f)
+    return home
+
+def run_login(command, extra_args, server, keep_home, cache_key=None):
+    home = prepare_home(server.config.access_token, cache_key)
+    env = dict(os.environ)
+    env.update(server.endpoint_environment())
+    env.update({
+        "HOME": home,
+        "USERPROFILE": home,
+        "AWS_DEFAULT_REGION": SSO_REGION,
+        "CLI_NO_COLOR": "1",
+    })
+    for var in ["AWS_PROFILE", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN", "AWS_CONFIG_FILE", "AWS_SHARED_CREDENTIALS_FILE"]:
+        env.pop(var, None)
+    args = shlex.split(command) + ["login", "--sso-session", SSO_SESSION, "--profile", default_profile_name()] + extra_args
+    started = time.monotonic()
+    result = subprocess.run(args, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    elapsed = time.monotonic() - started
+    if not keep_home:
+        shutil.rmtree(home, ignore_errors=True)
+    return elapsed, result.returncode, result.stdout.decode("utf-8", "replace"), home
+
+def report(run_times, failures, snapshot, as_json):
+    total_requests = sum(len(v) for v in snapshot["latencies"].values())
+    summary = {
+        "runs": len(run_times),
+        "failures": failures,
+        "run_seconds": {
+            "p50": percentile(run_times, 50),
+            "p90": percentile(run_times, 90),
+            "p99": percentile(run_times, 99),
+            "max": max(run_times) if run_times else 0.0,
+        },
+        "requests": total_requests,
+        "requests_per_second": total_requests / snapshot["elapsed"] if snapshot["elapsed"] else 0.0,
+        "operations": {},
+    }
+    for operation, latencies in sorted(snapshot["latencies"].items()):
+        summary["operations"][operation] = {
+            "count": len(latencies),
+            "throttled": snapshot["throttled"].get(operation, 0),
+            "errors": snapshot["errors"].get(operation, 0),
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p90_ms": percentile(latencies, 90) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+    if as_json:
+        print(json.dumps(summary, indent=2))
+        return
+    print("Runs: {runs} (failures: {failures})".format(**summary))
+    print("Run time p50/p90/p99/max: {p50:.3f}s / {p90:.3f}s / {p99:.3f}s / {max:.3f}s".format(**summary["run_seconds"]))
+    print("Requests: {} ({:.1f} req/s)".format(summary["requests"], summary["requests_per_second"]))
+    header = "{:<26} {:>8} {:>9} {:>7} {:>9} {:>9} {:>9}".format("Operation", "Count", "Throttled", "Errors", "p50 ms", "p90 ms", "p99 ms")
+    print(header)
+    for operation, values in summary["operations"].items():
+        print("{:<26} {count:>8} {throttled:>9} {errors:>7} {p50_ms:>9.2f} {p90_ms:>9.2f} {p99_ms:>9.2f}".format(operation, **values))
+
+def main():
+    parser = argparse.ArgumentParser(description="aws-sso-magic end-to-end load harness")
+    add_config_arguments(parser)
+    parser.add_argument("--runs", type=int, default=1, help="Number of login runs")
+    parser.add_argument("--parallel", type=int, default=1, help="Number of login runs executed at the same time")
+    parser.add_argument("--command", default="{} -m aws_sso_magic".format(shlex.quote(sys.executable)), help="Command used to launch aws-sso-magic")
+    parser.add_argument("--login-args", default="", help="Extra arguments for the login command")
+    parser.add_argument("--session-cache", action="store_true", help="Seed the token cache keyed by the sso-session name instead of the start URL")
+    parser.add_argument("--keep-home", action="store_true", help="Keep the temporary HOME directories for inspection")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--show-output", action="store_true", help="Print the output of failed runs")
+    args = parser.parse_args()
+
+    server = StandInServer(config_from_args(args)).start()
+    extra_args = shlex.split(args.login_args)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as executor:
+            results = list(executor.map(
+                lambda _: run_login(args.command, extra_args, server, args.keep_home, SSO_SESSION if args.session_cache else None),
+                range(args.runs)))
+        snapshot = server.stats.snapshot()
+    finally:
+        server.stop()
+
+    failures = 0
+    for elapsed, returncode, output, home in results:
+        if returncode != 0:
+            failures += 1
+            if args.show_output:
+                print("Run failed ({}) in {}:\n{}".format(returncode, home, output), file=sys.stderr)
+    report([r[0] for r in results], failures, snapshot, args.json)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+# Copyright 2020 Javier Ortiz
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""Local HTTP stand-in for the AWS SSO portal, EKS and STS endpoints.
+
+Point the tool at it with the AWS_ENDPOINT_URL_SSO, AWS_ENDPOINT_URL_EKS and
+AWS_ENDPOINT_URL_STS environment variables. Run it alone with:
+
+    python utilities/load_harness/stand_in.py --accounts 500 --roles 4
+"""
+
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+import uuid
+
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+DEFAULT_TOKEN = "stand-in-access-token"
+STS_NAMESPACE = "https://sts.amazonaws.com/doc/2011-06-15/"
+
+StandInConfig = namedtuple("StandInConfig", [
+    "accounts",
+    "roles_per_account",
+    "clusters",
+    "page_size",
+    "latency_ms",
+    "jitter_ms",
+    "throttle_rate",
+    "max_rps",
+    "access_token",
+])
+StandInConfig.__new__.__defaults__ = (100, 3, 2, 20, 0.0, 0.0, 0.0, 0.0, DEFAULT_TOKEN)
+
+
+def account_id(index):
+    return "{:012d}".format(100000000000 + index)
+
+def account_name(index):
+    return "acct{:04d}".format(index)
+
+def role_name(index):
+    return "Role{}".format(index)
+
+def cluster_name(index):
+    return "cluster{:02d}".format(index)
+
+
+class TokenBucket:
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        if not self.rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.latencies = defaultdict(list)
+        self.throttled = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def record(self, operation, status, elapsed, throttled=False):
+        with self._lock:
+            self.latencies[operation].append(elapsed)
+            if throttled:
+                self.throttled[operation] += 1
+            elif status >= 400:
+                self.errors[operation] += 1
+
+    def reset(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self.latencies.clear()
+            self.throttled.clear()
+            self.errors.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "elapsed": time.monotonic() - self.started,
+                "latencies": {k: list(v) for k, v in self.latencies.items()},
+                "throttled": dict(self.throttled),
+                "errors": dict(self.errors),
+            }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        started = time.monotonic()
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        operation, handler = self._route(method, url.path, body)
+        if self.config.latency_ms or self.config.jitter_ms:
+            time.sleep((self.config.latency_ms + random.uniform(0, self.config.jitter_ms)) / 1000.0)
+        throttled = False
+        if handler is None:
+            status = self._send_json(404, {"message": "Unknown operation {} {}".format(method, url.path)})
+        elif self._throttled():
+            throttled = True
+            status = self._send_throttle(operation)
+        else:
+            status = handler(query, body)
+        self.server.stats.record(operation, status, time.monotonic() - started, throttled)
+
+    def _route(self, method, path, body):
+        if path == "/assignment/accounts":
+            return "sso:ListAccounts", self._list_accounts
+        if path == "/assignment/roles":
+            return "sso:ListAccountRoles", self._list_account_roles
+        if path == "/federation/credentials":
+            return "sso:GetRoleCredentials", self._get_role_credentials
+        if path == "/logout" and method == "POST":
+            return "sso:Logout", self._logout
+        if path == "/clusters":
+            return "eks:ListClusters", self._list_clusters
+        if path.startswith("/clusters/"):
+            return "eks:DescribeCluster", self._describe_cluster
+        if path == "/" and method == "POST":
+            action = parse_qs(body).get("Action", [""])[0]
+            if action == "GetCallerIdentity":
+                return "sts:GetCallerIdentity", self._get_caller_identity
+            if action == "AssumeRole":
+                return "sts:AssumeRole", self._assume_role
+        return "unknown:{}".format(path), None
+
+    def _throttled(self):
+        if self.config.throttle_rate and random.random() < self.config.throttle_rate:
+            return True
+        return not self.server.bucket.take()
+
+    # Responses
+
+    def _send(self, status, payload, content_type, headers=None):
+        data = payload.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("x-amzn-RequestId", str(uuid.uuid4()))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        return status
+
+    def _send_json(self, status, payload, headers=None):
+        return self._send(status, json.dumps(payload), "application/json", headers)
+
+    def _send_xml(self, status, payload):
+        return self._send(status, payload, "text/xml")
+
+    def _send_throttle(self, operation):
+        if operation.startswith("sts:"):
+            return self._send_xml(400,
+                "<ErrorResponse xmlns=\"{}\"><Error><Type>Sender</Type><Code>Throttling</Code>"
+                "<Message>Rate exceeded</Message></Error><RequestId>{}</RequestId></ErrorResponse>".format(STS_NAMESPACE, uuid.uuid4()))
+        error_type = "ThrottlingException" if operation.startswith("eks:") else "TooManyRequestsException"
+        return self._send_json(429, {"message": "Rate exceeded"}, {"x-amzn-ErrorType": error_type})
+
+    def _unauthorized(self):
+        return self._send_json(401, {"message": "Session token not found or invalid"}, {"x-amzn-ErrorType": "UnauthorizedException"})
+
+    def _authorized(self):
+        return self.headers.get("x-amz-sso_bearer_token") == self.config.access_token
+
+    def _page(self, items, query, max_key, token_key):
+        start = int(query.get(token_key) or 0)
+        size = min(int(query.get(max_key) or self.config.page_size), self.config.page_size)
+        end = start + size
+        return items[start:end], (str(end) if end < len(items) else None)
+
+    # SSO portal
+
+    def _list_accounts(self, query, body):
+        if not self._authorized():
+            return self._unauthorized()
+        indexes, next_token = self._page(range(self.config.accounts), query, "max_result", "next_token")
+        payload = {"accountList": [
+            {"accountId": account_id(i), "accountName": account_name(i), "emailAddress": "{}@example.com".format(account_name(i))}
+            for i in indexes
+        ]}
+        if next_token:
+            payload["nextToken"] = next_token
+        return self._send_json(200, payload)
+
+    def _list_account_roles(self, query, body):
+        if not self._authorized():
+            return self._unauthorized()
+        indexes, next_token = self._page(range(self.config.roles_per_account), query, "max_result", "next_token")
+        payload = {"roleList": [{"roleName": role_name(i), "accountId": query.get("account_id")} for i in indexes]}
+        if next_token:
+            payload["nextToken"] = next_token
+        return self._send_json(200, payload)
+
+    def _get_role_credentials(self, query, body):
+        if not self._authorized():
+            return self._unauthorized()
+        expiration = datetime.now(timezone.utc) + timedelta(hours=1)
+        return self._send_json(200, {"roleCredentials": {
+            "accessKeyId": "ASIA{}".format(uuid.uuid4().hex[:16].upper()),
+            "secretAccessKey": uuid.uuid4().hex,
+            "sessionToken": uuid.uuid4().hex * 4,
+            "expiration": int(expiration.timestamp() * 1000),
+        }})
+
+    def _logout(self, query, body):
+        if not self._authorized():
+            return self._unauthorized()
+        return self._send_json(200, {})
+
+    # EKS
+
+    def _list_clusters(self, query, body):
+        indexes, next_token = self._page(range(self.config.clusters), query, "maxResults", "nextToken")
+        payload = {"clusters": [cluster_name(i) for i in indexes]}
+        if next_token:
+            payload["nextToken"] = next_token
+        return self._send_json(200, payload)
+
+    def _describe_cluster(self, query, body):
+        name = unquote(self.path.split("?")[0].rsplit("/", 1)[-1])
+        if name not in [cluster_name(i) for i in range(self.config.clusters)]:
+            return self._send_json(404, {"message": "No cluster found for name: {}.".format(name)}, {"x-amzn-ErrorType": "ResourceNotFoundException"})
+        return self._send_json(200, {"cluster": {
+            "name": name,
+            "arn": "arn:aws:eks:us-east-1:{}:cluster/{}".format(account_id(0), name),
+            "endpoint": "https://{}.stand-in.local".format(name),
+            "status": "ACTIVE",
+            "version": "1.27",
+            "certificateAuthority": {"data": base64.b64encode(b"stand-in-ca").decode("ascii")},
+        }})
+
+    # STS
+
+    def _get_caller_identity(self, query, body):
+        return self._send_xml(200,
+            "<GetCallerIdentityResponse xmlns=\"{ns}\"><GetCallerIdentityResult>"
+            "<Arn>arn:aws:sts::{account}:assumed-role/{role}/stand-in</Arn>"
+            "<UserId>AROASTANDIN:stand-in</UserId><Account>{account}</Account>"
+            "</GetCallerIdentityResult><ResponseMetadata><RequestId>{request}</RequestId></ResponseMetadata>"
+            "</GetCallerIdentityResponse>".format(ns=STS_NAMESPACE, account=account_id(0), role=role_name(0), request=uuid.uuid4()))
+
+    def _assume_role(self, query, body):
+        params = {k: v[0] for k, v in parse_qs(body).items()}
+        role_arn = params.get("RoleArn", "")
+        expiration = (datetime.now(timezone.utc) + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return self._send_xml(200,
+            "<AssumeRoleResponse xmlns=\"{ns}\"><AssumeRoleResult><Credentials>"
+            "<AccessKeyId>ASIA{key}</AccessKeyId><SecretAccessKey>{secret}</SecretAccessKey>"
+            "<SessionToken>{token}</SessionToken><Expiration>{expiration}</Expiration></Credentials>"
+            "<AssumedRoleUser><AssumedRoleId>AROASTANDIN:{session}</AssumedRoleId><Arn>{arn}</Arn></AssumedRoleUser>"
+            "</AssumeRoleResult><ResponseMetadata><RequestId>{request}</RequestId></ResponseMetadata>"
+            "</AssumeRoleResponse>".format(
+                ns=STS_NAMESPACE,
+                key=uuid.uuid4().hex[:16].upper(),
+                secret=uuid.uuid4().hex,
+                token=uuid.uuid4().hex * 4,
+                expiration=expiration,
+                session=params.get("RoleSessionName", "stand-in"),
+                arn=role_arn,
+                request=uuid.uuid4()))
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config, host="127.0.0.1", port=0):
+        super().__init__((host, port), StandInHandler)
+        self.config = config
+        self.stats = Stats()
+        self.bucket = TokenBucket(config.max_rps)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def endpoint_environment(self):
+        return {
+            "AWS_ENDPOINT_URL_SSO": self.url,
+            "AWS_ENDPOINT_URL_EKS": self.url,
+            "AWS_ENDPOINT_URL_STS": self.url,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--accounts", type=int, default=100, help="Number of accounts returned by ListAccounts")
+    parser.add_argument("--roles", type=int, default=3, help="Number of roles per account")
+    parser.add_argument("--clusters", type=int, default=2, help="Number of EKS clusters")
+    parser.add_argument("--page-size", type=int, default=20, help="Maximum items per page")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Fixed latency added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random latency added on top of --latency-ms")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability of answering with a throttling error")
+    parser.add_argument("--max-rps", type=float, default=0.0, help="Throttle requests above this rate (0 disables it)")
+
+def config_from_args(args):
+    return StandInConfig(
+        accounts=args.accounts,
+        roles_per_account=args.roles,
+        clusters=args.clusters,
+        page_size=args.page_size,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        throttle_rate=args.throttle_rate,
+        max_rps=args.max_rps,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SSO/EKS/STS stand-in server")
+    add_config_arguments(parser)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server = StandInServer(config_from_args(args), port=args.port)
+    for key, value in server.endpoint_environment().items():
+        print("export {}={}".format(key, value))
+    print("Access token: {}".format(server.config.access_token))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()